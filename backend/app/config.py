@@ -3,4 +3,70 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-OPENROUTER_API_KEY = os.getenv("OPENAI_API_KEY")
\ No newline at end of file
+OPENROUTER_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Two-stage retrieval: over-fetch candidates, then re-rank them locally
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "15"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+
+# Embedding cache shared across uploads; set to an empty string to disable
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache/")
+# Embedding cache rows kept per embedder version before the oldest are compacted away (~2 KB per row at dim 512)
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "250000"))
+
+# LLM call resilience: per-attempt and overall deadlines, retries, hedging and circuit breaker
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "45"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+
+# Publish the index to memory-mapped files shared by all workers; empty keeps it per-process
+SHARED_INDEX_DIR = os.getenv("SHARED_INDEX_DIR", "")
+
+# Streaming ingest: chunks per embedding batch and batches buffered between parser and indexer
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+INGEST_QUEUE_BATCHES = int(os.getenv("INGEST_QUEUE_BATCHES", "4"))
+
+# Worker processes used to parse multi-file uploads (defaults to the CPU count)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or None
+
+# Collapse near-duplicate chunks (MinHash + LSH) at ingest time
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+
+# Partition the index across this many search worker processes (1 = search in-process).
+# Ignored when SHARED_INDEX_DIR is set.
+SEARCH_SHARDS = int(os.getenv("SEARCH_SHARDS", "1"))
+
+# Admission control for /ask/: concurrency slots, bounded queue and per-client rate limits
+ASK_MAX_CONCURRENCY = int(os.getenv("ASK_MAX_CONCURRENCY", "8"))
+ASK_MAX_QUEUE = int(os.getenv("ASK_MAX_QUEUE", "32"))
+ASK_RATE_PER_CLIENT = float(os.getenv("ASK_RATE_PER_CLIENT", "5"))
+ASK_BURST_PER_CLIENT = float(os.getenv("ASK_BURST_PER_CLIENT", "10"))
+ASK_DEFAULT_DEADLINE_S = float(os.getenv("ASK_DEFAULT_DEADLINE_S", "30"))
+# Reverse proxies whose X-Forwarded-For is trusted to name the client for rate limiting (comma-separated IPs)
+TRUSTED_PROXIES = {ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(",") if ip.strip()}
+
+# Request profiling: admin token for X-Profile requests (empty disables profiling) and slow-request log threshold
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "50"))
+
+# Repeated questions: normalized query -> vector, and per-index (query, k) -> top-k rows (0 disables a level)
+QUERY_VECTOR_CACHE_SIZE = int(os.getenv("QUERY_VECTOR_CACHE_SIZE", "1024"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+
+# Decision step backend: "llm" (remote), "local" (on-box classifier) or "routing" (local unless ambiguous)
+EVALUATOR_BACKEND = os.getenv("EVALUATOR_BACKEND", "llm")
+EVALUATOR_ROUTING_THRESHOLD = float(os.getenv("EVALUATOR_ROUTING_THRESHOLD", "0.75"))
+
+# Answer "is X covered" / "waiting period for X" / "limit for X" from the ingest-time clause fact index.
+# Off by default: the fast path skips the evaluator, so keyword extraction errors reach users unchecked
+CLAUSE_FACTS_ENABLED = os.getenv("CLAUSE_FACTS_ENABLED", "false").lower() == "true"
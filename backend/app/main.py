@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
+from app.config import ADMIN_TOKEN, SLOW_REQUEST_MS, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_STORE_SIZE
+from app.utils.profiling import ProfilingMiddleware, profile_store
 
 app = FastAPI(title="Policy Pundit API", description="AI-powered policy analysis and document processing API")
 
@@ -21,6 +23,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the slow-request log covers the whole request; profiling needs X-Profile plus X-Admin-Token
+profile_store.max_profiles = PROFILE_STORE_SIZE
+app.add_middleware(ProfilingMiddleware, admin_token=ADMIN_TOKEN, slow_request_ms=SLOW_REQUEST_MS,
+                   sample_interval_ms=PROFILE_SAMPLE_INTERVAL_MS)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -57,6 +64,9 @@ except ImportError as e:
 except Exception as e:
     print(f"⚠️ Warning: Error loading document router: {e}")
 
+from app.routers import admin
+app.include_router(admin.router, prefix="/api/v1/admin")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
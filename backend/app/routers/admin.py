@@ -0,0 +1,45 @@
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from typing import Optional
+
+from app.config import ADMIN_TOKEN
+from app.utils.profiling import profile_store, token_matches
+
+router = APIRouter()
+
+def _check_admin(token: Optional[str]):
+    if not token_matches(ADMIN_TOKEN, token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@router.get("/profiles/")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Recently captured request profiles on this worker, newest first"""
+    _check_admin(x_admin_token)
+    return JSONResponse(content={"profiles": profile_store.list()})
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "folded", x_admin_token: Optional[str] = Header(None)):
+    """A stored profile as folded stacks (flamegraph.pl/speedscope), a pstats dump or a text summary.
+
+    Profiles live in the memory of the worker that served the profiled request, so with several
+    workers a lookup routed to another worker returns 404; retry or run one worker while profiling.
+    """
+    _check_admin(x_admin_token)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found on this worker")
+
+    if format == "folded":
+        if profile["folded"] is None:
+            raise HTTPException(status_code=400, detail="Folded stacks are only recorded in sampling mode")
+        return PlainTextResponse(profile["folded"])
+    if format == "pstats":
+        if profile["pstats"] is None:
+            raise HTTPException(status_code=400, detail="pstats dumps are only recorded in deterministic mode")
+        return Response(content=profile["pstats"], media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{profile_id}.pstats"'})
+    if format == "summary":
+        return PlainTextResponse(profile["summary"])
+    if format == "json":
+        return JSONResponse(content={k: v for k, v in profile.items() if k != "pstats"})
+    raise HTTPException(status_code=400, detail="format must be one of ['folded', 'pstats', 'summary', 'json']")
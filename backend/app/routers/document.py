@@ -1,17 +1,43 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
 from fastapi.responses import JSONResponse
-from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 import os
+from contextlib import contextmanager
 import numpy as np
+from app.utils.metrics import metrics
+from app.utils.profiling import stage, record_stage
+from app.config import RERANK_ENABLED, RERANK_CANDIDATES, RERANK_BUDGET_MS, RETRIEVAL_TOP_K, EMBEDDING_CACHE_DIR, SHARED_INDEX_DIR
+from app.config import EMBEDDING_CACHE_MAX_ROWS
+from app.config import INGEST_BATCH_SIZE, INGEST_QUEUE_BATCHES, PARSE_WORKERS, DEDUP_ENABLED, DEDUP_THRESHOLD
+from app.config import SEARCH_SHARDS, QUERY_VECTOR_CACHE_SIZE, RESULT_CACHE_SIZE
+from app.config import EVALUATOR_BACKEND, EVALUATOR_ROUTING_THRESHOLD, CLAUSE_FACTS_ENABLED
+from app.config import ASK_MAX_CONCURRENCY, ASK_MAX_QUEUE, ASK_RATE_PER_CLIENT, ASK_BURST_PER_CLIENT, ASK_DEFAULT_DEADLINE_S
+from app.config import TRUSTED_PROXIES
+from app.services.admission import AdmissionController, Rejected
+
+# Prefer orjson for response rendering when it is installed
+try:
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    import orjson  # noqa: F401
+except ImportError:
+    FastJSONResponse = JSONResponse
 
 # Import services with error handling
 try:
-    from app.services.parser import parse_files
-    from app.services.chunker import adaptive_chunk
-    from app.services.simple_embedder import build_index, retrieve
-    from app.services.logic import evaluate
-    from app.services.output import generate_json
+    from app.services.simple_embedder import SimpleEmbedder, retrieve, get_embedding_cache
+    from app.services.pipeline import ingest_files, ingest_files_parallel, get_parse_pool
+    from app.services.evaluators import get_evaluator
+    from app.services.reranker import rerank
+    from app.services.output import render_result, QueryResult, BatchQueryResult, EVIDENCE_MODES
+    from app.services.shared_index import SharedIndex
+    from app.services.dedup import Deduplicator
+    from app.services.sharded_index import ShardedIndex
+    from app.services import query_cache
+    from app.services.metadata_store import parse_filters
+    query_cache.configure(QUERY_VECTOR_CACHE_SIZE, RESULT_CACHE_SIZE)
+    evaluator = get_evaluator(EVALUATOR_BACKEND, EVALUATOR_ROUTING_THRESHOLD)
     SERVICES_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Some services not available: {e}")
@@ -24,87 +50,346 @@ chunks = []
 metadata = []
 faiss_index = None
 
+# With SHARED_INDEX_DIR set, the index is published to memory-mapped files and
+# every worker process attaches to the latest generation read-only
+shared_index = SharedIndex(SHARED_INDEX_DIR) if SERVICES_AVAILABLE and SHARED_INDEX_DIR else None
+
+def _active_index():
+    """Current index for this worker, following the shared generation when enabled"""
+    global chunks, metadata, faiss_index
+    if shared_index is not None:
+        index = shared_index.current()
+        if index is not None and index is not faiss_index:
+            faiss_index, chunks, metadata = index, index.chunks, index.metadata
+    return faiss_index
+
+ask_admission = AdmissionController(
+    "ask",
+    max_concurrency=ASK_MAX_CONCURRENCY,
+    max_queue=ASK_MAX_QUEUE,
+    rate_per_client=ASK_RATE_PER_CLIENT,
+    burst=ASK_BURST_PER_CLIENT,
+)
+
 class QueryRequest(BaseModel):
     question: str
+    evidence_mode: str = "full"  # full | snippet | ids_only
+    # e.g. {"file_path": "policy.pdf", "page": {"gte": 3, "lte": 10}, "section": ["Exclusions"]}
+    filters: Optional[Dict[str, Any]] = None
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    evidence_mode: str = "full"
+    filters: Optional[Dict[str, Any]] = None
+
+UPLOAD_DIR = "data/uploaded_docs/"
+ALLOWED_EXTENSIONS = ('.pdf', '.docx')
+
+async def _save_upload(file: UploadFile, taken: set = None) -> str:
+    """Write an upload to UPLOAD_DIR; names already in `taken` get a numeric suffix instead of overwriting"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    name = os.path.basename(file.filename)
+    if taken is not None:
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while name in taken:
+            n += 1
+            name = f"{stem}_{n}{ext}"
+        taken.add(name)
+    file_path = os.path.join(UPLOAD_DIR, name)
+    with open(file_path, "wb") as f:
+        f.write(await file.read())
+    return file_path
+
+def _new_index():
+    cache = get_embedding_cache(EMBEDDING_CACHE_DIR, max_rows=EMBEDDING_CACHE_MAX_ROWS) if EMBEDDING_CACHE_DIR else None
+    if SEARCH_SHARDS > 1 and shared_index is None:
+        return ShardedIndex(num_shards=SEARCH_SHARDS, cache=cache)
+    return SimpleEmbedder(cache=cache)
+
+def _new_deduplicator():
+    return Deduplicator(threshold=DEDUP_THRESHOLD) if DEDUP_ENABLED else None
+
+def _discard_index(index):
+    """Release a built index that will never be installed (e.g. a failed upload's shard processes)"""
+    if isinstance(index, ShardedIndex):
+        index.close()
 
-class Evidence(BaseModel):
-    clause_id: str
-    text: str
-    similarity_score: float
-    source: str
-    section: Optional[str] = None
-
-class QueryResult(BaseModel):
-    query: str
-    answer: str
-    evidence: List[Evidence]
-    conditions: List[str]
-    decision_rationale: str
-    confidence: float
-    status: str
-    token_usage: Optional[int] = None
-    processing_time: Optional[float] = None
+def _install_index(index):
+    """Make a freshly built index the one /ask/ answers from"""
+    global chunks, metadata, faiss_index
+    if isinstance(index, ShardedIndex):
+        # Balance before the index takes queries; rows in transit would be invisible to searches
+        index.rebalance()
+    previous = faiss_index
+    faiss_index, chunks, metadata = index, index.chunks, index.metadata
+    if isinstance(previous, ShardedIndex) and previous is not index:
+        # Stop the old shard processes once the requests still searching them are done
+        previous.retire()
+    if shared_index is not None:
+        # Swap the private copy for the read-only shared mapping
+        shared_index.publish(faiss_index)
+        _active_index()
 
 @router.post("/upload/")
 async def upload_document(file: UploadFile = File(...)):
     if not SERVICES_AVAILABLE:
         raise HTTPException(status_code=503, detail="Document processing services not available")
     
-    if not file.filename.endswith(('.pdf', '.docx')):
+    if not file.filename.endswith(ALLOWED_EXTENSIONS):
         raise HTTPException(status_code=400, detail="Only PDF or DOCX files are allowed")
     
-    upload_dir = "data/uploaded_docs/"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
+    with stage("save"):
+        file_path = await _save_upload(file)
     
-    global chunks, metadata, faiss_index
+    index = None
     try:
-        extracted_text = parse_files([file_path])
-        chunks, metadata = adaptive_chunk(extracted_text)
-        faiss_index = build_index(chunks)
+        index = _new_index()
+        with stage("ingest"):
+            # Parsing and embedding block for seconds; keep them off the event loop
+            build_stats = await run_in_threadpool(
+                ingest_files, [file_path], index, batch_size=INGEST_BATCH_SIZE, queue_batches=INGEST_QUEUE_BATCHES,
+                dedup=_new_deduplicator()
+            )
+        if build_stats["errors"] and not build_stats["chunks"]:
+            raise Exception(build_stats["errors"][0]["error"])
+        with stage("install"):
+            _install_index(index)
         
         return JSONResponse(content={
             "message": "Document uploaded successfully",
             "chunks_processed": len(chunks),
-            "filename": file.filename
+            "filename": file.filename,
+            "embedding_cache_hit_ratio": build_stats.get("cache_hit_ratio", 0.0),
+            "dedup": build_stats["dedup"],
+            "index_generation": faiss_index.generation
         })
     except Exception as e:
+        if index is not None and index is not faiss_index:
+            _discard_index(index)
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
+@router.post("/upload/batch/")
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """Upload many PDF/DOCX files, parse them in parallel and build one index"""
+    if not SERVICES_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Document processing services not available")
+    
+    rejected = []
+    file_paths = []
+    # Same-named files in one batch must not overwrite each other on disk
+    taken = set()
+    for file in files:
+        if file.filename.endswith(ALLOWED_EXTENSIONS):
+            file_paths.append(await _save_upload(file, taken))
+        else:
+            rejected.append({"file_path": file.filename, "status": "failed", "error": "Only PDF or DOCX files are allowed",
+                             "chunks": 0, "indexed_chunks": 0, "parse_seconds": None, "embed_seconds": None})
+    
+    index = _new_index()
+    try:
+        with stage("ingest"):
+            build_stats = await run_in_threadpool(
+                ingest_files_parallel, file_paths, index, get_parse_pool(PARSE_WORKERS), INGEST_BATCH_SIZE,
+                dedup=_new_deduplicator()
+            )
+    except Exception:
+        _discard_index(index)
+        raise
+    file_results = build_stats["files"] + rejected
+    if not build_stats["chunks"]:
+        _discard_index(index)
+        raise HTTPException(status_code=422, detail={"message": "No content could be extracted from the uploaded files",
+                                                     "files": file_results})
+    with stage("install"):
+        _install_index(index)
+    
+    return JSONResponse(content={
+        "message": "Documents uploaded successfully",
+        "chunks_processed": len(chunks),
+        "files_processed": sum(1 for f in file_results if f["status"] == "ok"),
+        "files_failed": sum(1 for f in file_results if f["status"] == "failed"),
+        "files": file_results,
+        "embedding_cache_hit_ratio": build_stats["cache_hit_ratio"],
+        "dedup": build_stats["dedup"],
+        "index_generation": faiss_index.generation,
+        "total_seconds": build_stats["total_seconds"]
+    })
+
 @router.get("/status/")
 async def get_status():
     """Get the current status of loaded documents"""
+    _active_index()
     return JSONResponse(content={
         "documents_loaded": len(chunks) > 0,
         "chunks_count": len(chunks),
         "index_built": faiss_index is not None,
-        "services_available": SERVICES_AVAILABLE
+        "services_available": SERVICES_AVAILABLE,
+        "index_generation": faiss_index.generation if faiss_index is not None else None,
+        "shared_index": shared_index is not None
     })
 
-@router.post("/ask/", response_model=QueryResult)
-async def ask_question(request: QueryRequest):
+def _check_evidence_mode(evidence_mode: str):
+    if evidence_mode not in EVIDENCE_MODES:
+        raise HTTPException(status_code=400, detail=f"evidence_mode must be one of {list(EVIDENCE_MODES)}")
+
+def _parse_filters(filters: Optional[Dict[str, Any]]):
+    try:
+        return parse_filters(filters)
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {e}")
+
+@contextmanager
+def _pinned_index():
+    """The active index, kept alive (shard processes included) until the request is done with it"""
+    while True:
+        index = _active_index()
+        if not isinstance(index, ShardedIndex):
+            yield index
+            return
+        # A failed pin means the index was retired after we read it; the replacement is installed by now
+        if index.pin():
+            break
+    try:
+        yield index
+    finally:
+        index.unpin()
+
+def _retrieve(question: str, filters=None, index=None) -> List[dict]:
+    """First-stage retrieval, optionally over-fetching and re-ranking locally"""
+    index = index if index is not None else faiss_index
+    chunks, metadata = index.chunks, index.metadata
+    if not RERANK_ENABLED:
+        with stage("retrieve"):
+            return retrieve(index, chunks, metadata, question, RETRIEVAL_TOP_K, filters)
+    # The re-ranked top-k is cached alongside the index's first-stage results
+    generation = index.generation
+    key = (query_cache.normalize_query(question), RETRIEVAL_TOP_K, filters.key if filters is not None else None, "rerank")
+    cached = index.result_cache.lookup(key, generation)
+    if cached is not None:
+        return [dict(chunk) for chunk in cached]
+    with stage("retrieve"):
+        candidates = retrieve(index, chunks, metadata, question, max(RERANK_CANDIDATES, RETRIEVAL_TOP_K), filters)
+    with stage("rerank"):
+        reranked, info = rerank(question, candidates, k=RETRIEVAL_TOP_K, budget_ms=RERANK_BUDGET_MS)
+    if info["elapsed_ms"] <= RERANK_BUDGET_MS:
+        # Budget fallbacks keep first-stage order and are not worth remembering
+        index.result_cache.store(key, generation, [dict(chunk) for chunk in reranked])
+    return reranked
+
+def _fact_answer(question: str, evidence_mode: str, filters=None, index=None) -> Optional[dict]:
+    """Answer from the ingest-time clause fact index, or None if the question needs the full pipeline"""
+    index = index if index is not None else faiss_index
+    facts = getattr(index, "clause_facts", None)
+    if not CLAUSE_FACTS_ENABLED or not facts:
+        return None
+    with stage("facts"):
+        found = index.answer_from_facts(question, filters)
+    if found is None:
+        metrics.incr("clause_facts.miss")
+        return None
+    metrics.incr("clause_facts.hit")
+    decision, evidence = found
+    with stage("render"):
+        return render_result(decision, evidence, question, evidence_mode)
+
+def _answer(question: str, evidence_mode: str, filters=None, try_facts: bool = True, index=None) -> dict:
+    if try_facts:
+        result = _fact_answer(question, evidence_mode, filters, index)
+        if result is not None:
+            return result
+    retrieved_chunks = _retrieve(question, filters, index)
+
+    # Clean any NaN values from retrieved chunks
+    for chunk in retrieved_chunks:
+        if 'similarity_score' in chunk:
+            if np.isnan(chunk['similarity_score']) or np.isinf(chunk['similarity_score']):
+                chunk['similarity_score'] = 0.0
+
+    with stage("evaluate"):
+        decision = evaluator(question, retrieved_chunks)
+    with stage("render"):
+        return render_result(decision, retrieved_chunks, question, evidence_mode)
+
+def _client_id(http_request: Request) -> str:
+    """Rate-limit identity: the peer address, or the client a trusted proxy forwarded for.
+
+    Client-supplied identifiers are ignored, since rotating them would reset the token bucket.
+    """
+    peer = http_request.client.host if http_request.client else "anonymous"
+    if peer in TRUSTED_PROXIES:
+        # The rightmost hop not added by one of our proxies is the real client
+        hops = [hop.strip() for hop in http_request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if hop not in TRUSTED_PROXIES:
+                return hop
+    return peer
+
+def _deadline(http_request: Request) -> float:
+    """Client's time budget in seconds, from X-Request-Timeout if it sent one"""
+    try:
+        return float(http_request.headers.get("x-request-timeout", ASK_DEFAULT_DEADLINE_S))
+    except ValueError:
+        return ASK_DEFAULT_DEADLINE_S
+
+def _reject(rejected: Rejected):
+    raise HTTPException(status_code=rejected.status_code, detail=rejected.reason,
+                        headers={"Retry-After": str(rejected.retry_after)})
+
+@router.get("/metrics/")
+async def get_metrics():
+    """In-process metrics for this worker"""
+    return JSONResponse(content=metrics.snapshot())
+
+# Responses are built as plain dicts matching QueryResult and rendered directly,
+# so FastAPI skips re-validating them; the model is kept for the OpenAPI schema.
+@router.post("/ask/", response_class=FastJSONResponse, responses={200: {"model": QueryResult}})
+async def ask_question(request: QueryRequest, http_request: Request):
     if not SERVICES_AVAILABLE:
         raise HTTPException(status_code=503, detail="Document processing services not available")
     
-    if not faiss_index or not chunks:
+    if not _active_index() or not chunks:
         raise HTTPException(status_code=400, detail="No document uploaded. Please upload a document first.")
     
+    _check_evidence_mode(request.evidence_mode)
+    filters = _parse_filters(request.filters)
     try:
-        question = request.question
-        retrieved_chunks = retrieve(faiss_index, chunks, metadata, question)
-        
-        # Clean any NaN values from retrieved chunks
-        for chunk in retrieved_chunks:
-            if 'similarity_score' in chunk:
-                if np.isnan(chunk['similarity_score']) or np.isinf(chunk['similarity_score']):
-                    chunk['similarity_score'] = 0.0
-        
-        decision = evaluate(question, retrieved_chunks)
-        result = generate_json(decision, retrieved_chunks, question)
-        
-        return result
+        with _pinned_index() as index:
+            # A fact lookup is a regex match and a dict probe, cheap enough to skip admission and the threadpool
+            result = _fact_answer(request.question, request.evidence_mode, filters, index)
+            if result is None:
+                async with ask_admission.slot(_client_id(http_request), _deadline(http_request)) as waited:
+                    record_stage("queue", waited * 1000.0)
+                    # Off the event loop, so queued requests can still be admitted or shed
+                    result = await run_in_threadpool(_answer, request.question, request.evidence_mode, filters, False,
+                                                     index)
+        return FastJSONResponse(content=result)
+    except Rejected as rejected:
+        _reject(rejected)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+
+@router.post("/ask/batch/", response_class=FastJSONResponse, responses={200: {"model": BatchQueryResult}})
+async def ask_questions(request: BatchQueryRequest, http_request: Request):
+    if not SERVICES_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Document processing services not available")
+    
+    if not _active_index() or not chunks:
+        raise HTTPException(status_code=400, detail="No document uploaded. Please upload a document first.")
+    
+    _check_evidence_mode(request.evidence_mode)
+    filters = _parse_filters(request.filters)
+    try:
+        with _pinned_index() as index:
+            # Every question in the batch costs a rate-limit token, as it would as a separate /ask/
+            async with ask_admission.slot(_client_id(http_request), _deadline(http_request),
+                                          cost=len(request.questions)) as waited:
+                record_stage("queue", waited * 1000.0)
+                results = await run_in_threadpool(
+                    lambda: [_answer(question, request.evidence_mode, filters, index=index) for question in request.questions]
+                )
+        return FastJSONResponse(content={"results": results})
+    except Rejected as rejected:
+        _reject(rejected)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing questions: {str(e)}")
@@ -0,0 +1,136 @@
+"""
+Admission control for request handlers under overload.
+
+Each client gets a token bucket. Admitted requests take one of a fixed number
+of concurrency slots, or wait in a bounded queue. A request is shed early,
+before any retrieval or LLM work, when the queue is full or when its
+estimated wait already exceeds its deadline. Callers turn a Rejected into a
+429/503 with a Retry-After header.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Tuple
+
+from app.utils.metrics import metrics
+
+class Rejected(Exception):
+    """Request was not admitted; carries the HTTP status and a Retry-After hint in seconds"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take `cost` tokens at once; returns (allowed, seconds until that many are available)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, (cost - self.tokens) / self.rate
+
+class AdmissionController:
+    def __init__(self, name: str, max_concurrency: int = 8, max_queue: int = 32,
+                 rate_per_client: float = 5.0, burst: float = 10.0, max_clients: int = 10_000):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.rate_per_client = rate_per_client
+        self.burst = burst
+        self.max_clients = max_clients
+        self._semaphore = None
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.in_flight = 0
+        self.waiting = 0
+        # EWMA of slot hold time, used to predict queueing delay
+        self.service_time = 1.0
+
+    def _bucket(self, client_id: str) -> TokenBucket:
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = self._buckets[client_id] = TokenBucket(self.rate_per_client, self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_id)
+        return bucket
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests admitted but still waiting for a slot"""
+        return max(0, self.in_flight + self.waiting - self.max_concurrency)
+
+    def estimated_wait(self) -> float:
+        """Expected queueing delay for a request that joins the queue now"""
+        return (self.queue_depth + 1) / self.max_concurrency * self.service_time
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"{self.name}.queue_depth", self.queue_depth)
+        metrics.set_gauge(f"{self.name}.in_flight", self.in_flight)
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, deadline: float, cost: int = 1):
+        """Hold a concurrency slot for the duration of the block, or raise Rejected.
+
+        `cost` is the number of questions the request carries; a batch is charged that many tokens.
+        """
+        if self._semaphore is None:
+            # Created lazily so it binds to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        if self.rate_per_client > 0:
+            if cost > self.burst:
+                metrics.incr(f"{self.name}.rejected_rate_limit")
+                raise Rejected(429, f"Request of {cost} questions exceeds the per-client burst of {self.burst:g}",
+                               cost / self.rate_per_client)
+            allowed, retry_after = self._bucket(client_id).take(cost)
+            if not allowed:
+                metrics.incr(f"{self.name}.rejected_rate_limit")
+                raise Rejected(429, "Rate limit exceeded", retry_after)
+
+        start = time.monotonic()
+        if self.in_flight + self.waiting >= self.max_concurrency:
+            if self.queue_depth >= self.max_queue:
+                metrics.incr(f"{self.name}.shed_queue_full")
+                raise Rejected(503, "Server is overloaded", self.estimated_wait())
+            if self.estimated_wait() > deadline:
+                metrics.incr(f"{self.name}.shed_deadline")
+                raise Rejected(503, "Request cannot be served within its deadline", self.estimated_wait())
+
+        # Counted as waiting until it holds a slot, so concurrent arrivals see each other
+        self.waiting += 1
+        self._publish()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=deadline)
+        except asyncio.TimeoutError:
+            metrics.incr(f"{self.name}.shed_timeout")
+            raise Rejected(503, "Request timed out waiting in queue", self.estimated_wait())
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - start
+        metrics.observe(f"{self.name}.wait", waited)
+        self.in_flight += 1
+        self._publish()
+        acquired = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - acquired)
+            metrics.incr(f"{self.name}.admitted")
+            self._publish()
@@ -1,64 +1,103 @@
-from typing import List, Tuple
+from typing import List, Tuple, Iterable, Iterator, Optional
+from itertools import groupby
 import re
 
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+def _split_paragraphs(text: str, offset: int = 0, page: Optional[int] = None,
+                      section: Optional[str] = None) -> Iterator[Tuple[str, int, Optional[int], Optional[str]]]:
+    """Yield (paragraph, start offset, page, section) for each blank-line separated paragraph"""
+    start = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        yield text[start:match.start()], offset + start, page, section
+        start = match.end()
+    yield text[start:], offset + start, page, section
+
+def iter_chunks(paragraphs: Iterable[Tuple[str, int, Optional[int], Optional[str]]], file_path: str,
+                max_tokens: int = 512, overlap: float = 0.15) -> Iterator[Tuple[str, dict]]:
+    """Pack a stream of (paragraph, start offset, page, section) into overlapping chunks"""
+    current_chunk = ""
+    current_tokens = 0
+    current_start = 0
+    current_page = None
+    current_section = None
+    chunk_id = 0
+
+    def chunk_meta(start_pos, page, section):
+        meta = {
+            "file_path": file_path,
+            "chunk_id": f"{file_path}_{chunk_id}",
+            "start_pos": start_pos,
+            "page": page
+        }
+        if section is not None:
+            meta["section"] = section
+        return meta
+
+    for para, para_start, page, section in paragraphs:
+        para = para.strip()
+        if not para:
+            continue
+        token_count = len(para.split())
+
+        if current_chunk and section != current_section:
+            # Chunks never straddle a heading, so each one carries the one section it belongs to
+            yield current_chunk, chunk_meta(current_start, current_page, current_section)
+            chunk_id += 1
+            current_chunk = ""
+            current_tokens = 0
+
+        if current_tokens + token_count > max_tokens:
+            if current_chunk:
+                yield current_chunk, chunk_meta(current_start, current_page, current_section)
+                overlap_size = int(len(current_chunk.split()) * overlap)
+                overlap_text = " ".join(current_chunk.split()[-overlap_size:])
+                current_chunk = overlap_text
+                current_tokens = len(overlap_text.split())
+                current_start = max(0, para_start - len(overlap_text))
+                chunk_id += 1
+
+            if token_count > max_tokens:
+                words = para.split()
+                while words:
+                    chunk_words = words[:max_tokens]
+                    yield " ".join(chunk_words), chunk_meta(para_start, page, section)
+                    words = words[max_tokens - int(max_tokens * overlap):]
+                    chunk_id += 1
+            else:
+                current_chunk = para
+                current_tokens = token_count
+                current_start = para_start
+                current_page = page
+                current_section = section
+        else:
+            if not current_chunk:
+                current_start = para_start
+                current_page = page
+                current_section = section
+            current_chunk += "\n\n" + para if current_chunk else para
+            current_tokens += token_count
+
+    if current_chunk:
+        yield current_chunk, chunk_meta(current_start, current_page, current_section)
+
+def stream_chunks(pages: Iterable[dict], max_tokens: int = 512, overlap: float = 0.15) -> Iterator[Tuple[str, dict]]:
+    """Chunk a stream of {"file_path", "page", "text"[, "section"]} pages without materializing whole documents"""
+    for file_path, doc_pages in groupby(pages, key=lambda page: page["file_path"]):
+        def paragraphs():
+            offset = 0
+            for page in doc_pages:
+                yield from _split_paragraphs(page["text"], offset, page.get("page"), page.get("section"))
+                offset += len(page["text"])
+        yield from iter_chunks(paragraphs(), file_path, max_tokens, overlap)
+
 def adaptive_chunk(texts: list[dict], max_tokens: int = 512, overlap: float = 0.15) -> Tuple[List[str], List[dict]]:
     chunks = []
     metadata = []
-    
+
     for doc in texts:
-        text = doc["text"]
-        file_path = doc["file_path"]
-        paragraphs = re.split(r'\n\s*\n', text)
-        
-        current_chunk = ""
-        current_tokens = 0
-        chunk_id = 0
-        
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
-            token_count = len(para.split())
-            
-            if current_tokens + token_count > max_tokens:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                    metadata.append({
-                        "file_path": file_path,
-                        "chunk_id": f"{file_path}_{chunk_id}",
-                        "start_pos": len(text) - len(current_chunk)
-                    })
-                    overlap_size = int(len(current_chunk.split()) * overlap)
-                    overlap_text = " ".join(current_chunk.split()[-overlap_size:])
-                    current_chunk = overlap_text
-                    current_tokens = len(overlap_text.split())
-                    chunk_id += 1
-                
-                if token_count > max_tokens:
-                    words = para.split()
-                    while words:
-                        chunk_words = words[:max_tokens]
-                        chunks.append(" ".join(chunk_words))
-                        metadata.append({
-                            "file_path": file_path,
-                            "chunk_id": f"{file_path}_{chunk_id}",
-                            "start_pos": len(text) - len(current_chunk)
-                        })
-                        words = words[max_tokens - int(max_tokens * overlap):]
-                        chunk_id += 1
-                else:
-                    current_chunk = para
-                    current_tokens = token_count
-            else:
-                current_chunk += "\n\n" + para if current_chunk else para
-                current_tokens += token_count
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-            metadata.append({
-                "file_path": file_path,
-                "chunk_id": f"{file_path}_{chunk_id}",
-                "start_pos": len(text) - len(current_chunk)
-            })
-    
-    return chunks, metadata
\ No newline at end of file
+        for chunk, meta in iter_chunks(_split_paragraphs(doc["text"]), doc["file_path"], max_tokens, overlap):
+            chunks.append(chunk)
+            metadata.append(meta)
+
+    return chunks, metadata
@@ -0,0 +1,314 @@
+"""
+Clause fact index for templated questions.
+
+At ingest, every chunk sentence is scanned for structured facts: coverage,
+exclusion, waiting period and monetary/percentage limit. Each fact is keyed
+by its subject, the content words the clause is about ("cataract surgery",
+"room rent"), reduced to stems. Questions that match a known template ("is X
+covered", "waiting period for X", "limit for X") are answered with one dict
+lookup on the same key, with the source clauses as evidence. Anything
+ambiguous (no fact, conflicting facts, an unrecognised question) returns None
+so the caller can run the normal retrieve + evaluate pipeline.
+"""
+import json
+import os
+import re
+from collections import defaultdict
+from typing import List, Dict, Optional, Tuple
+
+from . import simple_logic
+
+# "Rs." is a currency prefix, not the end of a sentence
+_SENTENCE_SPLIT = re.compile(r"(?<=[.;!?])(?<![Rr]s\.)\s+|\n+")
+# Clause numbering and headings such as "4.2 ", "Section 4: " or "Exclusions: "
+_LEADER = re.compile(r"^(?:[\d.()]+\s+|[^:\n]{1,40}:\s+)")
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9\-]*")
+_PREFIX = 5
+
+_NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "fifteen": 15, "eighteen": 18, "twenty": 20, "twenty-four": 24,
+    "thirty": 30, "thirty-six": 36, "forty-eight": 48, "sixty": 60, "ninety": 90,
+}
+_NUMBER = r"\d+|" + "|".join(sorted((w.replace("-", r"[\s-]") for w in _NUMBER_WORDS), key=len, reverse=True))
+_DURATION = re.compile(rf"\b(?P<n>{_NUMBER})\s*(?:\(\d+\)\s*)?(?P<unit>days?|months?|years?)\b", re.IGNORECASE)
+_WAITING_CUE = re.compile(r"\bwaiting period\b|\bcontinuous (?:coverage|cover|insurance)\b", re.IGNORECASE)
+_AMOUNT = re.compile(
+    r"(?:rs\.?|inr|₹|\$|usd)\s*\d(?:[\d,]*\d)?(?:\.\d+)?(?:\s*(?:lakhs?|crores?))?"
+    r"|\d+(?:\.\d+)?\s*%\s*of\s+(?:the\s+)?sum\s+insured",
+    re.IGNORECASE,
+)
+_LIMIT_CUE = re.compile(r"\bup ?to\b|\blimit(?:ed)?\b|\bcapped\b|\bmaximum\b|\bnot exceeding\b", re.IGNORECASE)
+# Cheap pre-check on the lowercased sentence: without any of these it cannot yield a fact
+_ANY_CUE = re.compile(r"cover|includ|exclu|payable|waiting period|continuous|up ?to|limit|capped|maximum|exceeding")
+# Exceptions, restrictions and time or event qualifiers ("only for employees", "during the first 9 months")
+# make a clause conditional
+_QUALIFIER = re.compile(r"\b(?:unless|except|during|within|after|before|until|prior to|first|following|once"
+                        r"|only|solely|exclusively|restricted to|limited to)\b", re.IGNORECASE)
+# Contrasting clauses in one sentence talk about different subjects
+_CLAUSE_SPLIT = re.compile(r";|\b(?:but|while|whereas|however)\b", re.IGNORECASE)
+# The subject ends where the clause's qualifiers begin
+_BOUNDARY = re.compile(r"[,(:]|\b(?:provided|subject|up ?to|after|if|unless|upon|per|during|within|for a)\b",
+                       re.IGNORECASE)
+# Cues and values inside the subject's span; the subject is the first stretch between them with content words
+_SEPARATORS = (_WAITING_CUE, _LIMIT_CUE, re.compile(r"\||\d[\d,.]*|\bis\b|\bare\b", re.IGNORECASE))
+
+_STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "be", "been", "by", "with",
+    "what", "which", "does", "do", "this", "that", "it", "as", "at", "under", "my", "i", "me", "any", "how",
+    "can", "will", "would", "shall", "all", "its", "there", "their", "such", "these", "those", "we", "our", "you",
+    "your", "section", "clause", "applies", "apply", "applicable", "also", "only", "not", "no",
+})
+# Words that describe the clause, not what it is about
+_GENERIC = frozenset(
+    word for terms in simple_logic.KEYWORDS.values() for term in terms for word in term.split()
+) | {
+    "policy", "policies", "insurance", "insured", "insurer", "plan", "claim", "claims", "pay", "paid", "payable",
+    "expenses", "expense", "treatment", "treatments", "charges", "charge", "costs", "cost", "benefit", "benefits",
+    "waiting", "period", "limit", "limits", "sub-limit", "maximum", "capped", "amount", "sum", "days", "day",
+    "months", "month", "years", "year", "much", "long", "wait", "get", "there", "available",
+}
+
+def _stem_key(text: str) -> Tuple[str, ...]:
+    """Order-free key of the content words in `text`"""
+    stems = {t[:_PREFIX] for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and t not in _GENERIC}
+    return tuple(sorted(stems))
+
+def _duration(match) -> str:
+    raw = re.sub(r"[\s-]+", "-", match.group("n").lower())
+    n = int(raw) if raw.isdigit() else _NUMBER_WORDS.get(raw, raw)
+    unit = match.group("unit").lower().rstrip("s")
+    return f"{n} {unit}" + ("s" if n != 1 else "")
+
+def _subject(sentence: str, anchor: int, anchor_end: int) -> Tuple[str, ...]:
+    """Content words before the first decisive cue, or right after it if nothing precedes it"""
+    key = _stem_key(sentence[:anchor])
+    if key:
+        return key
+    # Values become separators first, so "thirty-six (36) months" is not cut at its bracket
+    tail = _AMOUNT.sub(" | ", _DURATION.sub(" | ", sentence[anchor_end:]))
+    boundary = _BOUNDARY.search(tail)
+    tail = tail[:boundary.start()] if boundary else tail
+    # Cut at every cue and value, so "for X is 36 months of continuous coverage" keeps only X
+    spans = [(m.start(), m.end()) for pattern in _SEPARATORS for m in pattern.finditer(tail)]
+    spans += [(m["start"], m["end"]) for m in simple_logic.scan(tail)]
+    start = 0
+    for cut_start, cut_end in sorted(spans) + [(len(tail), len(tail))]:
+        key = _stem_key(tail[start:cut_start])
+        if key:
+            return key
+        start = max(start, cut_end)
+    return ()
+
+class _Unresolved(Exception):
+    """A negation in the sentence governs no cue, so no fact in it can be trusted"""
+
+def _clause_facts(clause: str, sentence: str) -> Optional[List[Dict]]:
+    """Facts stated in one clause, all sharing its subject; None if it has cues but no usable fact"""
+    matches = simple_logic.scan(clause)
+    resolved = simple_logic.resolve_negations(clause, matches)
+    if resolved is None:
+        raise _Unresolved()
+    # "36 months of continuous coverage" qualifies a waiting period; it does not say anything is covered
+    waiting_spans = [(m.start(), m.end()) for m in _WAITING_CUE.finditer(clause)]
+    decisive = [m for m in resolved if not any(start <= m["start"] < end for start, end in waiting_spans)]
+    kinds = {m["category"] for m in decisive}
+    has_condition = (any(m["category"] == "condition" for m in matches) or bool(_QUALIFIER.search(clause))
+                     or bool(_DURATION.search(clause)))
+
+    waiting = _DURATION.search(clause) if waiting_spans else None
+    amount = _AMOUNT.search(clause) if _LIMIT_CUE.search(clause) else None
+    anchors = [(m["start"], m["end"]) for m in decisive]
+    if waiting:
+        cue = _WAITING_CUE.search(clause)
+        anchors.append((cue.start(), cue.end()))
+    if amount:
+        cue = _LIMIT_CUE.search(clause)
+        anchors.append((cue.start(), cue.end()))
+    if not anchors:
+        return None if has_condition else []
+    subject = _subject(clause, *min(anchors))
+    if not subject:
+        return None
+
+    facts = []
+    if len(kinds) == 1:
+        facts.append({"type": kinds.pop(), "subject": subject, "value": None, "sentence": sentence,
+                      "conditional": has_condition})
+    elif kinds:
+        # "covered ... not covered" in one clause: the scanner cannot tell which applies to the subject
+        return None
+    if waiting:
+        facts.append({"type": "waiting_period", "subject": subject, "value": _duration(waiting), "sentence": sentence})
+    if amount:
+        facts.append({"type": "limit", "subject": subject, "value": re.sub(r"\s+", " ", amount.group()),
+                      "sentence": sentence})
+    return facts
+
+def _sentence_facts(sentence: str) -> List[Dict]:
+    """Facts stated in one sentence; each clause ("X is covered but Y is excluded") has its own subject"""
+    sentence = _LEADER.sub("", sentence)
+    facts = []
+    qualified = False
+    try:
+        for clause in _CLAUSE_SPLIT.split(sentence):
+            found = _clause_facts(clause, sentence)
+            if found is None:
+                qualified = True
+            else:
+                facts.extend(found)
+    except _Unresolved:
+        return []
+    if qualified:
+        # Another clause qualifies this one ("covered, but only after ...") in a way no fact captures
+        for fact in facts:
+            if fact["type"] in ("coverage", "exclusion"):
+                fact["conditional"] = True
+    return facts
+
+def extract_facts(text: str, memo: Dict[str, List[Dict]] = None) -> List[Dict]:
+    """Coverage, exclusion, waiting-period and limit facts stated in one chunk"""
+    facts = []
+    for sentence in _SENTENCE_SPLIT.split(text):
+        # Boilerplate clauses repeat across chunks and documents; extract each distinct sentence once
+        found = memo.get(sentence) if memo is not None else None
+        if found is None:
+            stripped = sentence.strip()
+            found = _sentence_facts(stripped) if len(stripped) >= 8 and _ANY_CUE.search(stripped.lower()) else []
+            if memo is not None:
+                memo[sentence] = found
+        facts.extend(dict(fact) for fact in found)
+    return facts
+
+# Question templates, tried in order; the named group is the entity asked about
+_TEMPLATES = [
+    ("waiting_period", re.compile(r"\bwaiting period\b.*?\b(?:for|of|on|before)\s+(?P<entity>.+)", re.IGNORECASE)),
+    ("waiting_period", re.compile(r"\bhow long\b.*?\bwait\w*\b.*?\bfor\s+(?P<entity>.+)", re.IGNORECASE)),
+    ("limit", re.compile(r"\b(?:sub-?limit|limit|cap|maximum)\b.*?\b(?:for|on|of)\s+(?P<entity>.+)", re.IGNORECASE)),
+    ("limit", re.compile(r"\bhow much\b.*?\b(?:for|on)\s+(?P<entity>.+)", re.IGNORECASE)),
+    ("coverage", re.compile(r"^(?:is|are|does|do|will|would)\s+(?:the\s+)?(?:policy|plan|insurance)?\s*"
+                            r"(?:cover|include|pay for)\s+(?P<entity>.+)", re.IGNORECASE)),
+    ("coverage", re.compile(r"^(?:is|are|will|would)\s+(?P<entity>.+?)\s+(?:be\s+)?(?:covered|included|payable)\b",
+                            re.IGNORECASE)),
+]
+
+def match_template(question: str) -> Optional[Tuple[str, str, Tuple[str, ...]]]:
+    """(template, entity text, entity key) if the question is a recognised template"""
+    question = question.strip().rstrip("?.! ")
+    for template, pattern in _TEMPLATES:
+        match = pattern.search(question)
+        if match:
+            entity = re.sub(r"\s+(?:under|in|by)\s+(?:the|this|my)\s+(?:policy|plan)\b.*$", "",
+                            match.group("entity"), flags=re.IGNORECASE).strip()
+            entity = re.sub(r"^(?:the|a|an)\s+", "", entity, flags=re.IGNORECASE)
+            key = _stem_key(entity)
+            if key:
+                return template, entity, key
+    return None
+
+class ClauseFactIndex:
+    """Facts keyed by (type, subject key); rows point back at the indexed chunks"""
+
+    def __init__(self, max_evidence: int = 5):
+        self.max_evidence = max_evidence
+        self.facts: List[Dict] = []
+        self._by_key: Dict[Tuple[str, Tuple[str, ...]], List[int]] = defaultdict(list)
+        # Per-key value sets and conditional facts, so unfiltered answers never walk every repeat of a clause
+        self._values: Dict[Tuple[str, Tuple[str, ...]], set] = defaultdict(set)
+        self._conditional: Dict[Tuple[str, Tuple[str, ...]], Dict[str, None]] = defaultdict(dict)
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def _insert(self, fact: Dict) -> None:
+        key = (fact["type"], tuple(fact["subject"]))
+        self._by_key[key].append(len(self.facts))
+        self._values[key].add(fact["value"])
+        if fact.get("conditional"):
+            self._conditional[key][fact["sentence"]] = None
+        self.facts.append(fact)
+
+    def add(self, texts: List[str], first_row: int = 0) -> None:
+        memo: Dict[str, List[Dict]] = {}
+        for offset, text in enumerate(texts):
+            for fact in extract_facts(text, memo):
+                fact["row"] = first_row + offset
+                self._insert(fact)
+
+    def lookup(self, fact_type: str, key: Tuple[str, ...], allowed=None) -> Tuple[List[Dict], set, List[str]]:
+        """(evidence facts, distinct values, conditional sentences) for one fact type and subject"""
+        ids = self._by_key.get((fact_type, key), ())
+        if allowed is None:
+            evidence = [self.facts[i] for i in ids[:self.max_evidence]]
+            values = set(self._values.get((fact_type, key), ()))
+            conditional = list(self._conditional.get((fact_type, key), ()))
+        else:
+            facts = [self.facts[i] for i in ids if self.facts[i]["row"] < len(allowed) and allowed[self.facts[i]["row"]]]
+            evidence = facts[:self.max_evidence]
+            values = {f["value"] for f in facts}
+            conditional = [f["sentence"] for f in facts if f.get("conditional")]
+        return evidence, values, list(dict.fromkeys(conditional))
+
+    def answer(self, question: str, allowed=None) -> Optional[Tuple[Dict, List[Dict]]]:
+        """(decision, supporting facts) for a templated question, or None to use the full pipeline"""
+        matched = match_template(question)
+        if matched is None:
+            return None
+        template, entity, key = matched
+
+        if template == "coverage":
+            covered, _, covered_conditions = self.lookup("coverage", key, allowed)
+            excluded, _, exceptions = self.lookup("exclusion", key, allowed)
+            if bool(covered) == bool(excluded):
+                # Nothing known, or the clauses disagree: leave it to the evaluator
+                return None
+            if excluded:
+                # "excluded unless arising from an accident" is an exception, not a flat no
+                conditions = exceptions
+                status, facts = ("conditional" if conditions else "not_covered"), excluded
+                answer = (f"The policy excludes {entity} only in the circumstances stated in the quoted clause."
+                          if conditions else f"No, the policy does not cover {entity}.")
+            else:
+                waiting, waiting_values, _ = self.lookup("waiting_period", key, allowed)
+                limits, limit_values, _ = self.lookup("limit", key, allowed)
+                conditions = [f"Waiting period: {v}" for v in sorted(waiting_values)]
+                conditions += [f"Limit: {v}" for v in sorted(limit_values)] + covered_conditions
+                status, facts = ("conditional" if conditions else "covered"), covered + waiting + limits
+                answer = f"Yes, the policy covers {entity}" + (", subject to conditions." if conditions else ".")
+        else:
+            facts, values, _ = self.lookup(template, key, allowed)
+            if len(values) != 1:
+                # No stated value, or clauses that disagree on it
+                return None
+            value = values.pop()
+            label = "waiting period" if template == "waiting_period" else "limit"
+            status = "conditional"
+            answer = f"The {label} for {entity} is {value}."
+            conditions = [f"{label.capitalize()}: {value}"]
+
+        sentences = list(dict.fromkeys(f["sentence"] for f in facts))
+        decision = {
+            "answer": answer,
+            "conditions": conditions,
+            "decision_rationale": "Answered from the clause fact index, which states this directly: "
+                                  + " ".join(f'"{sentence}"' for sentence in sentences[:3]),
+            # A qualified clause ("during the first 9 months") is stated directly but does not settle every case
+            "confidence": 0.9 if status != "conditional" or template != "coverage" else 0.8,
+            "status": status,
+            "token_usage": 0,
+        }
+        return decision, facts
+
+    def save(self, directory: str) -> None:
+        with open(os.path.join(directory, "clause_facts.json"), "w") as f:
+            json.dump(self.facts, f)
+
+    @classmethod
+    def load(cls, directory: str) -> "ClauseFactIndex":
+        index = cls()
+        path = os.path.join(directory, "clause_facts.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                for fact in json.load(f):
+                    index._insert(fact)
+        return index
@@ -0,0 +1,162 @@
+"""
+Near-duplicate chunk elimination with MinHash and LSH banding.
+
+Policy packs repeat the same definitions, general conditions and legal notices
+in every rider. Each chunk gets a MinHash signature over hashed word shingles.
+Signatures are split into bands, and chunks that share a band bucket and have
+an estimated Jaccard similarity above the threshold collapse into the first
+one seen. The representative's metadata keeps back-references to every source
+it stands for. Chunks that state different numbers ("30 days" vs "60 days")
+never merge, however similar the rest of the wording is.
+"""
+import zlib
+import re
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_PRIME = np.uint64((1 << 31) - 1)
+_MIX = (np.uint64(0x9E3779B1), np.uint64(0x85EBCA77))
+_MASK32 = np.uint64(0xFFFFFFFF)
+_EMPTY = np.iinfo(np.uint64).max
+# Numbers written as digits or words; "thirty" and "30" are the same value
+_NUMBER_TOKEN_RE = re.compile(r"\d[\d,]*(?:\.\d+)?|[a-z]+")
+_UNITS = {w: i for i, w in enumerate(
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen "
+    "sixteen seventeen eighteen nineteen".split())}
+_TENS = {w: 10 * i for i, w in enumerate("twenty thirty forty fifty sixty seventy eighty ninety".split(), start=2)}
+
+def numeric_values(text: str) -> frozenset:
+    """Every number stated in `text`, normalized so digit and word forms compare equal"""
+    tokens = _NUMBER_TOKEN_RE.findall(text.lower())
+    values = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token[0].isdigit():
+            number = token.replace(",", "").rstrip(".")
+            values.append(number.rstrip("0").rstrip(".") if "." in number else number.lstrip("0") or "0")
+        elif token in _TENS:
+            value = _TENS[token]
+            if i + 1 < len(tokens) and 0 < _UNITS.get(tokens[i + 1], 0) < 10:
+                value += _UNITS[tokens[i + 1]]
+                i += 1
+            values.append(str(value))
+        elif token in _UNITS:
+            values.append(str(_UNITS[token]))
+        i += 1
+    return frozenset(values)
+
+class Deduplicator:
+    """Incremental near-duplicate filter; state persists across batches of one ingest"""
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, bands: int = 16,
+                 shingle_size: int = 3, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, (1 << 31) - 1, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, (1 << 31) - 1, size=num_perm).astype(np.uint64)
+        self._token_hashes: Dict[str, int] = {}
+        self._buckets: List[Dict[bytes, int]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+        self._numbers: List[frozenset] = []
+        self._metadata: List[dict] = []
+        self.input_chunks = 0
+        self.removed_chunks = 0
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """Hashed word k-shingles (whole text as one shingle if it is shorter than k words)"""
+        tokens = _TOKEN_RE.findall(text.lower())
+        if not tokens:
+            return np.zeros(0, dtype=np.uint64)
+        hashes = np.fromiter((self._token_hash(t) for t in tokens), dtype=np.uint64, count=len(tokens))
+        k = min(self.shingle_size, len(hashes))
+        shingles = hashes[:len(hashes) - k + 1].copy()
+        for offset in range(1, k):
+            shingles = (shingles * _MIX[offset % 2]) ^ hashes[offset:len(hashes) - k + 1 + offset]
+        return np.unique(shingles & _MASK32)
+
+    def _token_hash(self, token: str) -> int:
+        h = self._token_hashes.get(token)
+        if h is None:
+            h = self._token_hashes[token] = zlib.crc32(token.encode())
+        return h
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """(n, num_perm) MinHash signatures, computed per chunk with vectorized permutations"""
+        out = np.full((len(texts), self.num_perm), _EMPTY, dtype=np.uint64)
+        for i, text in enumerate(texts):
+            shingles = self._shingles(text)
+            if len(shingles):
+                # (a * x + b) mod p with 31-bit operands stays inside uint64
+                permuted = (self._a[:, None] * (shingles[None, :] % _PRIME) + self._b[:, None]) % _PRIME
+                out[i] = permuted.min(axis=1)
+        return out
+
+    def filter(self, chunks: List[str], metadata: List[dict]) -> Tuple[List[str], List[dict]]:
+        """Drop near-duplicates of chunks already kept, recording them on the representative"""
+        signatures = self.signatures(chunks)
+        kept_chunks, kept_metadata = [], []
+        self.input_chunks += len(chunks)
+
+        for chunk, meta, signature in zip(chunks, metadata, signatures):
+            band_keys = [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+            representative = None
+            numbers = numeric_values(chunk)
+            if signature[0] != _EMPTY:
+                candidates = {self._buckets[b][key] for b, key in enumerate(band_keys) if key in self._buckets[b]}
+                for candidate in sorted(candidates):
+                    # A limit or waiting period that differs is a different clause, not boilerplate
+                    if self._numbers[candidate] != numbers:
+                        continue
+                    if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                        representative = candidate
+                        break
+
+            if representative is not None:
+                rep_meta = self._metadata[representative]
+                rep_meta.setdefault("duplicates", []).append({
+                    "chunk_id": meta.get("chunk_id"),
+                    "file_path": meta.get("file_path"),
+                    "page": meta.get("page"),
+                })
+                self.removed_chunks += 1
+                continue
+
+            row = len(self._signatures)
+            self._signatures.append(signature)
+            self._numbers.append(numbers)
+            self._metadata.append(meta)
+            if signature[0] != _EMPTY:
+                for b, key in enumerate(band_keys):
+                    self._buckets[b].setdefault(key, row)
+            kept_chunks.append(chunk)
+            kept_metadata.append(meta)
+
+        return kept_chunks, kept_metadata
+
+    def back_references(self) -> List[Tuple[int, List[dict]]]:
+        """(kept row, duplicates) for every kept chunk that absorbed near-duplicates, rows in keep order"""
+        return [(row, meta["duplicates"]) for row, meta in enumerate(self._metadata) if "duplicates" in meta]
+
+    def stats(self) -> Dict:
+        kept = self.input_chunks - self.removed_chunks
+        return {
+            "input_chunks": self.input_chunks,
+            "indexed_chunks": kept,
+            "duplicates_removed": self.removed_chunks,
+            "shrinkage": self.removed_chunks / self.input_chunks if self.input_chunks else 0.0,
+        }
+
+def dedup_chunks(chunks: List[str], metadata: List[dict], threshold: float = 0.85) -> Tuple[List[str], List[dict], Dict]:
+    """One-shot near-duplicate elimination for an already chunked corpus"""
+    deduplicator = Deduplicator(threshold=threshold)
+    kept_chunks, kept_metadata = deduplicator.filter(chunks, metadata)
+    return kept_chunks, kept_metadata, deduplicator.stats()
@@ -16,7 +16,8 @@ class VectorIndex:
     
     def search(self, query, k=5):
         """Search for similar chunks"""
-        if not self.embeddings or not self.chunks:
+        # Sparse matrices have no truth value, so test for None explicitly
+        if self.embeddings is None or not self.chunks:
             return [], []
         
         # Transform query
@@ -0,0 +1,171 @@
+"""
+Persistent embedding cache shared across uploads.
+
+Vectors are keyed by (embedder version, SHA-1 of the chunk text). Each embedder
+version gets its own directory holding an append-only float32 vector file,
+read through a memory map, and an append-only file of 20-byte content hashes
+whose position gives the vector's row. Re-uploading a lightly edited policy
+only embeds the chunks that actually changed.
+
+Writers hold an exclusive flock and first cut both files back to their common
+row count, so a crash between the two appends can never shift keys against
+vectors. Once the cache exceeds `max_rows`, the oldest rows are compacted away
+by rewriting both files; readers take a shared flock so they never see one file
+replaced and the other not.
+"""
+import os
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import List, Callable, Dict, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+HASH_SIZE = 20
+DEFAULT_MAX_ROWS = 250_000
+
+def content_hash(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """Append-only, memory-mapped store of chunk embeddings for one embedder version"""
+
+    def __init__(self, cache_dir: str, version: str, dim: int, max_rows: int = DEFAULT_MAX_ROWS):
+        self.dim = dim
+        self.version = version
+        self.max_rows = max_rows
+        self.path = os.path.join(cache_dir, version)
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.keys_path = os.path.join(self.path, "keys.bin")
+        self.lock_path = os.path.join(self.path, ".lock")
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._vectors = None
+        self._loaded_rows = 0
+        self._keys_inode = None
+        with self._file_lock(exclusive=False):
+            self._refresh()
+
+    def __len__(self) -> int:
+        return self._loaded_rows
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(self.lock_path, "a") as lock_file:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_rows(self) -> Tuple[int, int]:
+        key_bytes = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        vector_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        return key_bytes // HASH_SIZE, vector_bytes // (4 * self.dim)
+
+    def _refresh(self) -> None:
+        """Pick up rows appended since the last load (possibly by another process); needs the file lock"""
+        inode = os.stat(self.keys_path).st_ino if os.path.exists(self.keys_path) else None
+        if inode != self._keys_inode:
+            # First load, or another process compacted the files: row numbers start over
+            self._rows, self._vectors, self._loaded_rows, self._keys_inode = {}, None, 0, inode
+        # Only trust rows that have both a key and a complete vector
+        n_rows = min(self._file_rows())
+        if n_rows == self._loaded_rows:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._loaded_rows * HASH_SIZE)
+            new_keys = f.read((n_rows - self._loaded_rows) * HASH_SIZE)
+        for i in range(n_rows - self._loaded_rows):
+            self._rows.setdefault(new_keys[i * HASH_SIZE:(i + 1) * HASH_SIZE], self._loaded_rows + i)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+        self._loaded_rows = n_rows
+
+    def fetch(self, hashes: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        """(hit mask, vectors of the hits) in one consistent view of the files"""
+        with self._lock, self._file_lock(exclusive=False):
+            self._refresh()
+            rows = np.fromiter((self._rows.get(h, -1) for h in hashes), dtype=np.int64, count=len(hashes))
+            hit = rows >= 0
+            vectors = np.asarray(self._vectors[rows[hit]], dtype=np.float32) if hit.any() else None
+            return hit, vectors
+
+    def _truncate_to_common_rows(self) -> int:
+        """Drop a half-written tail, e.g. vectors appended by a writer that died before its keys"""
+        key_rows, vector_rows = self._file_rows()
+        n_rows = min(key_rows, vector_rows)
+        for path, row_bytes in ((self.keys_path, HASH_SIZE), (self.vectors_path, 4 * self.dim)):
+            if os.path.exists(path) and os.path.getsize(path) != n_rows * row_bytes:
+                os.truncate(path, n_rows * row_bytes)
+        return n_rows
+
+    def _compact(self, keep_rows: int) -> None:
+        """Rewrite both files with only the newest `keep_rows` rows"""
+        n_rows = self._loaded_rows
+        start = max(0, n_rows - keep_rows)
+        with open(self.keys_path, "rb") as f:
+            f.seek(start * HASH_SIZE)
+            keys = f.read((n_rows - start) * HASH_SIZE)
+        vectors = np.array(self._vectors[start:n_rows]) if self._vectors is not None else np.zeros((0, self.dim), np.float32)
+        for path, data in ((self.vectors_path, vectors.tobytes()), (self.keys_path, keys)):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        self._keys_inode = None
+        self._refresh()
+
+    def put(self, hashes: List[bytes], vectors: np.ndarray) -> None:
+        """Append new vectors; hashes that are already cached are skipped"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock(exclusive=True):
+            self._truncate_to_common_rows()
+            self._refresh()
+            keep = [i for i, h in enumerate(hashes) if h not in self._rows]
+            if not keep:
+                return
+            if self._loaded_rows + len(keep) > self.max_rows:
+                # Oldest rows go first; keeping half the budget avoids compacting on every put
+                self._compact(max(0, self.max_rows // 2 - len(keep)))
+            # Vectors first: a row only counts once its key is written too
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors[keep].tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(hashes[i] for i in keep))
+            self._refresh()
+
+def embed_with_cache(texts: List[str], embed_batch: Callable[[List[str]], np.ndarray],
+                     cache: EmbeddingCache) -> Tuple[np.ndarray, Dict]:
+    """Embed texts, computing vectors only for content the cache has not seen"""
+    hashes = [content_hash(t) for t in texts]
+    hit, cached = cache.fetch(hashes)
+    out = np.zeros((len(texts), cache.dim), dtype=np.float32)
+    if cached is not None:
+        out[hit] = cached
+
+    # Identical chunks within one batch are embedded once
+    missing: Dict[bytes, List[int]] = {}
+    for i in np.flatnonzero(~hit):
+        missing.setdefault(hashes[i], []).append(int(i))
+    if missing:
+        unique_hashes = list(missing)
+        vectors = embed_batch([texts[missing[h][0]] for h in unique_hashes])
+        for h, vector in zip(unique_hashes, vectors):
+            out[missing[h]] = vector
+        cache.put(unique_hashes, vectors)
+
+    stats = {
+        "chunks": len(texts),
+        "cache_hits": int(hit.sum()),
+        "embedded": len(missing),
+        "cache_hit_ratio": float(hit.mean()) if len(texts) else 0.0,
+    }
+    return out, stats
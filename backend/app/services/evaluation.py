@@ -0,0 +1,226 @@
+"""
+Offline retrieval evaluation: answer quality against latency and memory.
+
+A labelled set pairs each question with the clause(s) that answer it, either
+by chunk ID or by a snippet of the clause text. Every retrieval configuration
+(backend, embedding dim, storage dtype, re-ranking, k) is built over the same
+chunks. Each one reports recall@k, MRR and nDCG@k next to per-query latency
+and index memory, and `pareto_frontier` keeps the settings that no other
+setting at the same k beats on all three.
+"""
+import json
+import re
+import time
+from typing import List, Dict, Set, Callable
+
+import numpy as np
+
+from .simple_embedder import SimpleEmbedder, DEFAULT_DIM
+from .reranker import rerank
+
+_WHITESPACE = re.compile(r"\s+")
+# Rows of the int8 matrix upcast per step; bounds the float32 temporary to a few MB at any dim
+INT8_BLOCK_ROWS = 2048
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text.lower()).strip()
+
+def load_labelled_set(path: str) -> List[Dict]:
+    """JSONL of {"question", "relevant_ids": [...]} and/or {"question", "relevant_text": [...]}"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def resolve_relevant(labelled: List[Dict], chunks: List[str], metadata: List[dict]) -> List[Set[int]]:
+    """Row indices of the relevant chunks for each labelled question"""
+    row_of = {meta.get("chunk_id"): row for row, meta in enumerate(metadata)}
+    normalized = [_normalize(chunk) for chunk in chunks]
+    resolved = []
+    for item in labelled:
+        rows = {row_of[i] for i in item.get("relevant_ids", []) if i in row_of}
+        for snippet in item.get("relevant_text", []):
+            snippet = _normalize(snippet)
+            rows.update(row for row, text in enumerate(normalized) if snippet in text)
+        resolved.append(rows)
+    return resolved
+
+def recall_at_k(ranked: List[int], relevant: Set[int], k: int) -> float:
+    return len(set(ranked[:k]) & relevant) / len(relevant) if relevant else 0.0
+
+def reciprocal_rank(ranked: List[int], relevant: Set[int], k: int) -> float:
+    for rank, row in enumerate(ranked[:k], start=1):
+        if row in relevant:
+            return 1.0 / rank
+    return 0.0
+
+def ndcg_at_k(ranked: List[int], relevant: Set[int], k: int) -> float:
+    """Binary-relevance nDCG"""
+    dcg = sum(1.0 / np.log2(rank + 1) for rank, row in enumerate(ranked[:k], start=1) if row in relevant)
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+class HashRetriever:
+    """SimpleEmbedder search with the matrix stored as float32, float16 or per-row scaled int8"""
+
+    def __init__(self, chunks: List[str], metadata: List[dict], dim: int = DEFAULT_DIM, dtype: str = "float32",
+                 rerank_candidates: int = 0, rerank_budget_ms: float = 15.0):
+        self.embedder = SimpleEmbedder(dim=dim)
+        self.embedder.build_index(chunks, metadata)
+        self.chunks = chunks
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        matrix = self.embedder.embeddings
+        self.scale = None
+        if dtype == "int8":
+            scale = np.abs(matrix).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            self.matrix = np.round(matrix / scale[:, None]).astype(np.int8)
+            self.scale = scale.astype(np.float32)
+        elif dtype in ("float16", "float32"):
+            self.matrix = np.ascontiguousarray(matrix, dtype=dtype)
+        else:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.matrix.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def _int8_scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """Scaled int8 scores, upcasting one block of rows at a time instead of the whole matrix per query"""
+        scores = np.empty(len(self.matrix), dtype=np.float32)
+        for start in range(0, len(self.matrix), INT8_BLOCK_ROWS):
+            block = self.matrix[start:start + INT8_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        return scores * self.scale
+
+    def _first_stage(self, query: str, k: int):
+        # Embedded directly rather than through the query-vector cache, so latency stays uncached
+        query_vector = self.embedder.embed_batch([query])[0]
+        if self.scale is not None:
+            scores = self._int8_scores(query_vector.astype(np.float32))
+        else:
+            scores = self.matrix @ query_vector.astype(self.matrix.dtype)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [int(row) for row in top[np.argsort(-scores[top], kind="stable")]], scores
+
+    def search(self, query: str, k: int) -> List[int]:
+        if not self.rerank_candidates:
+            return self._first_stage(query, k)[0]
+        rows, scores = self._first_stage(query, max(k, self.rerank_candidates))
+        candidates = [{"text": self.chunks[row], "similarity_score": float(scores[row]), "clause_id": row} for row in rows]
+        reranked, _ = rerank(query, candidates, k=k, budget_ms=self.rerank_budget_ms)
+        return [candidate["clause_id"] for candidate in reranked]
+
+class TfidfRetriever:
+    """The TF-IDF VectorIndex backend"""
+
+    def __init__(self, chunks: List[str], metadata: List[dict]):
+        from .embedder import VectorIndex
+
+        self.index = VectorIndex()
+        self.index.build_index(chunks)
+
+    @property
+    def memory_bytes(self) -> int:
+        matrix = self.index.embeddings
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+    def search(self, query: str, k: int) -> List[int]:
+        _, indices = self.index.search(query, k)
+        return [int(row) for row in indices]
+
+def default_configs(dims=(256, 512, 1024), dtypes=("float32", "float16", "int8"), rerank_candidates=(0, 30)) -> List[Dict]:
+    """The grid evaluated when no configs are given: TF-IDF plus every hash dim x dtype x rerank setting"""
+    configs = [{"backend": "tfidf"}]
+    for dim in dims:
+        for dtype in dtypes:
+            for candidates in rerank_candidates:
+                configs.append({"backend": "hash", "dim": dim, "dtype": dtype, "rerank_candidates": candidates})
+    return configs
+
+def config_name(config: Dict) -> str:
+    if config["backend"] == "tfidf":
+        return "tfidf"
+    name = f"hash-d{config.get('dim', DEFAULT_DIM)}-{config.get('dtype', 'float32')}"
+    if config.get("rerank_candidates"):
+        name += f"+rerank{config['rerank_candidates']}"
+    return name
+
+def build_retriever(config: Dict, chunks: List[str], metadata: List[dict]):
+    if config["backend"] == "tfidf":
+        return TfidfRetriever(chunks, metadata)
+    if config["backend"] == "hash":
+        return HashRetriever(chunks, metadata, dim=config.get("dim", DEFAULT_DIM), dtype=config.get("dtype", "float32"),
+                             rerank_candidates=config.get("rerank_candidates", 0))
+    raise ValueError(f"Unknown backend: {config['backend']}")
+
+def evaluate_retriever(search: Callable[[str, int], List[int]], questions: List[str], relevant: List[Set[int]],
+                       k: int) -> Dict:
+    """Quality and latency of one search function at one k"""
+    recalls, rrs, ndcgs, latencies = [], [], [], []
+    for question, rows in zip(questions, relevant):
+        start = time.perf_counter()
+        ranked = search(question, k)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        recalls.append(recall_at_k(ranked, rows, k))
+        rrs.append(reciprocal_rank(ranked, rows, k))
+        ndcgs.append(ndcg_at_k(ranked, rows, k))
+    return {
+        "k": k,
+        "recall": float(np.mean(recalls)) if recalls else 0.0,
+        "mrr": float(np.mean(rrs)) if rrs else 0.0,
+        "ndcg": float(np.mean(ndcgs)) if ndcgs else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+    }
+
+def run_grid(chunks: List[str], metadata: List[dict], labelled: List[Dict], configs: List[Dict] = None,
+             ks=(1, 3, 5, 10), warmup: int = 3) -> Dict:
+    """Evaluate every config at every k over the same chunks and labelled questions"""
+    relevant = resolve_relevant(labelled, chunks, metadata)
+    usable = [(item["question"], rows) for item, rows in zip(labelled, relevant) if rows]
+    questions = [question for question, _ in usable]
+    relevant = [rows for _, rows in usable]
+
+    rows = []
+    for config in configs or default_configs():
+        start = time.perf_counter()
+        retriever = build_retriever(config, chunks, metadata)
+        build_seconds = time.perf_counter() - start
+        for question in questions[:warmup]:
+            retriever.search(question, max(ks))
+        for k in ks:
+            row = {"config": config_name(config), **config}
+            row.update(evaluate_retriever(retriever.search, questions, relevant, k))
+            row["memory_bytes"] = retriever.memory_bytes
+            row["build_seconds"] = build_seconds
+            rows.append(row)
+
+    return {
+        "chunks": len(chunks),
+        "questions": len(questions),
+        "unresolved_questions": len(labelled) - len(questions),
+        "results": rows,
+    }
+
+def pareto_frontier(rows: List[Dict], quality: str = "ndcg", costs=("p95_ms", "memory_bytes"),
+                    group_by: str = "k") -> List[Dict]:
+    """Rows not dominated by another row with at least the quality and no higher cost, sorted by latency.
+
+    Quality at different k is not comparable (recall@10 is never below recall@1), so rows only compete
+    with rows that share their `group_by` value; the result lists each group's frontier in turn.
+    """
+    def dominates(a, b):
+        no_worse = a[quality] >= b[quality] and all(a[c] <= b[c] for c in costs)
+        better = a[quality] > b[quality] or any(a[c] < b[c] for c in costs)
+        return no_worse and better
+
+    groups: Dict = {}
+    for row in rows:
+        groups.setdefault(row.get(group_by), []).append(row)
+    frontier = []
+    for key in sorted(groups, key=lambda key: (key is None, key)):
+        group = groups[key]
+        members = [row for row in group if not any(dominates(other, row) for other in group)]
+        frontier.extend(sorted(members, key=lambda row: row[costs[0]]))
+    return frontier
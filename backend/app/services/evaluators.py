@@ -0,0 +1,208 @@
+"""
+Pluggable evaluators for the decision step of /ask/.
+
+Every evaluator takes the question and its retrieved chunks and returns the
+same decision dict (answer, conditions, decision_rationale, confidence,
+status, token_usage). The status is one of covered, not_covered, conditional
+or unclear.
+
+- LocalEvaluator answers on-box. It is an extractive, feature-based
+  classifier: it keeps the evidence sentences that mention the question's
+  subject, tags them with the simple_logic keyword scanner, and weighs the
+  coverage, exclusion and condition votes by topical overlap and retrieval
+  score. Its confidence reflects how one-sided and how on-topic the evidence
+  is.
+- LLMEvaluator is the remote OpenRouter path, falling back to another
+  evaluator when the call fails.
+- RoutingEvaluator answers locally when the local result is confident, and
+  escalates only ambiguous questions to the LLM.
+"""
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import List, Dict
+
+from . import simple_logic
+from app.utils.helpers import tokenize, query_terms
+from app.utils.metrics import metrics
+
+STATUSES = ("covered", "not_covered", "conditional", "unclear")
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.;:!?])\s+|\n+")
+# Decision vocabulary and policy boilerplate say nothing about the question's subject
+_GENERIC_TERMS = frozenset(
+    word for terms in simple_logic.KEYWORDS.values() for term in terms for word in term.split()
+) | {"policy", "policies", "insurance", "insured", "insurer", "plan", "claim", "claims", "get", "will", "pay", "paid"}
+_PREFIX = 5
+
+def _stems(tokens) -> set:
+    return {t[:_PREFIX] for t in tokens}
+
+class Evaluator(ABC):
+    """Decision backend; subclasses implement `evaluate`"""
+
+    name = "base"
+
+    @abstractmethod
+    def evaluate(self, query: str, retrieved_chunks: List[dict]) -> Dict:
+        """Decision dict for the question given its retrieved chunks"""
+
+    def __call__(self, query: str, retrieved_chunks: List[dict]) -> Dict:
+        start = time.perf_counter()
+        result = self.evaluate(query, retrieved_chunks)
+        metrics.observe(f"evaluator.{self.name}", time.perf_counter() - start)
+        return result
+
+class LocalEvaluator(Evaluator):
+    """Extractive clause classifier over the retrieved evidence, no network calls"""
+
+    name = "local"
+
+    def __init__(self, min_relevance: float = 0.5, dominance: float = 0.75, condition_ratio: float = 0.5):
+        self.min_relevance = min_relevance
+        self.dominance = dominance
+        self.condition_ratio = condition_ratio
+
+    def _evidence(self, subject: List[str], retrieved_chunks: List[dict]) -> List[Dict]:
+        """Sentences that mention the question's subject, with their keyword categories"""
+        subject_stems = _stems(subject)
+        if not subject_stems:
+            # Nothing to match sentences against; voting over every sentence would decide on unrelated clauses
+            return []
+        evidence = []
+        for chunk in retrieved_chunks:
+            similarity = max(0.0, float(chunk.get("similarity_score") or 0.0))
+            for sentence in _SENTENCE_SPLIT.split(chunk.get("text", "")):
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                relevance = len(subject_stems & _stems(tokenize(sentence))) / len(subject_stems)
+                if relevance < self.min_relevance:
+                    continue
+                matches = simple_logic.scan(sentence)
+                categories = {m["category"] for m in matches if m["category"] == "condition"}
+                # "will not be covered" must not vote as coverage; a negation that governs no cue
+                # ("covered without ...") leaves the sentence with no coverage or exclusion vote at all
+                resolved = simple_logic.resolve_negations(sentence, matches)
+                if resolved is not None:
+                    categories |= {m["category"] for m in resolved}
+                if categories:
+                    evidence.append({
+                        "clause_id": chunk.get("clause_id"),
+                        "sentence": sentence,
+                        "categories": categories,
+                        "relevance": relevance,
+                        "weight": relevance * (1.0 + similarity),
+                    })
+        return evidence
+
+    def evaluate(self, query: str, retrieved_chunks: List[dict]) -> Dict:
+        subject = [t for t in query_terms(query) if t not in _GENERIC_TERMS]
+        evidence = self._evidence(subject, retrieved_chunks)
+        votes = {category: sum(e["weight"] for e in evidence if category in e["categories"])
+                 for category in ("coverage", "exclusion", "condition")}
+        coverage, exclusion, condition = votes["coverage"], votes["exclusion"], votes["condition"]
+        decisive = coverage + exclusion
+        strength = max((e["relevance"] for e in evidence), default=0.0)
+
+        if decisive == 0:
+            status, confidence = "unclear", 0.3
+        else:
+            margin = abs(coverage - exclusion) / decisive
+            if coverage and exclusion and max(coverage, exclusion) / decisive < self.dominance:
+                status, confidence = "conditional", 0.45 + 0.2 * strength
+            elif coverage >= exclusion:
+                with_conditions = condition >= self.condition_ratio * coverage
+                status = "conditional" if with_conditions else "covered"
+                confidence = 0.5 + 0.45 * margin * strength - (0.1 if with_conditions else 0.0)
+            else:
+                status, confidence = "not_covered", 0.5 + 0.45 * margin * strength
+
+        topic = " ".join(subject) or "this"
+        best = max((e for e in evidence if e["categories"] & {"coverage", "exclusion"}),
+                   key=lambda e: e["weight"], default=None)
+        quote = f' Relevant clause ({best["clause_id"]}): "{best["sentence"]}"' if best else ""
+        answer = {
+            "covered": f"Yes, the policy covers {topic}.",
+            "not_covered": f"No, the policy does not cover {topic}.",
+            "conditional": f"The policy covers {topic} only subject to conditions or exclusions.",
+            "unclear": f"The documents do not clearly state whether {topic} is covered.",
+        }[status] + quote
+
+        conditions = [e["sentence"] for e in sorted(evidence, key=lambda e: -e["weight"])
+                      if "condition" in e["categories"]][:3]
+        rationale = (f"Local analysis of {len(retrieved_chunks)} retrieved sections found {len(evidence)} "
+                     f"on-topic sentences (coverage weight {coverage:.2f}, exclusion weight {exclusion:.2f}, "
+                     f"condition weight {condition:.2f}).")
+        return {
+            "answer": answer,
+            "conditions": conditions,
+            "decision_rationale": rationale,
+            "confidence": round(min(0.95, max(0.05, confidence)), 3),
+            "status": status,
+            "token_usage": 0,
+        }
+
+class LLMEvaluator(Evaluator):
+    """Remote LLM decision, with another evaluator as the offline fallback"""
+
+    name = "llm"
+
+    def __init__(self, fallback: Evaluator = None):
+        self.fallback = fallback
+
+    def call(self, query: str, retrieved_chunks: List[dict]) -> Dict:
+        """The LLM decision; raises if the call fails"""
+        # Imported lazily so local-only deployments do not need the OpenAI client
+        from .logic import call_llm
+        return call_llm(query, retrieved_chunks)
+
+    def evaluate(self, query: str, retrieved_chunks: List[dict]) -> Dict:
+        if self.fallback is None:
+            from .logic import evaluate
+            return evaluate(query, retrieved_chunks)
+        try:
+            return self.call(query, retrieved_chunks)
+        except Exception as e:
+            metrics.incr("llm.fallbacks")
+            result = self.fallback.evaluate(query, retrieved_chunks)
+            result["decision_rationale"] += f" (LLM call failed: {str(e)}; using offline analysis)"
+            return result
+
+class RoutingEvaluator(Evaluator):
+    """Local answer when it is confident, LLM escalation otherwise"""
+
+    name = "routing"
+
+    def __init__(self, local: Evaluator = None, remote: LLMEvaluator = None, threshold: float = 0.75):
+        self.local = local or LocalEvaluator()
+        self.remote = remote or LLMEvaluator()
+        self.threshold = threshold
+
+    def evaluate(self, query: str, retrieved_chunks: List[dict]) -> Dict:
+        local_result = self.local.evaluate(query, retrieved_chunks)
+        if local_result["status"] != "unclear" and local_result["confidence"] >= self.threshold:
+            metrics.incr("evaluator.routed_local")
+            return local_result
+
+        metrics.incr("evaluator.escalated")
+        try:
+            return self.remote.call(query, retrieved_chunks)
+        except Exception as e:
+            # The local answer is already computed, so an LLM outage costs nothing extra
+            metrics.incr("llm.fallbacks")
+            local_result["decision_rationale"] += f" (LLM escalation failed: {str(e)}; using local analysis)"
+            return local_result
+
+def get_evaluator(backend: str, threshold: float = 0.75) -> Evaluator:
+    """Evaluator for a backend name: "llm", "local" or "routing" """
+    if backend in ("llm", "routing"):
+        # Surface a missing OpenAI client or API key at startup rather than on the first question
+        from . import logic  # noqa: F401
+    if backend == "llm":
+        return LLMEvaluator()
+    if backend == "local":
+        return LocalEvaluator()
+    if backend == "routing":
+        return RoutingEvaluator(threshold=threshold)
+    raise ValueError(f"Unknown evaluator backend '{backend}'; expected llm, local or routing")
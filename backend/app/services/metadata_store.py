@@ -0,0 +1,329 @@
+"""
+Columnar chunk metadata and compiled filters.
+
+Metadata is held as typed NumPy columns instead of a list of dicts: source
+and section are dictionary-encoded to int32 IDs, and page, start offset,
+document version and the chunk number of a "{file_path}_{n}" chunk ID are
+integer columns (-1 where absent). Keys that do not fit a column, such as
+dedup back-references or non-standard chunk IDs, go into a sparse per-row
+dict. Indexing the store still returns a plain metadata dict.
+
+Filters are small expressions, e.g. `(Field("file_path") == "a.pdf") &
+Field("page").between(3, 10)`. They compile to a boolean mask over the
+columns with vectorized comparisons, so no per-chunk Python runs at query
+time, and the index restricts scoring to the masked rows. A source filter also
+matches rows that dedup kept in place of a copy from that source.
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Typed columns; -1 marks a missing value
+INT_COLUMNS = {
+    "source_id": np.int32,
+    "chunk_no": np.int32,
+    "page": np.int32,
+    "section_id": np.int32,
+    "start_pos": np.int64,
+    "doc_version": np.int32,
+}
+_PLAIN_KEYS = {"page": "page", "start_pos": "start_pos", "doc_version": "doc_version"}
+_ENCODED_KEYS = {"file_path": "source_id", "section": "section_id"}
+_HANDLED_KEYS = set(_PLAIN_KEYS) | set(_ENCODED_KEYS) | {"chunk_id"}
+
+class MetadataStore:
+    """Append-only columnar metadata; behaves like a read-only list of dicts"""
+
+    def __init__(self, columns: Dict[str, np.ndarray] = None, sources: List[str] = None,
+                 sections: List[str] = None, extras: Dict[int, Dict] = None, size: int = None):
+        self._columns = columns or {name: np.zeros(0, dtype=dtype) for name, dtype in INT_COLUMNS.items()}
+        self.sources = list(sources or [])
+        self.sections = list(sections or [])
+        self._source_ids = {s: i for i, s in enumerate(self.sources)}
+        self._section_ids = {s: i for i, s in enumerate(self.sections)}
+        self._extras: Dict[int, Dict] = extras or {}
+        self._size = len(self._columns["source_id"]) if size is None else size
+        # Source code -> rows that stand in for a deduplicated copy from that source
+        self._duplicate_rows: Dict[int, set] = {}
+        for row, extra in self._extras.items():
+            self._index_duplicates(row, extra.get("duplicates", ()))
+
+    @classmethod
+    def from_dicts(cls, metadata: Iterable[Dict]) -> "MetadataStore":
+        store = cls()
+        store.extend(list(metadata))
+        return store
+
+    def __len__(self) -> int:
+        return self._size
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name][:self._size]
+
+    def _encode(self, value: Optional[str], lookup: Dict[str, int], values: List[str]) -> int:
+        if value is None:
+            return -1
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(values)
+            values.append(value)
+        return code
+
+    def _index_duplicates(self, row: int, duplicates: List[Dict]) -> None:
+        for duplicate in duplicates:
+            code = self._encode(duplicate.get("file_path"), self._source_ids, self.sources)
+            if code >= 0:
+                self._duplicate_rows.setdefault(code, set()).add(row)
+
+    def duplicate_rows(self, source_code: int) -> np.ndarray:
+        """Rows whose dedup back-references include the source, though the row itself is from another"""
+        rows = [row for row in self._duplicate_rows.get(source_code, ()) if row < self._size]
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def _grow(self, n_new: int) -> None:
+        capacity = len(self._columns["source_id"])
+        if self._size + n_new <= capacity and all(c.flags.writeable for c in self._columns.values()):
+            return
+        # Capacity doubling keeps repeated appends amortized O(n); memory-mapped columns are copied out
+        capacity = max(2 * capacity, self._size + n_new, 64)
+        for name, dtype in INT_COLUMNS.items():
+            grown = np.full(capacity, -1, dtype=dtype)
+            grown[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = grown
+
+    def extend(self, metadata: List[Dict]) -> None:
+        self._grow(len(metadata))
+        start = self._size
+        values = {name: np.full(len(metadata), -1, dtype=dtype) for name, dtype in INT_COLUMNS.items()}
+        for i, meta in enumerate(metadata):
+            source = meta.get("file_path")
+            values["source_id"][i] = self._encode(source, self._source_ids, self.sources)
+            values["section_id"][i] = self._encode(meta.get("section"), self._section_ids, self.sections)
+            for key, column in _PLAIN_KEYS.items():
+                if meta.get(key) is not None:
+                    values[column][i] = meta[key]
+
+            extra = {k: v for k, v in meta.items() if k not in _HANDLED_KEYS}
+            chunk_id = meta.get("chunk_id")
+            if chunk_id is not None:
+                prefix = f"{source}_"
+                standard = isinstance(chunk_id, str) and source is not None and chunk_id.startswith(prefix)
+                suffix = chunk_id[len(prefix):] if standard else ""
+                if suffix.isdigit() and str(int(suffix)) == suffix:
+                    values["chunk_no"][i] = int(suffix)
+                else:
+                    extra["chunk_id"] = chunk_id
+            if extra:
+                self._extras[start + i] = extra
+                self._index_duplicates(start + i, extra.get("duplicates", ()))
+
+        for name in INT_COLUMNS:
+            self._columns[name][start:start + len(metadata)] = values[name]
+        self._size += len(metadata)
+
+    def update(self, row: int, **fields) -> None:
+        """Set non-columnar fields on one row (e.g. dedup back-references added after indexing)"""
+        self._extras.setdefault(row, {}).update(fields)
+        self._index_duplicates(row, fields.get("duplicates", ()))
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError(row)
+        meta: Dict[str, Any] = {}
+        source_id = int(self._columns["source_id"][row])
+        if source_id >= 0:
+            meta["file_path"] = self.sources[source_id]
+        chunk_no = int(self._columns["chunk_no"][row])
+        if chunk_no >= 0:
+            meta["chunk_id"] = f"{meta['file_path']}_{chunk_no}"
+        for key, column in _PLAIN_KEYS.items():
+            value = int(self._columns[column][row])
+            if value >= 0:
+                meta[key] = value
+        section_id = int(self._columns["section_id"][row])
+        if section_id >= 0:
+            meta["section"] = self.sections[section_id]
+        meta.update(self._extras.get(row, {}))
+        return meta
+
+    def __iter__(self):
+        return (self[i] for i in range(self._size))
+
+    def code(self, key: str, value: str) -> int:
+        """Dictionary code of a source or section value, -1 if it never occurs"""
+        lookup = self._source_ids if key == "file_path" else self._section_ids
+        return lookup.get(value, -1)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.column(name).nbytes for name in INT_COLUMNS)
+
+    def save(self, directory: str) -> None:
+        for name in INT_COLUMNS:
+            np.save(os.path.join(directory, f"meta_{name}.npy"), self.column(name))
+        with open(os.path.join(directory, "meta_dictionaries.json"), "w") as f:
+            json.dump({"sources": self.sources, "sections": self.sections,
+                       "extras": {str(row): extra for row, extra in self._extras.items()}}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "MetadataStore":
+        columns = {name: np.load(os.path.join(directory, f"meta_{name}.npy"), mmap_mode=mmap_mode)
+                   for name in INT_COLUMNS}
+        with open(os.path.join(directory, "meta_dictionaries.json")) as f:
+            dictionaries = json.load(f)
+        extras = {int(row): extra for row, extra in dictionaries["extras"].items()}
+        return cls(columns, dictionaries["sources"], dictionaries["sections"], extras)
+
+# Filter field name -> (column, dictionary-encoded?)
+FILTER_FIELDS = {
+    "file_path": ("source_id", True),
+    "source": ("source_id", True),
+    "section": ("section_id", True),
+    "page": ("page", False),
+    "start_pos": ("start_pos", False),
+    "doc_version": ("doc_version", False),
+    "chunk_no": ("chunk_no", False),
+}
+
+class Filter:
+    """Boolean expression over metadata columns; `key` identifies it in caches"""
+
+    def __init__(self, key: tuple, compile_mask):
+        self.key = key
+        self._compile_mask = compile_mask
+
+    def mask(self, store: MetadataStore) -> np.ndarray:
+        return self._compile_mask(store)
+
+    def bitset(self, store: MetadataStore) -> np.ndarray:
+        """The mask packed to one bit per row, for shipping to other processes"""
+        return np.packbits(self.mask(store))
+
+    def __and__(self, other: "Filter") -> "Filter":
+        return Filter(("and", self.key, other.key), lambda store: self.mask(store) & other.mask(store))
+
+    def __or__(self, other: "Filter") -> "Filter":
+        return Filter(("or", self.key, other.key), lambda store: self.mask(store) | other.mask(store))
+
+    def __invert__(self) -> "Filter":
+        return Filter(("not", self.key), lambda store: ~self.mask(store))
+
+    def __repr__(self) -> str:
+        return f"Filter{self.key}"
+
+_OPERATORS = {
+    "eq": np.equal, "ne": np.not_equal,
+    "lt": np.less, "lte": np.less_equal, "gt": np.greater, "gte": np.greater_equal,
+}
+
+class Field:
+    """Filter builder for one metadata field: Field("page") >= 3, Field("file_path").isin([...])"""
+
+    def __init__(self, name: str):
+        if name not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field '{name}'; expected one of {sorted(FILTER_FIELDS)}")
+        self.name = name
+        self.column, self.encoded = FILTER_FIELDS[name]
+
+    def _check(self, value) -> None:
+        """Reject operands the column cannot hold, before they reach the vectorized comparison"""
+        if self.encoded:
+            if not isinstance(value, str):
+                raise ValueError(f"Field '{self.name}' filters on strings, got {value!r}")
+        elif isinstance(value, bool) or not isinstance(value, (int, np.integer)):
+            raise ValueError(f"Field '{self.name}' filters on integers, got {value!r}")
+
+    def _compare(self, op: str, value) -> Filter:
+        if self.encoded and op not in ("eq", "ne"):
+            raise ValueError(f"Field '{self.name}' only supports equality filters")
+        self._check(value)
+        compare = _OPERATORS[op]
+
+        def compile_mask(store: MetadataStore) -> np.ndarray:
+            column = store.column(self.column)
+            target = store.code("file_path" if self.column == "source_id" else "section", value) if self.encoded else value
+            mask = compare(column, target)
+            # Rows without the field never match a comparison, including "ne"
+            mask &= column >= 0
+            if op == "eq" and self.column == "source_id" and target >= 0:
+                # Dedup keeps one row for a clause repeated across sources; it still belongs to each of them
+                mask[store.duplicate_rows(target)] = True
+            return mask
+
+        return Filter((op, self.column, value), compile_mask)
+
+    def __eq__(self, value) -> Filter:  # type: ignore[override]
+        return self._compare("eq", value)
+
+    def __ne__(self, value) -> Filter:  # type: ignore[override]
+        return self._compare("ne", value)
+
+    def __lt__(self, value) -> Filter:
+        return self._compare("lt", value)
+
+    def __le__(self, value) -> Filter:
+        return self._compare("lte", value)
+
+    def __gt__(self, value) -> Filter:
+        return self._compare("gt", value)
+
+    def __ge__(self, value) -> Filter:
+        return self._compare("gte", value)
+
+    def between(self, low, high) -> Filter:
+        """Inclusive range"""
+        return (self >= low) & (self <= high)
+
+    def isin(self, values) -> Filter:
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            raise ValueError(f"Field '{self.name}' 'in' filter expects a list, got {values!r}")
+        for value in values:
+            self._check(value)
+        values = tuple(sorted(set(values), key=str))
+
+        def compile_mask(store: MetadataStore) -> np.ndarray:
+            column = store.column(self.column)
+            if self.encoded:
+                kind = "file_path" if self.column == "source_id" else "section"
+                targets = [store.code(kind, v) for v in values]
+            else:
+                targets = list(values)
+            mask = np.isin(column, [t for t in targets if t >= 0])
+            if self.column == "source_id":
+                for target in targets:
+                    if target >= 0:
+                        mask[store.duplicate_rows(target)] = True
+            return mask
+
+        return Filter(("in", self.column, values), compile_mask)
+
+def parse_filters(spec: Dict[str, Any]) -> Optional[Filter]:
+    """Build a Filter from a JSON object; clauses are ANDed.
+
+    {"file_path": "a.pdf", "page": {"gte": 3, "lte": 10}, "section": ["Exclusions", "Definitions"]}
+    """
+    if not spec:
+        return None
+    clauses = []
+    for name, condition in sorted(spec.items()):
+        f = Field(name)
+        if isinstance(condition, dict):
+            for op, value in sorted(condition.items()):
+                if op == "in":
+                    clauses.append(f.isin(value))
+                elif op in _OPERATORS:
+                    clauses.append(f._compare(op, value))
+                else:
+                    raise ValueError(f"Unknown filter operator '{op}'; expected one of {sorted(_OPERATORS) + ['in']}")
+        elif isinstance(condition, list):
+            clauses.append(f.isin(condition))
+        else:
+            clauses.append(f == condition)
+    combined = clauses[0]
+    for clause in clauses[1:]:
+        combined = combined & clause
+    return combined
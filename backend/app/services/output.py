@@ -1,12 +1,25 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+import json
+import re
 from pydantic import BaseModel
 
+# How much of each evidence chunk is returned to the client
+EVIDENCE_MODES = ("full", "snippet", "ids_only")
+DEFAULT_SNIPPET_CHARS = 240
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+_SNIPPET_STOPWORDS = frozenset({
+    "the", "and", "for", "are", "is", "was", "what", "which", "does", "this",
+    "that", "with", "under", "policy", "from", "have", "has", "can", "will",
+    "any", "how", "who", "when", "where", "there", "their", "into", "about",
+})
+
 class Evidence(BaseModel):
     clause_id: str
-    text: str
+    text: Optional[str] = None
     similarity_score: float
     source: str
-    section: str | None = None
+    section: Optional[str] = None
 
 class QueryResult(BaseModel):
     query: str
@@ -16,28 +29,115 @@ class QueryResult(BaseModel):
     decision_rationale: str
     confidence: float
     status: str
-    token_usage: int | None = None
-    processing_time: float | None = None
-
-def generate_json(decision: Dict, retrieved_chunks: List[dict], query: str) -> QueryResult:
-    evidence = [
-        Evidence(
-            clause_id=chunk["clause_id"],
-            text=chunk["text"],
-            similarity_score=chunk["similarity_score"],
-            source=chunk["source"],
-            section=chunk.get("section")
-        ) for chunk in retrieved_chunks
-    ]
-    
-    return QueryResult(
-        query=query,
-        answer=decision.get("answer", "No answer provided"),
-        evidence=evidence,
-        conditions=decision.get("conditions", []),
-        decision_rationale=decision.get("decision_rationale", "No rationale provided"),
-        confidence=decision.get("confidence", 0.9),
-        status=decision.get("status", "conditional"),
-        token_usage=decision.get("token_usage"),
-        processing_time=decision.get("processing_time")
-    )
\ No newline at end of file
+    token_usage: Optional[int] = None
+    processing_time: Optional[float] = None
+
+class BatchQueryResult(BaseModel):
+    results: List[QueryResult]
+
+def _query_terms(query: str) -> List[str]:
+    return [t for t in _TERM_RE.findall(query.lower()) if len(t) > 2 and t not in _SNIPPET_STOPWORDS]
+
+def make_snippet(text: str, query: str, max_chars: int = DEFAULT_SNIPPET_CHARS) -> str:
+    """Cut the window of `text` that contains the most query-term hits"""
+    if len(text) <= max_chars:
+        return text
+
+    terms = _query_terms(query)
+    hits = []
+    if terms:
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in sorted(set(terms), key=len, reverse=True)) + r")", re.IGNORECASE)
+        hits = [m.start() for m in pattern.finditer(text)]
+
+    if hits:
+        # Two-pointer sweep: densest run of hits that fits in one window
+        best_start, best_count, lo = hits[0], 0, 0
+        for hi, pos in enumerate(hits):
+            while pos - hits[lo] > max_chars // 2:
+                lo += 1
+            if hi - lo + 1 > best_count:
+                best_count = hi - lo + 1
+                best_start = hits[lo]
+        start = max(0, best_start - max_chars // 4)
+    else:
+        start = 0
+
+    end = min(len(text), start + max_chars)
+    start = max(0, end - max_chars)
+
+    # Snap to word boundaries so the snippet doesn't start/end mid-word
+    if start > 0:
+        space = text.find(" ", start)
+        if space != -1 and space < end:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        if space > start:
+            end = space
+
+    snippet = text[start:end].strip()
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(text):
+        snippet = snippet + "..."
+    return snippet
+
+def render_evidence(retrieved_chunks: List[dict], query: str, evidence_mode: str = "full") -> List[dict]:
+    """Build evidence dicts for the response, trimming text per `evidence_mode`"""
+    if evidence_mode not in EVIDENCE_MODES:
+        raise ValueError(f"Unknown evidence mode '{evidence_mode}', expected one of {EVIDENCE_MODES}")
+
+    evidence = []
+    for chunk in retrieved_chunks:
+        item = {
+            "clause_id": chunk["clause_id"],
+            "similarity_score": float(chunk["similarity_score"]),
+            "source": chunk["source"],
+            "section": chunk.get("section"),
+        }
+        if evidence_mode == "full":
+            item["text"] = chunk["text"]
+        elif evidence_mode == "snippet":
+            item["text"] = make_snippet(chunk["text"], query)
+        evidence.append(item)
+    return evidence
+
+def _as_float(value, default: float) -> float:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if value == value else default
+
+def _as_strings(value) -> List[str]:
+    """Model output sometimes gives one condition as a bare string, or nests non-string items"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value else []
+    if isinstance(value, (list, tuple)):
+        return [v if isinstance(v, str) else json.dumps(v, default=str) for v in value if v is not None]
+    return [str(value)]
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def render_result(decision: Dict, retrieved_chunks: List[dict], query: str, evidence_mode: str = "full") -> dict:
+    """Build a QueryResult-shaped dict without pydantic, coercing decision fields to the model's types"""
+    return {
+        "query": query,
+        "answer": str(decision.get("answer") or "No answer provided"),
+        "evidence": render_evidence(retrieved_chunks, query, evidence_mode),
+        "conditions": _as_strings(decision.get("conditions")),
+        "decision_rationale": str(decision.get("decision_rationale") or "No rationale provided"),
+        "confidence": _as_float(decision.get("confidence", 0.9), 0.0),
+        "status": str(decision.get("status") or "conditional"),
+        "token_usage": _as_int(decision.get("token_usage")),
+        "processing_time": _as_float(decision["processing_time"], 0.0) if decision.get("processing_time") is not None else None,
+    }
+
+def generate_json(decision: Dict, retrieved_chunks: List[dict], query: str, evidence_mode: str = "full") -> QueryResult:
+    return QueryResult(**render_result(decision, retrieved_chunks, query, evidence_mode))
@@ -1,4 +1,6 @@
-import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
 
 # Import PyMuPDF with error handling
 try:
@@ -8,14 +10,7 @@ except ImportError as e:
     print(f"Warning: PyMuPDF not available: {e}")
     PYMUPDF_AVAILABLE = False
 
-# Import python-docx with error handling
-try:
-    from docx import Document
-    DOCX_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: python-docx not available: {e}")
-    DOCX_AVAILABLE = False
-
+# DOCX files are read straight from their XML, so python-docx is not needed here
 def extract_text_from_pdf(file_path: str) -> str:
     if not PYMUPDF_AVAILABLE:
         raise Exception("PyMuPDF not available for PDF processing")
@@ -30,17 +25,172 @@ def extract_text_from_pdf(file_path: str) -> str:
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+_BODY_BLOCKS = {_W + "p", _W + "tbl", _W + "sectPr", _W + "sdt"}
+_HEADING_STYLE = re.compile(r"^(?:heading|berschrift|titre)\s*(\d)$|^title$", re.IGNORECASE)
+
+def _heading_level(style: str) -> int:
+    """1-9 for heading styles ("Heading2", "Title"), 0 for body text"""
+    match = _HEADING_STYLE.match(style or "")
+    if not match:
+        return 0
+    return int(match.group(1)) if match.group(1) else 1
+
+def iter_docx_blocks(file_path: str):
+    """Stream paragraphs and table rows from word/document.xml in document order
+
+    Yields {"type": "paragraph" | "table_row" | "page_break", "text", "style",
+    "heading_level"} dicts without building the whole document tree.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml_file:
+        table_depth = 0
+        fallback_depth = 0
+        body = None
+        # Open paragraphs, innermost last: a text box (w:txbxContent) nests whole paragraphs inside a run
+        paragraphs = []
+        cells = []
+        cell_parts = []
+
+        for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+            tag = elem.tag
+            if tag == _MC + "Fallback":
+                # Alternate rendering of the mc:Choice content just before it; reading both would duplicate text
+                fallback_depth += 1 if event == "start" else -1
+                continue
+            if fallback_depth:
+                continue
+            if event == "start":
+                if tag == _W + "p":
+                    paragraphs.append({"parts": [], "style": "", "page_breaks": 0})
+                elif tag == _W + "tbl":
+                    table_depth += 1
+                elif tag == _W + "tr" and table_depth == 1:
+                    cells = []
+                elif tag == _W + "tc" and table_depth == 1:
+                    cell_parts = []
+                elif tag == _W + "body":
+                    body = elem
+                continue
+
+            paragraph = paragraphs[-1] if paragraphs else None
+            if tag == _W + "t":
+                if paragraph is not None and elem.text:
+                    paragraph["parts"].append(elem.text)
+            elif tag == _W + "tab":
+                if paragraph is not None:
+                    paragraph["parts"].append("\t")
+            elif tag == _W + "br" or tag == _W + "cr":
+                if paragraph is not None:
+                    paragraph["parts"].append("\n")
+                    if elem.get(_W + "type") == "page" and table_depth == 0:
+                        paragraph["page_breaks"] += 1
+            elif tag == _W + "pStyle":
+                if paragraph is not None:
+                    paragraph["style"] = elem.get(_W + "val", "")
+            elif tag == _W + "p":
+                paragraphs.pop()
+                text = "".join(paragraph["parts"]).strip()
+                style = paragraph["style"]
+                if table_depth:
+                    # Paragraphs inside a cell (or nested table) are folded into the current cell
+                    if text:
+                        cell_parts.append(text)
+                elif text:
+                    yield {"type": "paragraph", "text": text, "style": style, "heading_level": _heading_level(style)}
+                # The break ends the page this paragraph's text is on
+                for _ in range(paragraph["page_breaks"]):
+                    yield {"type": "page_break", "text": "", "style": "", "heading_level": 0}
+                elem.clear()
+            elif tag == _W + "tc" and table_depth == 1:
+                cells.append(" ".join(cell_parts))
+                elem.clear()
+            elif tag == _W + "tr" and table_depth == 1:
+                if any(cells):
+                    yield {"type": "table_row", "text": " | ".join(cells), "style": "", "heading_level": 0}
+                elem.clear()
+            elif tag == _W + "tbl":
+                table_depth -= 1
+                if table_depth == 0:
+                    elem.clear()
+            elif tag == _W + "sectPr":
+                elem.clear()
+
+            if body is not None and not paragraphs and table_depth == 0 and tag in _BODY_BLOCKS:
+                # Cleared blocks are still children of w:body; drop them so memory stays flat on long documents
+                body.clear()
+
 def extract_text_from_docx(file_path: str) -> str:
-    if not DOCX_AVAILABLE:
-        raise Exception("python-docx not available for DOCX processing")
-    
     try:
-        doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text
+        return "\n\n".join(block["text"] for block in iter_docx_blocks(file_path) if block["text"])
     except Exception as e:
         raise Exception(f"Error extracting text from DOCX: {str(e)}")
 
+# DOCX text is handed to the chunker in units of at most this many blocks; a unit is not a page
+DOCX_BLOCKS_PER_UNIT = 50
+_DOCX_PAGE_BREAK = re.compile(rb'<w:br\b[^>]*\bw:type="page"')
+
+def _docx_has_page_breaks(file_path: str) -> bool:
+    """Byte-scan word/document.xml for an explicit page break without parsing it"""
+    tail = b""
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml_file:
+        for block in iter(lambda: xml_file.read(1 << 20), b""):
+            data = tail + block
+            if _DOCX_PAGE_BREAK.search(data):
+                return True
+            tail = data[-256:]
+    return False
+
+def iter_pdf_pages(file_path: str):
+    """Yield the text of one PDF page at a time"""
+    if not PYMUPDF_AVAILABLE:
+        raise Exception("PyMuPDF not available for PDF processing")
+
+    doc = fitz.open(file_path)
+    try:
+        for page in doc:
+            yield page.get_text()
+    finally:
+        doc.close()
+
+def iter_docx_units(file_path: str):
+    """Yield {"text", "section", "page"} for DOCX text split on headings, explicit page breaks, or
+    every DOCX_BLOCKS_PER_UNIT blocks
+
+    "section" is the heading the text sits under. DOCX has no layout, so "page" counts explicit
+    page breaks only, and is None for documents that have none.
+    """
+    page = 1 if _docx_has_page_breaks(file_path) else None
+    blocks = []
+    section = None
+    for block in iter_docx_blocks(file_path):
+        if block["heading_level"] and blocks:
+            # A new heading starts a new section, so text under different headings never shares a unit
+            yield {"text": "\n\n".join(blocks) + "\n\n", "section": section, "page": page}
+            blocks = []
+        if block["heading_level"]:
+            section = block["text"]
+        if block["type"] != "page_break":
+            blocks.append(block["text"])
+        if block["type"] == "page_break" or len(blocks) >= DOCX_BLOCKS_PER_UNIT:
+            if blocks:
+                # Blank line after the unit keeps its last block a separate paragraph
+                yield {"text": "\n\n".join(blocks) + "\n\n", "section": section, "page": page}
+            blocks = []
+        if block["type"] == "page_break" and page is not None:
+            page += 1
+    if blocks:
+        yield {"text": "\n\n".join(blocks) + "\n\n", "section": section, "page": page}
+
+def iter_pages(file_path: str):
+    """Yield {"file_path", "page", "text"} dicts one page (DOCX: one unit) at a time, plus "section" for DOCX"""
+    if file_path.endswith('.pdf'):
+        for page_number, text in enumerate(iter_pdf_pages(file_path), start=1):
+            yield {"file_path": file_path, "page": page_number, "text": text}
+    elif file_path.endswith('.docx'):
+        for unit in iter_docx_units(file_path):
+            yield {"file_path": file_path, **unit}
+
 def parse_files(file_paths: list[str]) -> list[dict]:
     extracted_texts = []
     for file_path in file_paths:
@@ -51,10 +201,7 @@ def parse_files(file_paths: list[str]) -> list[dict]:
                 else:
                     text = f"PDF processing not available for {file_path}"
             elif file_path.endswith('.docx'):
-                if DOCX_AVAILABLE:
-                    text = extract_text_from_docx(file_path)
-                else:
-                    text = f"DOCX processing not available for {file_path}"
+                text = extract_text_from_docx(file_path)
             else:
                 continue
             extracted_texts.append({"file_path": file_path, "text": text})
@@ -0,0 +1,239 @@
+"""
+Streaming ingest pipeline: parse -> chunk -> embed -> index.
+
+Pages flow from the parser into the chunker on a producer thread, which
+groups chunks into fixed-size batches and hands them to the indexing side
+through a bounded queue. When embedding falls behind, the producer blocks on
+the full queue, so no more than `queue_batches` batches are in flight besides
+the index itself.
+
+Multi-file uploads instead parse and chunk each file in a process pool, then
+merge every file's chunks into one index build.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Iterator, Tuple
+
+from .parser import iter_pages
+from .chunker import stream_chunks
+from .dedup import Deduplicator
+
+_DONE = object()
+
+def _sync_back_references(index, first_row: int, dedup: Deduplicator) -> None:
+    """Representatives can absorb duplicates after they were indexed; copy the final lists in"""
+    update = getattr(index.metadata, "update", None)
+    if dedup is None or update is None:
+        return
+    for row, duplicates in dedup.back_references():
+        update(first_row + row, duplicates=duplicates)
+
+def iter_batches(file_paths: List[str], batch_size: int, max_tokens: int = 512, overlap: float = 0.15,
+                 errors: List[Dict] = None) -> Iterator[Tuple[List[str], List[dict]]]:
+    """Yield (chunks, metadata) batches of at most `batch_size` chunks"""
+    def pages():
+        for file_path in file_paths:
+            try:
+                yield from iter_pages(file_path)
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+                if errors is not None:
+                    errors.append({"file_path": file_path, "error": str(e)})
+
+    batch_chunks, batch_meta = [], []
+    for chunk, meta in stream_chunks(pages(), max_tokens, overlap):
+        batch_chunks.append(chunk)
+        batch_meta.append(meta)
+        if len(batch_chunks) >= batch_size:
+            yield batch_chunks, batch_meta
+            batch_chunks, batch_meta = [], []
+    if batch_chunks:
+        yield batch_chunks, batch_meta
+
+def ingest_files(file_paths: List[str], index, batch_size: int = 256, queue_batches: int = 4,
+                 max_tokens: int = 512, overlap: float = 0.15, dedup: Deduplicator = None) -> Dict:
+    """Stream files into `index` (anything with add(chunks, metadata)) and return ingest stats"""
+    start = time.perf_counter()
+    batches: queue.Queue = queue.Queue(maxsize=queue_batches)
+    errors: List[Dict] = []
+    failure: List[BaseException] = []
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for batch in iter_batches(file_paths, batch_size, max_tokens, overlap, errors):
+                # Blocking put is the backpressure point; poll so a failed consumer can stop us
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            batches.put(_DONE)
+
+    first_row = len(index.metadata)
+    producer = threading.Thread(target=produce, name="ingest-producer", daemon=True)
+    producer.start()
+
+    n_chunks = n_batches = cache_hits = 0
+    embed_seconds = 0.0
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                break
+            batch_chunks, batch_meta = batch
+            if dedup is not None:
+                batch_chunks, batch_meta = dedup.filter(batch_chunks, batch_meta)
+            n_batches += 1
+            if not batch_chunks:
+                continue
+            embed_start = time.perf_counter()
+            index.add(batch_chunks, batch_meta)
+            embed_seconds += time.perf_counter() - embed_start
+            n_chunks += len(batch_chunks)
+            cache_hits += getattr(index, "last_build_stats", {}).get("cache_hits", 0)
+    finally:
+        stop.set()
+        # Drain so a producer blocked on put() can finish
+        while producer.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+    if failure:
+        raise failure[0]
+    _sync_back_references(index, first_row, dedup)
+
+    return {
+        "chunks": n_chunks,
+        "batches": n_batches,
+        "errors": errors,
+        "dedup": dedup.stats() if dedup is not None else None,
+        "cache_hits": cache_hits,
+        "cache_hit_ratio": cache_hits / n_chunks if n_chunks else 0.0,
+        "embed_seconds": round(embed_seconds, 4),
+        "total_seconds": round(time.perf_counter() - start, 4),
+    }
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """Process pool shared by multi-file uploads, created on first use"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # Spawned workers, like the index shards: forking a threaded server process can copy held locks
+            _parse_pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+def reset_parse_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken shared pool so the next upload starts fresh workers"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _submit(pool: ProcessPoolExecutor, *args) -> Future:
+    """Submit chunk_file, turning a pool that is already broken into a failed future"""
+    try:
+        return pool.submit(chunk_file, *args)
+    except BrokenProcessPool as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+def chunk_file(file_path: str, max_tokens: int = 512, overlap: float = 0.15) -> Dict:
+    """Parse and chunk one file; runs inside a pool worker, so failures are returned, not raised"""
+    start = time.perf_counter()
+    try:
+        chunks, metadata = [], []
+        for chunk, meta in stream_chunks(iter_pages(file_path), max_tokens, overlap):
+            chunks.append(chunk)
+            metadata.append(meta)
+        error = None
+    except Exception as e:
+        chunks, metadata, error = [], [], str(e)
+    return {
+        "file_path": file_path,
+        "chunks": chunks,
+        "metadata": metadata,
+        "error": error,
+        "parse_seconds": round(time.perf_counter() - start, 4),
+    }
+
+def ingest_files_parallel(file_paths: List[str], index, pool: ProcessPoolExecutor = None,
+                          batch_size: int = 256, max_tokens: int = 512, overlap: float = 0.15,
+                          dedup: Deduplicator = None) -> Dict:
+    """Parse files concurrently in a process pool and add all their chunks to `index`"""
+    start = time.perf_counter()
+    pool = pool or get_parse_pool()
+    futures = [_submit(pool, path, max_tokens, overlap) for path in file_paths]
+    first_row = len(index.metadata)
+
+    files = []
+    n_chunks = cache_hits = 0
+    embed_seconds = 0.0
+    broken = False
+    # Add in upload order so chunk ids and rows are deterministic
+    for path, future in zip(file_paths, futures):
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            # A worker died (crash, OOM kill); its files fail and the pool is replaced below
+            broken = True
+            result = {"file_path": path, "chunks": [], "metadata": [], "error": f"parse worker died: {e}",
+                      "parse_seconds": None}
+        except Exception as e:
+            result = {"file_path": path, "chunks": [], "metadata": [], "error": str(e), "parse_seconds": None}
+
+        file_chunks, file_metadata = result["chunks"], result["metadata"]
+        if dedup is not None and file_chunks:
+            file_chunks, file_metadata = dedup.filter(file_chunks, file_metadata)
+
+        embed_start = time.perf_counter()
+        for i in range(0, len(file_chunks), batch_size):
+            index.add(file_chunks[i:i + batch_size], file_metadata[i:i + batch_size])
+            cache_hits += getattr(index, "last_build_stats", {}).get("cache_hits", 0)
+        file_embed_seconds = time.perf_counter() - embed_start
+        embed_seconds += file_embed_seconds
+        n_chunks += len(file_chunks)
+
+        files.append({
+            "file_path": path,
+            "status": "failed" if result["error"] else "ok",
+            "error": result["error"],
+            "chunks": len(result["chunks"]),
+            "indexed_chunks": len(file_chunks),
+            "parse_seconds": result["parse_seconds"],
+            "embed_seconds": round(file_embed_seconds, 4),
+        })
+
+    if broken:
+        reset_parse_pool(pool)
+    _sync_back_references(index, first_row, dedup)
+    return {
+        "files": files,
+        "chunks": n_chunks,
+        "errors": [{"file_path": f["file_path"], "error": f["error"]} for f in files if f["error"]],
+        "dedup": dedup.stats() if dedup is not None else None,
+        "cache_hits": cache_hits,
+        "cache_hit_ratio": cache_hits / n_chunks if n_chunks else 0.0,
+        "embed_seconds": round(embed_seconds, 4),
+        "total_seconds": round(time.perf_counter() - start, 4),
+    }
@@ -0,0 +1,92 @@
+"""
+In-process caches for repeated questions.
+
+Two levels: a normalized query maps to its query vector, shared by every index
+built with the same embedder version, and each index keeps a map from
+(query, k, filters) to its top-k rows and scores. The result cache is tied to
+the index generation it was filled under and empties itself when the index
+changes. Both are bounded LRUs with O(1) lookup and eviction.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from app.utils.metrics import metrics
+
+DEFAULT_VECTOR_CACHE_SIZE = 1024
+DEFAULT_RESULT_CACHE_SIZE = 1024
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def normalize_query(query: str) -> str:
+    """Case- and punctuation-insensitive key; the hash embedder sees exactly these tokens"""
+    return " ".join(_TOKEN_RE.findall(query.lower()))
+
+class LRUCache:
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+        metrics.incr(f"{self.name}.{'miss' if value is None else 'hit'}")
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+class ResultCache(LRUCache):
+    """Top-k results for one index; entries from an older generation are never served"""
+
+    def __init__(self, name: str = "result_cache", max_size: int = None):
+        super().__init__(name, _result_cache_size if max_size is None else max_size)
+        self.generation = None
+
+    def lookup(self, key: Hashable, generation: int) -> Optional[Any]:
+        with self._lock:
+            if generation != self.generation:
+                self._items.clear()
+                self.generation = generation
+        return self.get(key)
+
+    def store(self, key: Hashable, generation: int, value: Any) -> None:
+        with self._lock:
+            if generation != self.generation:
+                # Filled under an index version that has since changed
+                return
+        self.put(key, value)
+
+query_vectors = LRUCache("query_vector_cache", DEFAULT_VECTOR_CACHE_SIZE)
+_result_cache_size = DEFAULT_RESULT_CACHE_SIZE
+
+def configure(vector_cache_size: int, result_cache_size: int) -> None:
+    """Set cache bounds (0 disables a level); result caches created afterwards use the new size"""
+    global _result_cache_size
+    query_vectors.max_size = vector_cache_size
+    _result_cache_size = result_cache_size
+    if not vector_cache_size:
+        query_vectors.clear()
@@ -0,0 +1,161 @@
+"""
+Local CPU re-ranker for two-stage retrieval.
+
+The first stage over-fetches candidates cheaply; this module re-scores them with
+lexical features (BM25 over body and section title, phrase matches, term
+proximity) and returns the best k. If scoring overruns its latency budget the
+first-stage order is kept.
+"""
+import time
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+from app.utils.helpers import tokenize, query_terms
+
+# Feature weights: first-stage score, body BM25, title BM25, phrase hits, proximity
+FEATURE_WEIGHTS = np.array([1.0, 1.0, 0.5, 0.6, 0.4], dtype=np.float32)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def _section_title(candidate: dict) -> str:
+    """Use the chunk's section if known, otherwise a short leading line as the title"""
+    if candidate.get("section"):
+        return candidate["section"]
+    first_line = candidate.get("text", "").lstrip().split("\n", 1)[0]
+    return first_line if len(first_line.split()) <= 12 else ""
+
+class _Encoded:
+    """Candidates' tokens flattened into one array of query-term ids (-1 for other tokens)"""
+
+    def __init__(self, docs: List[List[str]], terms: List[str]):
+        self.vocab = {t: j for j, t in enumerate(dict.fromkeys(terms))}
+        self.n_docs = len(docs)
+        self.lengths = np.fromiter((len(d) for d in docs), dtype=np.int64, count=len(docs))
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(np.int64)
+        get = self.vocab.get
+        self.ids = np.fromiter((get(tok, -1) for tokens in docs for tok in tokens), dtype=np.int64,
+                               count=int(self.lengths.sum()))
+        self.doc = np.repeat(np.arange(self.n_docs), self.lengths)
+
+def _term_frequencies(encoded: _Encoded, terms: List[str]) -> np.ndarray:
+    """(n_docs, n_terms) term-frequency matrix restricted to the query terms"""
+    n_vocab = len(encoded.vocab)
+    hit = encoded.ids >= 0
+    counts = np.bincount(encoded.doc[hit] * n_vocab + encoded.ids[hit], minlength=encoded.n_docs * n_vocab)
+    tf = counts.reshape(encoded.n_docs, n_vocab).astype(np.float32)
+    return tf[:, [encoded.vocab[t] for t in terms]]
+
+def _bm25(tf: np.ndarray, doc_lengths: np.ndarray) -> np.ndarray:
+    """BM25 over the candidate set, vectorized across candidates and terms"""
+    n_docs = tf.shape[0]
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+    avg_len = max(float(doc_lengths.mean()), 1.0)
+    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_lengths / avg_len)
+    scores = tf * (BM25_K1 + 1.0) / (tf + norm[:, None])
+    return scores @ idf
+
+def _phrase_hits(encoded: _Encoded, terms: List[str]) -> np.ndarray:
+    """Number of query bigrams that appear verbatim in each candidate"""
+    n_vocab = len(encoded.vocab)
+    wanted = np.array(sorted({encoded.vocab[a] * n_vocab + encoded.vocab[b] for a, b in zip(terms, terms[1:])}),
+                      dtype=np.int64)
+    if not len(wanted) or len(encoded.ids) < 2:
+        return np.zeros(encoded.n_docs, dtype=np.float32)
+    first, second = encoded.ids[:-1], encoded.ids[1:]
+    # Adjacent query-term pairs that do not straddle two candidates
+    pair = (first >= 0) & (second >= 0) & (encoded.doc[:-1] == encoded.doc[1:])
+    codes = first[pair] * n_vocab + second[pair]
+    docs = encoded.doc[:-1][pair]
+    # Binary search and a presence matrix rather than np.isin / np.unique, whose first call in a process
+    # costs more than the whole latency budget (NumPy imports numpy.ma lazily)
+    slot = np.minimum(np.searchsorted(wanted, codes), len(wanted) - 1)
+    keep = wanted[slot] == codes
+    # Each distinct bigram counts once per candidate
+    present = np.zeros((encoded.n_docs, len(wanted)), dtype=bool)
+    present[docs[keep], slot[keep]] = True
+    return present.sum(axis=1).astype(np.float32)
+
+def _proximity(encoded: _Encoded) -> np.ndarray:
+    """Matched-term density inside the tightest window covering every matched query term"""
+    n_vocab = len(encoded.vocab)
+    scores = np.zeros(encoded.n_docs, dtype=np.float32)
+    positions = np.flatnonzero(encoded.ids >= 0)
+    if not len(positions):
+        return scores
+    terms, docs = encoded.ids[positions], encoded.doc[positions]
+    present = np.zeros((encoded.n_docs, n_vocab), dtype=bool)
+    present[docs, terms] = True
+    distinct = present.sum(axis=1)
+
+    # For every match, the latest position of each term so far; positions are global, so a value from an
+    # earlier candidate falls before this candidate's offset and does not count
+    last = np.full((len(positions), n_vocab), -1, dtype=np.int64)
+    last[np.arange(len(positions)), terms] = positions
+    last = np.maximum.accumulate(last, axis=0)
+    seen = last >= encoded.offsets[docs][:, None]
+    complete = seen.sum(axis=1) == distinct[docs]
+    # Window ending at this match that covers every distinct term of the candidate
+    window = positions - np.where(seen, last, np.iinfo(np.int64).max).min(axis=1) + 1
+    best = encoded.lengths.copy()
+    np.minimum.at(best, docs[complete], window[complete])
+
+    multi = distinct >= 2
+    scores[multi] = distinct[multi] / np.maximum(best[multi], 1)
+    scores[distinct == 1] = 1.0
+    return scores
+
+def rerank(query: str, candidates: List[dict], k: int = 5, budget_ms: float = 15.0) -> Tuple[List[dict], Dict]:
+    """Re-score first-stage candidates and return the top k plus timing info"""
+    start = time.perf_counter()
+    info = {"candidates": len(candidates), "reranked": False, "elapsed_ms": 0.0}
+
+    terms = query_terms(query)
+    if len(candidates) <= 1 or not terms:
+        return candidates[:k], info
+
+    def over_budget() -> bool:
+        return (time.perf_counter() - start) * 1000.0 > budget_ms
+
+    def fallback() -> Tuple[List[dict], Dict]:
+        info["elapsed_ms"] = (time.perf_counter() - start) * 1000.0
+        return candidates[:k], info
+
+    # Tokenizing long candidates dominates; check the budget as it goes rather than only after every stage
+    docs, titles = [], []
+    for candidate in candidates:
+        docs.append(tokenize(candidate.get("text", "")))
+        titles.append(tokenize(_section_title(candidate)))
+        if over_budget():
+            return fallback()
+
+    similarity = np.array([c.get("similarity_score") or 0.0 for c in candidates], dtype=np.float32)
+    body = _Encoded(docs, terms)
+    title = _Encoded(titles, terms)
+    stages = [
+        # A NaN or infinite first-stage score would poison the min-max normalization of every column
+        lambda: np.nan_to_num(similarity, nan=0.0, posinf=1.0, neginf=-1.0),
+        lambda: _bm25(_term_frequencies(body, terms), body.lengths.astype(np.float32)),
+        lambda: _bm25(_term_frequencies(title, terms), title.lengths.astype(np.float32)),
+        lambda: _phrase_hits(body, terms),
+        lambda: _proximity(body),
+    ]
+    columns = []
+    for compute in stages:
+        columns.append(compute())
+        if over_budget():
+            return fallback()
+    features = np.column_stack(columns).astype(np.float32)
+
+    # Min-max normalize each feature column, then take the weighted sum
+    span = features.max(axis=0) - features.min(axis=0)
+    span[span <= 0] = 1.0
+    scores = ((features - features.min(axis=0)) / span) @ FEATURE_WEIGHTS
+    # Stable sort keeps first-stage order among ties
+    order = np.argsort(-scores, kind="stable")[:k]
+
+    info["reranked"] = True
+    info["elapsed_ms"] = (time.perf_counter() - start) * 1000.0
+    return [candidates[i] for i in order], info
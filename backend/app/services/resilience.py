@@ -0,0 +1,182 @@
+"""
+Tail-latency controls for upstream calls: per-attempt and overall deadlines,
+jittered retries of transient errors, optional hedged requests and a circuit
+breaker.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, TypeVar
+
+from app.utils.metrics import metrics
+
+T = TypeVar("T")
+
+class CircuitOpenError(Exception):
+    """Raised when the breaker is open and the call is not attempted"""
+
+def _status_code(error: Exception):
+    """HTTP status of an SDK error (openai's .status_code, httpx's .response.status_code), if any"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_transient(error: Exception) -> bool:
+    """Timeouts, dropped connections, 5xx and 429 are worth retrying; other errors would fail again"""
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    # SDK timeout and connection errors (openai.APITimeoutError, httpx.ConnectError) do not subclass the builtins
+    return isinstance(error, (TimeoutError, ConnectionError)) or "Timeout" in name or "Connection" in name
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures; half-open probe after a cool-down"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._publish()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"{self.name}.breaker_open", 0.0 if self._state == self.CLOSED else 1.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                # Let exactly one probe through while half-open
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+            self._publish()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    metrics.incr(f"{self.name}.breaker_trips")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+            self._publish()
+
+class ResilientCaller:
+    """Wraps a call that accepts a `timeout` keyword with deadlines, retries and hedging"""
+
+    def __init__(self, name: str, timeout: float = 20.0, max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_max: float = 4.0, deadline: float = None,
+                 hedge: bool = False, hedge_percentile: float = 95.0, hedge_min_samples: int = 20,
+                 breaker: CircuitBreaker = None, max_workers: int = 16,
+                 retryable: Callable[[Exception], bool] = is_transient):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Bound on the whole call, retries and backoff included
+        self.deadline = deadline if deadline is not None else timeout * (max_retries + 1)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker(name)
+        self.retryable = retryable
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-call")
+
+    def _hedge_delay(self):
+        if not self.hedge:
+            return None
+        return metrics.percentile(f"{self.name}.latency", self.hedge_percentile, self.hedge_min_samples)
+
+    def _attempt(self, fn: Callable[..., T], timeout: float) -> T:
+        """One logical attempt, optionally hedged with a second request after the p95 delay"""
+        start = time.monotonic()
+        futures = [self._executor.submit(fn, timeout=timeout)]
+        hedge_delay = self._hedge_delay()
+
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                metrics.incr(f"{self.name}.hedges")
+                futures.append(self._executor.submit(fn, timeout=timeout - (time.monotonic() - start)))
+
+        pending = set(futures)
+        last_error = None
+        try:
+            while pending:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is not futures[0]:
+                            metrics.incr(f"{self.name}.hedge_wins")
+                        metrics.observe(f"{self.name}.latency", time.monotonic() - start)
+                        return future.result()
+                    last_error = future.exception()
+        finally:
+            # The losing or timed-out request should not hold a worker if it has not started yet
+            for future in pending:
+                future.cancel()
+
+        if last_error is not None and not pending:
+            raise last_error
+        metrics.incr(f"{self.name}.timeouts")
+        raise TimeoutError(f"{self.name} call exceeded {timeout:.2f}s deadline")
+
+    def call(self, fn: Callable[..., T]) -> T:
+        """Run `fn(timeout=...)` under the breaker; raises CircuitOpenError or the last error"""
+        if not self.breaker.allow():
+            metrics.incr(f"{self.name}.short_circuited")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        metrics.incr(f"{self.name}.calls")
+        give_up_at = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = self._attempt(fn, min(self.timeout, give_up_at - time.monotonic()))
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                metrics.incr(f"{self.name}.errors")
+                if not self.retryable(e):
+                    # The upstream answered; a bad request says nothing about its health
+                    self.breaker.record_success()
+                    metrics.incr(f"{self.name}.failures")
+                    raise
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if attempt == self.max_retries or time.monotonic() + backoff >= give_up_at:
+                    # One breaker failure per logical call, however many attempts it took
+                    self.breaker.record_failure()
+                    metrics.incr(f"{self.name}.failures")
+                    raise
+                metrics.incr(f"{self.name}.retries")
+                # Full jitter: sleep uniformly up to the exponential cap
+                time.sleep(backoff)
@@ -0,0 +1,254 @@
+"""
+Sharded scatter-gather retrieval across local worker processes.
+
+ShardedIndex behaves like SimpleEmbedder, but its embedding rows live in N
+worker processes instead of the coordinator. A query is embedded once and
+sent to every shard, each shard computes a local top-k over its rows in
+parallel, and the coordinator merges the partial results with a heap. New
+rows go to the least-loaded shards, so shards stay balanced as documents are
+ingested.
+
+Requests to a shard carry an ID and a reader thread per shard hands each
+reply to its waiting caller, so concurrent queries pipeline through the
+shards instead of queueing on one lock. Callers that may outlive the index's
+time as the active one pin it; a retired index stops its shard processes when
+the last pin is released.
+"""
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+from .simple_embedder import SimpleEmbedder, DEFAULT_DIM
+from .embedding_cache import EmbeddingCache
+from app.utils.metrics import metrics
+
+def _shard_worker(conn, dim: int) -> None:
+    """Shard process: holds a slice of the embedding matrix and answers local top-k queries"""
+    buffer = np.zeros((0, dim), dtype=np.float32)
+    id_buffer = np.zeros(0, dtype=np.int64)
+    n = 0
+    while True:
+        request_id, command, *args = conn.recv()
+        if command == "search":
+            query, k, bits, n_total = args
+            start = time.perf_counter()
+            scores = buffer[:n] @ query if n else None
+            if bits is not None and n:
+                # The filter arrives as a packed bitset over global row ids
+                allowed = np.unpackbits(bits, count=n_total).astype(bool)[id_buffer[:n]]
+                scores[~allowed] = -np.inf
+                k = min(k, int(allowed.sum()))
+            if n and k > 0:
+                k = min(k, n)
+                top = np.argpartition(-scores, k - 1)[:k]
+                result = (scores[top], id_buffer[top])
+            else:
+                result = (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+            conn.send((request_id, result + (time.perf_counter() - start,)))
+        elif command == "add":
+            new_ids, new_vectors = args
+            if n + len(new_ids) > len(buffer):
+                # Grow geometrically so repeated ingests stay amortized O(n)
+                capacity = max(2 * len(buffer), n + len(new_ids), 64)
+                grown = np.zeros((capacity, dim), dtype=np.float32)
+                grown_ids = np.zeros(capacity, dtype=np.int64)
+                grown[:n], grown_ids[:n] = buffer[:n], id_buffer[:n]
+                buffer, id_buffer = grown, grown_ids
+            buffer[n:n + len(new_ids)] = new_vectors
+            id_buffer[n:n + len(new_ids)] = new_ids
+            n += len(new_ids)
+            conn.send((request_id, n))
+        elif command == "reset":
+            buffer = np.zeros((0, dim), dtype=np.float32)
+            id_buffer = np.zeros(0, dtype=np.int64)
+            n = 0
+            conn.send((request_id, 0))
+        elif command == "take":
+            # Hand back the last rows so the coordinator can move them to another shard
+            count = min(args[0], n)
+            conn.send((request_id, (id_buffer[n - count:n].copy(), buffer[n - count:n].copy())))
+            n -= count
+        elif command == "stop":
+            conn.close()
+            return
+
+class ShardedIndex(SimpleEmbedder):
+    """SimpleEmbedder whose vectors are partitioned across worker processes"""
+
+    def __init__(self, num_shards: int = 2, dim: int = DEFAULT_DIM, cache: EmbeddingCache = None):
+        super().__init__(dim=dim, cache=cache)
+        self.num_shards = num_shards
+        self.shard_rows = [0] * num_shards
+        self._rows = 0
+        # Serializes changes to the row layout (add, reset, rebalance); searches do not take it
+        self._lock = threading.Lock()
+        self._send_locks = [threading.Lock() for _ in range(num_shards)]
+        self._pending: List[Dict[int, Future]] = [{} for _ in range(num_shards)]
+        self._request_ids = itertools.count()
+        self._refs_lock = threading.Lock()
+        self._refs = 0
+        self._retired = False
+        context = multiprocessing.get_context("spawn")
+        self._conns = []
+        self._processes = []
+        for i in range(num_shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child, dim), name=f"index-shard-{i}", daemon=True)
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        for i in range(num_shards):
+            threading.Thread(target=self._read_replies, args=(i,), name=f"index-shard-{i}-reader", daemon=True).start()
+
+    def _request(self, shard: int, command: str, *args) -> Future:
+        """Send one command to a shard; the future resolves when its reply arrives"""
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._send_locks[shard]:
+            if shard >= len(self._conns):
+                raise ConnectionError(f"Index shard {shard} is closed")
+            self._pending[shard][request_id] = future
+            self._conns[shard].send((request_id, command) + args)
+        return future
+
+    def _read_replies(self, shard: int) -> None:
+        conn = self._conns[shard]
+        try:
+            while True:
+                request_id, result = conn.recv()
+                self._pending[shard].pop(request_id).set_result(result)
+        except (EOFError, OSError):
+            with self._send_locks[shard]:
+                for future in self._pending[shard].values():
+                    future.set_exception(ConnectionError(f"Index shard {shard} stopped"))
+                self._pending[shard].clear()
+
+    def build_index(self, chunks: List[Any], metadata: List[Dict[str, Any]] = None) -> None:
+        """Drop every shard's rows, then index `chunks` from scratch"""
+        with self._lock:
+            for future in [self._request(shard, "reset") for shard in range(self.num_shards)]:
+                future.result()
+            self.shard_rows = [0] * self.num_shards
+            self._rows = 0
+        super().build_index(chunks, metadata)
+
+    def _placement(self, n_new: int) -> List[int]:
+        """How many of the new rows each shard receives, filling the least-loaded first"""
+        counts = list(self.shard_rows)
+        target = (sum(counts) + n_new) // self.num_shards
+        extra = (sum(counts) + n_new) % self.num_shards
+        order = sorted(range(self.num_shards), key=lambda i: counts[i])
+        quota = [0] * self.num_shards
+        remaining = n_new
+        for rank, i in enumerate(order):
+            want = max(0, target + (1 if rank < extra else 0) - counts[i])
+            quota[i] = min(want, remaining)
+            remaining -= quota[i]
+        quota[order[0]] += remaining
+        return quota
+
+    def _append_rows(self, vectors: np.ndarray) -> None:
+        with self._lock:
+            ids = np.arange(self._rows, self._rows + len(vectors), dtype=np.int64)
+            offset = 0
+            pending = {}
+            for shard, count in enumerate(self._placement(len(vectors))):
+                if count:
+                    pending[shard] = self._request(shard, "add", ids[offset:offset + count], vectors[offset:offset + count])
+                    offset += count
+            for shard, future in pending.items():
+                self.shard_rows[shard] = future.result()
+                metrics.set_gauge(f"shard.{shard}.rows", self.shard_rows[shard])
+            self._rows += len(vectors)
+        # The coordinator keeps only a row-count placeholder, not the vectors
+        self.embeddings = np.zeros((self._rows, 0), dtype=np.float32)
+
+    def rebalance(self, tolerance: int = 1) -> int:
+        """Move rows from the fullest to the emptiest shard until counts differ by at most `tolerance`.
+
+        Rows are briefly on neither shard while they move, so only call this before the index serves queries.
+        """
+        moved = 0
+        with self._lock:
+            while max(self.shard_rows) - min(self.shard_rows) > tolerance:
+                src = self.shard_rows.index(max(self.shard_rows))
+                dst = self.shard_rows.index(min(self.shard_rows))
+                n = (self.shard_rows[src] - self.shard_rows[dst]) // 2
+                ids, vectors = self._request(src, "take", n).result()
+                self.shard_rows[src] -= len(ids)
+                self.shard_rows[dst] = self._request(dst, "add", ids, vectors).result()
+                moved += len(ids)
+            for shard, rows in enumerate(self.shard_rows):
+                metrics.set_gauge(f"shard.{shard}.rows", rows)
+        return moved
+
+    def _search(self, query_vector: np.ndarray, top_k: int, mask: np.ndarray = None) -> List[Tuple[int, float]]:
+        """Scatter the query to every shard and merge the local top-k lists"""
+        if not self._rows:
+            return []
+
+        start = time.perf_counter()
+        bits = np.packbits(mask) if mask is not None else None
+        rows = self._rows
+        futures = [self._request(shard, "search", query_vector, top_k, bits, rows) for shard in range(self.num_shards)]
+        partials = [future.result() for future in futures]
+
+        candidates = []
+        for shard, (scores, ids, elapsed) in enumerate(partials):
+            metrics.observe(f"shard.{shard}.search", elapsed)
+            # Rows masked out by a filter come back as -inf
+            keep = scores != -np.inf
+            scores = np.nan_to_num(scores[keep], nan=0.0, posinf=0.0)
+            candidates.extend(zip(scores.tolist(), ids[keep].tolist()))
+        # Ties resolve to the lower row id, matching the unsharded ordering
+        best = heapq.nlargest(top_k, candidates, key=lambda c: (c[0], -c[1]))
+        metrics.observe("sharded.search", time.perf_counter() - start)
+
+        return [(int(idx), float(score)) for score, idx in best]
+
+    def pin(self) -> bool:
+        """Keep the shard processes alive for one caller; False once the index has been retired"""
+        with self._refs_lock:
+            if self._retired:
+                return False
+            self._refs += 1
+            return True
+
+    def unpin(self) -> None:
+        with self._refs_lock:
+            self._refs -= 1
+            idle = self._retired and self._refs == 0
+        if idle:
+            # The last in-flight request should not wait for the shard processes to exit
+            threading.Thread(target=self.close, name="index-shard-shutdown", daemon=True).start()
+
+    def retire(self) -> None:
+        """Stop the shard processes as soon as no caller has the index pinned"""
+        with self._refs_lock:
+            self._retired = True
+            idle = self._refs == 0
+        if idle:
+            self.close()
+
+    def close(self) -> None:
+        conns, processes = self._conns, self._processes
+        for shard, (conn, process) in enumerate(zip(conns, processes)):
+            with self._send_locks[shard]:
+                try:
+                    conn.send((None, "stop"))
+                except (OSError, BrokenPipeError):
+                    pass
+            process.join(timeout=1)
+            conn.close()
+        self._conns, self._processes = [], []
+
+    def __del__(self):
+        if getattr(self, "_conns", None):
+            self.close()
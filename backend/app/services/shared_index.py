@@ -0,0 +1,169 @@
+"""
+Index shared across uvicorn worker processes through memory-mapped files.
+
+The worker that ingests a document publishes the embedding matrix, a
+chunk-text buffer and the columnar metadata store into a new generation
+directory, then atomically repoints the CURRENT file at it. Every worker
+attaches read-only with np.load(mmap_mode="r"), so the OS page cache holds
+one copy of the index no matter how many workers there are. Workers switch
+to a new generation the next time they look up the index after CURRENT
+changes.
+"""
+import os
+import json
+import shutil
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from .simple_embedder import SimpleEmbedder
+from .metadata_store import MetadataStore
+from .clause_facts import ClauseFactIndex
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+CURRENT_FILE = "CURRENT"
+KEEP_GENERATIONS = 2
+# Re-reads of CURRENT when the generation being attached is deleted underneath the reader
+ATTACH_ATTEMPTS = 5
+
+class TextColumn:
+    """Read-only sequence of strings stored as one UTF-8 buffer plus row offsets"""
+
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    @staticmethod
+    def write(path: str, texts: List[str]) -> None:
+        encoded = [t.encode("utf-8") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        with open(f"{path}.bin", "wb") as f:
+            for e in encoded:
+                f.write(e)
+        np.save(f"{path}.offsets.npy", offsets)
+
+    @classmethod
+    def open(cls, path: str) -> "TextColumn":
+        offsets = np.load(f"{path}.offsets.npy", mmap_mode="r")
+        size = int(offsets[-1])
+        buffer = np.memmap(f"{path}.bin", dtype=np.uint8, mode="r", shape=(size,)) if size else np.zeros(0, dtype=np.uint8)
+        return cls(buffer, offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._buffer[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def _read_generation(root: str) -> Optional[int]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def publish(index: SimpleEmbedder, root: str) -> int:
+    """Write the index as a new generation and atomically make it current"""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "a") as lock_file:
+        if FCNTL_AVAILABLE:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            generation = (_read_generation(root) or 0) + 1
+            final_dir = os.path.join(root, f"gen-{generation}")
+            tmp_dir = final_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            texts = [c if isinstance(c, str) else c.get("text", "") for c in index.chunks]
+            metadata = index.metadata
+            if not isinstance(metadata, MetadataStore):
+                metadata = MetadataStore.from_dicts(metadata)
+
+            np.save(os.path.join(tmp_dir, "embeddings.npy"), np.ascontiguousarray(index.embeddings, dtype=np.float32))
+            TextColumn.write(os.path.join(tmp_dir, "texts"), texts)
+            metadata.save(tmp_dir)
+            index.clause_facts.save(tmp_dir)
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump({"generation": generation, "dim": index.dim, "version": index.version,
+                           "count": len(texts)}, f)
+
+            os.rename(tmp_dir, final_dir)
+            tmp_current = os.path.join(root, CURRENT_FILE + ".tmp")
+            with open(tmp_current, "w") as f:
+                f.write(str(generation))
+            os.replace(tmp_current, os.path.join(root, CURRENT_FILE))
+
+            # Readers keep their mappings alive after unlink, so old generations can go
+            for old in range(1, generation - KEEP_GENERATIONS + 1):
+                shutil.rmtree(os.path.join(root, f"gen-{old}"), ignore_errors=True)
+            return generation
+        finally:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def attach(root: str, generation: int) -> SimpleEmbedder:
+    """Open one published generation read-only"""
+    gen_dir = os.path.join(root, f"gen-{generation}")
+    return SimpleEmbedder.from_arrays(
+        np.load(os.path.join(gen_dir, "embeddings.npy"), mmap_mode="r"),
+        TextColumn.open(os.path.join(gen_dir, "texts")),
+        MetadataStore.load(gen_dir, mmap_mode="r"),
+        generation=generation,
+        clause_facts=ClauseFactIndex.load(gen_dir),
+    )
+
+class SharedIndex:
+    """Per-worker handle that follows the CURRENT generation"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._index: Optional[SimpleEmbedder] = None
+        self._generation: Optional[int] = None
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self._generation
+
+    def publish(self, index: SimpleEmbedder) -> int:
+        generation = publish(index, self.root)
+        self.current()
+        return generation
+
+    def current(self) -> Optional[SimpleEmbedder]:
+        """The latest published index, re-attaching if another worker published a new one"""
+        generation = _read_generation(self.root)
+        if generation is None or generation == self._generation:
+            return self._index
+        with self._lock:
+            for _ in range(ATTACH_ATTEMPTS):
+                if generation is None or generation == self._generation:
+                    break
+                try:
+                    self._index = attach(self.root, generation)
+                    self._generation = generation
+                    break
+                except FileNotFoundError:
+                    # Newer publishes deleted this generation between reading CURRENT and opening its files
+                    latest = _read_generation(self.root)
+                    if latest == generation:
+                        raise
+                    generation = latest
+            else:
+                raise RuntimeError(f"Shared index under {self.root} kept changing while attaching")
+        return self._index
@@ -1,123 +1,335 @@
 """
 Simplified embedder service for initial testing without FAISS
+
+Chunks are embedded with a fit-free feature-hashing scheme: word unigrams,
+word bigrams and character n-grams are hashed with a signed hashing trick into
+a fixed number of dimensions, weighted by sublinear TF and L2-normalized.
+There is no vocabulary to fit, so new chunks can be added to an existing index
+without re-embedding the old ones.
 """
+import os
+import re
+import threading
+import zlib
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from .embedding_cache import EmbeddingCache, embed_with_cache, DEFAULT_MAX_ROWS
+from .query_cache import ResultCache, query_vectors, normalize_query
+from .metadata_store import MetadataStore, Filter
+from .clause_facts import ClauseFactIndex
+
+DEFAULT_DIM = 512
+CHAR_NGRAM_SIZES = (3, 4)
+CHAR_NGRAM_WEIGHT = 0.5
+
+# Bump when the feature scheme changes so cached vectors are not reused across versions
+EMBEDDER_VERSION = "hash-v1"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_BIGRAM_MIX = np.uint64(0x9E3779B1)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+class FeatureHasher:
+    """Hashes tokens and their character n-grams, caching per distinct token.
+
+    The cache is shared by /ask/ threadpool calls and ingest threads, so id assignment,
+    lookups and resets happen under one lock; token ids are only valid until the next reset.
+    """
+
+    def __init__(self, max_tokens: int = 200_000):
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self._token_ids: Dict[str, int] = {}
+        self._word_hashes: List[int] = []
+        self._ngram_hashes: List[np.ndarray] = []
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _token_id(self, token: str) -> int:
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            token_id = len(self._word_hashes)
+            self._token_ids[token] = token_id
+            self._word_hashes.append(zlib.crc32(b"w:" + token.encode()))
+            padded = f"<{token}>"
+            grams = {padded[i:i + n] for n in CHAR_NGRAM_SIZES for i in range(len(padded) - n + 1)}
+            self._ngram_hashes.append(np.fromiter(
+                (zlib.crc32(b"c:" + g.encode()) for g in grams), dtype=np.uint64, count=len(grams)))
+        return token_id
+
+    def features(self, texts: List[str]):
+        """Return flat (row, feature hash, count, weight) arrays for a batch of texts"""
+        with self._lock:
+            return self._features(texts)
+
+    def _features(self, texts: List[str]):
+        if len(self._token_ids) > self.max_tokens:
+            self._clear()
+
+        doc_tokens = [_TOKEN_RE.findall(text.lower()) for text in texts]
+        ids = np.fromiter((self._token_id(t) for tokens in doc_tokens for t in tokens), dtype=np.int64)
+        lengths = np.fromiter((len(tokens) for tokens in doc_tokens), dtype=np.int64, count=len(texts))
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        word_hashes = np.asarray(self._word_hashes, dtype=np.uint64)
+        token_hashes = word_hashes[ids] if len(ids) else np.zeros(0, dtype=np.uint64)
+
+        # Word bigrams: mix consecutive token hashes, skipping pairs that span two documents
+        same_doc = rows[1:] == rows[:-1]
+        bigram_hashes = ((token_hashes[:-1] * _BIGRAM_MIX) ^ token_hashes[1:])[same_doc] & _MASK32
+        bigram_rows = rows[1:][same_doc]
+
+        # Character n-grams come from each (document, distinct token) pair
+        pair_keys, pair_counts = np.unique(rows * len(word_hashes) + ids, return_counts=True) if len(ids) else (ids, ids)
+        pair_rows = pair_keys // max(len(word_hashes), 1)
+        pair_ids = pair_keys % max(len(word_hashes), 1)
+        gram_arrays = [self._ngram_hashes[i] for i in pair_ids]
+        gram_lengths = np.fromiter((len(a) for a in gram_arrays), dtype=np.int64, count=len(gram_arrays))
+        gram_hashes = np.concatenate(gram_arrays) if gram_arrays else np.zeros(0, dtype=np.uint64)
+        gram_rows = np.repeat(pair_rows, gram_lengths)
+        gram_counts = np.repeat(pair_counts, gram_lengths)
+
+        all_rows = np.concatenate([rows, bigram_rows, gram_rows])
+        all_hashes = np.concatenate([token_hashes, bigram_hashes, gram_hashes])
+        all_counts = np.concatenate([
+            np.ones(len(rows) + len(bigram_rows), dtype=np.float32),
+            gram_counts.astype(np.float32),
+        ])
+        all_weights = np.concatenate([
+            np.ones(len(rows) + len(bigram_rows), dtype=np.float32),
+            np.full(len(gram_rows), CHAR_NGRAM_WEIGHT, dtype=np.float32),
+        ])
+        return all_rows, all_hashes, all_counts, all_weights
+
+def hash_embed(texts: List[str], dim: int = DEFAULT_DIM, hasher: FeatureHasher = None) -> np.ndarray:
+    """Embed a batch of texts into an (n, dim) float32 matrix of unit-norm rows"""
+    hasher = hasher or _default_hasher
+    rows, hashes, counts, weights = hasher.features(texts)
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    if not len(rows):
+        return out
+
+    # Term frequency per (document, feature) pair, then sublinear TF
+    keys = rows.astype(np.uint64) << np.uint64(32) | hashes
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    tf = np.bincount(inverse, weights=counts).astype(np.float32)
+    weight = np.bincount(inverse, weights=weights).astype(np.float32) / np.bincount(inverse).astype(np.float32)
+    values = (1.0 + np.log(tf)) * weight
+
+    # Signed hashing trick: low bits pick the bucket, bit 31 picks the sign
+    feature_hashes = unique_keys & _MASK32
+    buckets = (feature_hashes % np.uint64(dim)).astype(np.int64)
+    signs = np.where((feature_hashes >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+    feature_rows = (unique_keys >> np.uint64(32)).astype(np.int64)
+
+    flat = np.bincount(feature_rows * dim + buckets, weights=values * signs, minlength=len(texts) * dim)
+    out[:] = flat.reshape(len(texts), dim)
+
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out
+
+_default_hasher = FeatureHasher()
 
 class SimpleEmbedder:
-    """Simple embedder that creates basic embeddings without FAISS"""
-    
-    def __init__(self):
-        self.embeddings = []
+    """Simple embedder that creates feature-hashing embeddings without FAISS"""
+
+    def __init__(self, dim: int = DEFAULT_DIM, cache: EmbeddingCache = None):
+        self.dim = dim
+        self.version = f"{EMBEDDER_VERSION}-d{dim}"
+        self.cache = cache
+        self.embeddings = np.zeros((0, dim), dtype=np.float32)
+        self._buffer = None
         self.chunks = []
-        self.metadata = []
-    
+        self.metadata = MetadataStore()
+        self.last_build_stats = {}
+        # Bumped on every change so readers can tell index versions apart
+        self.generation = 0
+        self.result_cache = ResultCache()
+        # Coverage/waiting-period/limit facts extracted at ingest, for templated questions
+        self.clause_facts = ClauseFactIndex()
+
+    @classmethod
+    def from_arrays(cls, embeddings: np.ndarray, chunks, metadata, generation: int = 0,
+                    clause_facts: ClauseFactIndex = None) -> "SimpleEmbedder":
+        """Wrap precomputed (possibly memory-mapped) embeddings without re-embedding"""
+        embedder = cls(dim=embeddings.shape[1])
+        if clause_facts is not None:
+            embedder.clause_facts = clause_facts
+        embedder.embeddings = embeddings
+        embedder.chunks = chunks
+        embedder.metadata = metadata if isinstance(metadata, MetadataStore) else MetadataStore.from_dicts(metadata)
+        embedder.generation = generation
+        return embedder
+
     def build_index(self, chunks: List[Any], metadata: List[Dict[str, Any]] = None) -> None:
         """Build a simple index from chunks"""
-        self.chunks = chunks
-        self.metadata = metadata or []
-        
-        # Create simple embeddings (just for testing)
-        self.embeddings = []
-        for i, chunk in enumerate(chunks):
-            # Handle both string and dict formats
-            if isinstance(chunk, str):
-                text = chunk
-            else:
-                text = chunk.get('text', '')
-            embedding = self._simple_embed(text)
-            self.embeddings.append(embedding)
-    
-    def _simple_embed(self, text: str) -> np.ndarray:
-        """Create a simple embedding for testing"""
-        # Simple hash-based embedding (not for production)
-        import hashlib
-        hash_obj = hashlib.md5(text.encode())
-        hash_bytes = hash_obj.digest()
-        
-        # Convert to numpy array
-        embedding = np.frombuffer(hash_bytes, dtype=np.float32)
-        # Pad or truncate to 128 dimensions
-        if len(embedding) < 128:
-            embedding = np.pad(embedding, (0, 128 - len(embedding)), 'constant')
+        self.chunks = []
+        self.metadata = MetadataStore()
+        self.clause_facts = ClauseFactIndex()
+        self.embeddings = np.zeros((0, self.dim), dtype=np.float32)
+        self._buffer = None
+        self.add(chunks, metadata)
+
+    def add(self, chunks: List[Any], metadata: List[Dict[str, Any]] = None) -> None:
+        """Embed and append more chunks without touching the existing rows"""
+        # Handle both string and dict formats
+        texts = [chunk if isinstance(chunk, str) else chunk.get('text', '') for chunk in chunks]
+        if self.cache is not None:
+            vectors, self.last_build_stats = embed_with_cache(texts, self.embed_batch, self.cache)
         else:
-            embedding = embedding[:128]
-        
-        return embedding
-    
-    def retrieve(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Retrieve similar chunks based on query"""
-        if not self.embeddings or not self.chunks:
+            vectors = self.embed_batch(texts)
+            self.last_build_stats = {"chunks": len(texts), "cache_hits": 0, "embedded": len(texts), "cache_hit_ratio": 0.0}
+        self.clause_facts.add(texts, first_row=len(self.embeddings))
+        self._append_rows(vectors)
+        # Read-only columns (e.g. a shared index) become private copies on first append
+        if not isinstance(self.chunks, list):
+            self.chunks = list(self.chunks)
+        self.chunks.extend(chunks)
+        # Keep metadata rows aligned with embedding rows even when none is given
+        self.metadata.extend(metadata if metadata is not None else [{}] * len(chunks))
+        self.generation += 1
+
+    def _append_rows(self, vectors: np.ndarray) -> None:
+        """Append to a capacity-doubling buffer so repeated adds stay amortized O(n)"""
+        n_rows, n_new = len(self.embeddings), len(vectors)
+        buffer = self._buffer if self._buffer is not None else self.embeddings
+        if n_rows + n_new > len(buffer) or not buffer.flags.writeable:
+            capacity = max(2 * len(buffer), n_rows + n_new, 64)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:n_rows] = self.embeddings
+            buffer = grown
+        buffer[n_rows:n_rows + n_new] = vectors
+        self._buffer = buffer
+        self.embeddings = buffer[:n_rows + n_new]
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed a list of texts in one vectorized pass"""
+        return hash_embed(texts, self.dim)
+
+    def _simple_embed(self, text: str) -> np.ndarray:
+        """Embed a single query, reusing the vector if the same normalized query was seen before"""
+        key = (self.version, normalize_query(text))
+        vector = query_vectors.get(key)
+        if vector is None:
+            vector = self.embed_batch([key[1]])[0]
+            vector.flags.writeable = False
+            query_vectors.put(key, vector)
+        return vector
+
+    def _result(self, idx: int, similarity: float) -> Dict[str, Any]:
+        chunk = self.chunks[idx]
+        meta = self.metadata[idx] if idx < len(self.metadata) else {}
+        if isinstance(chunk, str):
+            return {
+                'text': chunk,
+                'similarity_score': similarity,
+                'clause_id': meta.get('chunk_id', f"chunk_{idx}"),
+                'source': meta.get('file_path', 'document'),
+                'section': meta.get('section')
+            }
+        result = chunk.copy()
+        result['similarity_score'] = similarity
+        result['clause_id'] = f"chunk_{idx}"
+        result['source'] = chunk.get('source', 'document')
+        return result
+
+    def retrieve(self, query: str, top_k: int = 5, filters: Filter = None) -> List[Dict[str, Any]]:
+        """Retrieve similar chunks based on query, optionally restricted to chunks matching `filters`"""
+        if not len(self.embeddings) or not len(self.chunks):
             return []
-        
-        # Create query embedding
-        query_embedding = self._simple_embed(query)
-        
-        # Calculate similarities
-        similarities = []
-        for i, embedding in enumerate(self.embeddings):
-            # Avoid division by zero
-            query_norm = np.linalg.norm(query_embedding)
-            embedding_norm = np.linalg.norm(embedding)
-            
-            if query_norm > 0 and embedding_norm > 0:
-                similarity = np.dot(query_embedding, embedding) / (query_norm * embedding_norm)
-                # Handle NaN values
-                if np.isnan(similarity):
-                    similarity = 0.0
-            else:
-                similarity = 0.0
-                
-            similarities.append((similarity, i))
-        
-        # Sort by similarity
-        similarities.sort(reverse=True)
-        
-        # Return top_k results
-        results = []
-        for similarity, idx in similarities[:top_k]:
-            # Ensure similarity is a valid float
-            if np.isnan(similarity) or np.isinf(similarity):
-                similarity = 0.0
-            
-            chunk = self.chunks[idx]
-            if isinstance(chunk, str):
-                result = {
-                    'text': chunk,
-                    'similarity_score': float(similarity),
-                    'clause_id': f"chunk_{idx}",
-                    'source': 'document'
-                }
-            else:
-                result = chunk.copy()
-                result['similarity_score'] = float(similarity)
-                result['clause_id'] = f"chunk_{idx}"
-                result['source'] = chunk.get('source', 'document')
-            results.append(result)
-        
-        return results
-
-def build_index(chunks: List[Any], metadata: List[Dict[str, Any]] = None):
+
+        generation = self.generation
+        key = (normalize_query(query), top_k, filters.key if filters is not None else None)
+        hits = self.result_cache.lookup(key, generation)
+        if hits is None:
+            mask = self.filter_mask(filters) if filters is not None else None
+            hits = self._search(self._simple_embed(query), top_k, mask)
+            self.result_cache.store(key, generation, hits)
+        # Fresh dicts every time, so callers can modify results without touching the cache
+        return [self._result(idx, score) for idx, score in hits]
+
+    def answer_from_facts(self, question: str, filters: Filter = None) -> Optional[Tuple[Dict, List[Dict[str, Any]]]]:
+        """(decision, evidence chunks) from the clause fact index, or None if the question needs retrieval"""
+        allowed = self.filter_mask(filters) if filters is not None else None
+        found = self.clause_facts.answer(question, allowed)
+        if found is None:
+            return None
+        decision, supporting = found
+        # The clauses that state the fact are the evidence, one entry per chunk
+        rows = dict.fromkeys(fact["row"] for fact in supporting)
+        return decision, [self._result(row, 1.0) for row in rows]
+
+    def filter_mask(self, filters: Filter) -> np.ndarray:
+        """Filter mask over embedding rows (rows without metadata never match)"""
+        mask = filters.mask(self.metadata)
+        n_rows = len(self.embeddings)
+        if len(mask) < n_rows:
+            mask = np.concatenate([mask, np.zeros(n_rows - len(mask), dtype=bool)])
+        return mask[:n_rows]
+
+    def _search(self, query_vector: np.ndarray, top_k: int, mask: np.ndarray = None) -> List[Tuple[int, float]]:
+        """Top-k (row, similarity) pairs, best first, among the rows where `mask` is set"""
+        rows = None
+        if mask is not None:
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return []
+        # Rows are unit-norm, so the dot product is the cosine similarity
+        if rows is not None and len(rows) < len(self.embeddings) // 4:
+            # Selective filter: gather and score only the matching rows
+            similarities = self.embeddings[rows] @ query_vector
+        else:
+            similarities = self.embeddings @ query_vector
+            if rows is not None:
+                similarities[~mask] = -np.inf
+                rows = None
+        similarities = np.nan_to_num(similarities, nan=0.0, posinf=0.0, neginf=-np.inf)
+
+        top_k = min(top_k, len(similarities) if mask is None else int(mask.sum()))
+        top = np.argpartition(-similarities, top_k - 1)[:top_k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        ids = rows[top] if rows is not None else top
+
+        return [(int(idx), float(similarities[pos])) for idx, pos in zip(ids, top)]
+
+_caches: Dict[str, EmbeddingCache] = {}
+
+def get_embedding_cache(cache_dir: str, dim: int = DEFAULT_DIM, max_rows: int = DEFAULT_MAX_ROWS) -> EmbeddingCache:
+    """Process-wide embedding cache for this embedder version"""
+    version = f"{EMBEDDER_VERSION}-d{dim}"
+    key = os.path.join(cache_dir, version)
+    if key not in _caches:
+        _caches[key] = EmbeddingCache(cache_dir, version, dim, max_rows=max_rows)
+    return _caches[key]
+
+def build_index(chunks: List[Any], metadata: List[Dict[str, Any]] = None, cache: EmbeddingCache = None):
     """Build index function for compatibility"""
-    embedder = SimpleEmbedder()
+    embedder = SimpleEmbedder(cache=cache)
     embedder.build_index(chunks, metadata)
     return embedder
 
-def retrieve(index, chunks: List[Any], metadata: List[Dict[str, Any]], query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+def retrieve(index, chunks: List[Any], metadata: List[Dict[str, Any]], query: str, top_k: int = 5,
+             filters: Filter = None) -> List[Dict[str, Any]]:
     """Retrieve function for compatibility"""
     if hasattr(index, 'retrieve'):
-        return index.retrieve(query, top_k)
+        return index.retrieve(query, top_k, filters) if filters is not None else index.retrieve(query, top_k)
     else:
         # Fallback to simple text matching
         results = []
         query_lower = query.lower()
-        
+
         for i, chunk in enumerate(chunks):
             if isinstance(chunk, str):
                 text = chunk.lower()
             else:
                 text = chunk.get('text', '').lower()
-            
+
             if any(word in text for word in query_lower.split()):
                 if isinstance(chunk, str):
                     result = {
@@ -132,5 +344,5 @@ def retrieve(index, chunks: List[Any], metadata: List[Dict[str, Any]], query: st
                     result['clause_id'] = f"chunk_{i}"
                     result['source'] = chunk.get('source', 'document')
                 results.append(result)
-        
-        return results[:top_k] 
\ No newline at end of file
+
+        return results[:top_k]
@@ -1,25 +1,93 @@
 """
 Simplified logic service for testing without API dependencies
+
+All keyword lists are compiled into one word-bounded regex, so each chunk is
+scanned once and every hit comes back with its category and character span
+for evidence highlighting.
 """
-from typing import List, Dict
+import re
+from typing import List, Dict, Optional, Tuple
+
+# Negated phrases are listed as exclusions, so "not covered" never counts as coverage
+KEYWORDS = {
+    "coverage": ["cover", "covers", "covered", "coverage", "include", "includes", "included", "including"],
+    "exclusion": ["exclude", "excludes", "excluded", "exclusion", "exclusions",
+                  "not covered", "not include", "not included", "not payable"],
+    "condition": ["if", "when", "provided", "provided that", "subject to", "condition", "conditions", "conditional"],
+}
+
+def _compile(keywords: Dict[str, List[str]]) -> Tuple[re.Pattern, Dict[str, str]]:
+    category_of = {term: category for category, terms in keywords.items() for term in terms}
+    # Longest first so multi-word phrases win over their single-word prefixes
+    alternation = "|".join(re.escape(term).replace(r"\ ", r"\s+") for term in sorted(category_of, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE), category_of
+
+_PATTERN, _CATEGORY_OF = _compile(KEYWORDS)
+_WHITESPACE = re.compile(r"\s+")
+
+def scan(text: str) -> List[Dict]:
+    """All keyword hits in one pass: [{"category", "term", "start", "end"}]"""
+    matches = []
+    for match in _PATTERN.finditer(text):
+        term = _WHITESPACE.sub(" ", match.group().lower())
+        matches.append({"category": _CATEGORY_OF[term], "term": term, "start": match.start(), "end": match.end()})
+    return matches
+
+# Negations the fixed phrases above miss: "will not be covered", "no coverage", "never included"
+_NEGATION = re.compile(r"\b(?:not|no|never|nor|neither|cannot|without|none)\b|n't\b", re.IGNORECASE)
+_WORD = re.compile(r"\S+")
+# How many words before a coverage or exclusion cue a negation may sit and still govern it
+NEGATION_WINDOW = 3
+
+def resolve_negations(text: str, matches: List[Dict]) -> Optional[List[Dict]]:
+    """Coverage and exclusion hits with the category flipped where a preceding negation governs them.
+
+    Returns None when the text has a negation that governs no cue ("covered without ...", "no claim
+    unless ..."): its meaning is not something the keyword scanner can decide.
+    """
+    negations = [(m.start(), m.end()) for m in _NEGATION.finditer(text)]
+    decisive = [m for m in matches if m["category"] in ("coverage", "exclusion")]
+    used = set()
+    resolved = []
+    previous_end = 0
+    for match in decisive:
+        # Negations inside the hit itself ("not covered") are already part of its category
+        inside = {n for n in negations if match["start"] <= n[0] < match["end"]}
+        window_start = previous_end
+        words = list(_WORD.finditer(text, previous_end, match["start"]))
+        if len(words) > NEGATION_WINDOW:
+            window_start = words[-NEGATION_WINDOW].start()
+        governing = {n for n in negations if window_start <= n[0] < match["start"]} - used
+        used |= inside | governing
+        category = match["category"]
+        if governing:
+            category = "exclusion" if category == "coverage" else "coverage"
+        resolved.append(dict(match, category=category, negated=bool(governing)))
+        previous_end = match["end"]
+    if len(used) != len(negations):
+        return None
+    return resolved
+
+def _scan_chunks(retrieved_chunks: List[dict], cache: Dict = None) -> List[Dict]:
+    results = []
+    for chunk in retrieved_chunks:
+        text = chunk.get('text', '')
+        key = (chunk.get('clause_id'), text)
+        if cache is not None and key in cache:
+            matches = cache[key]
+        else:
+            matches = scan(text)
+            if cache is not None:
+                cache[key] = matches
+        results.append({"clause_id": chunk.get('clause_id'), "matches": matches})
+    return results
+
+def _decide(query: str, retrieved_chunks: List[dict], chunk_matches: List[Dict]) -> Dict:
+    categories = {m["category"] for chunk in chunk_matches for m in chunk["matches"]}
+    has_coverage = "coverage" in categories
+    has_exclusions = "exclusion" in categories
+    has_conditions = "condition" in categories
 
-def evaluate(query: str, retrieved_chunks: List[dict]) -> Dict:
-    """Simplified evaluation function for testing"""
-    
-    # Simple keyword-based analysis
-    query_lower = query.lower()
-    chunks_text = " ".join([chunk.get('text', '') for chunk in retrieved_chunks]).lower()
-    
-    # Basic keyword matching
-    coverage_keywords = ['cover', 'covered', 'coverage', 'include', 'included']
-    exclusion_keywords = ['exclude', 'excluded', 'not covered', 'not include']
-    condition_keywords = ['if', 'when', 'provided', 'subject to', 'condition']
-    
-    # Determine status based on keywords
-    has_coverage = any(keyword in chunks_text for keyword in coverage_keywords)
-    has_exclusions = any(keyword in chunks_text for keyword in exclusion_keywords)
-    has_conditions = any(keyword in chunks_text for keyword in condition_keywords)
-    
     # Generate response
     if has_coverage and not has_exclusions:
         status = "covered"
@@ -33,14 +101,14 @@ def evaluate(query: str, retrieved_chunks: List[dict]) -> Dict:
     else:
         status = "unclear"
         answer = f"The coverage status for {query.lower()} is unclear based on the available information."
-    
+
     # Generate conditions
     conditions = []
     if has_conditions:
         conditions.append("Specific conditions may apply")
     if has_coverage:
         conditions.append("Coverage is subject to policy terms")
-    
+
     # Generate rationale
     rationale = f"Analysis of the document found {len(retrieved_chunks)} relevant sections. "
     if has_coverage:
@@ -49,12 +117,25 @@ def evaluate(query: str, retrieved_chunks: List[dict]) -> Dict:
         rationale += "However, there are specific conditions that must be met."
     if has_exclusions:
         rationale += "There are also exclusions that may limit coverage."
-    
+
     return {
         "answer": answer,
         "conditions": conditions,
         "decision_rationale": rationale,
         "confidence": 0.8 if retrieved_chunks else 0.5,
         "status": status,
-        "token_usage": len(query) + sum(len(chunk.get('text', '')) for chunk in retrieved_chunks)
-    } 
\ No newline at end of file
+        "token_usage": len(query) + sum(len(chunk.get('text', '')) for chunk in retrieved_chunks),
+        "matches": chunk_matches
+    }
+
+def evaluate(query: str, retrieved_chunks: List[dict]) -> Dict:
+    """Simplified evaluation function for testing"""
+    return _decide(query, retrieved_chunks, _scan_chunks(retrieved_chunks))
+
+def evaluate_batch(queries: List[str], retrieved_chunks_list: List[List[dict]]) -> List[Dict]:
+    """Evaluate many questions, scanning each distinct chunk only once across the batch"""
+    cache: Dict = {}
+    return [
+        _decide(query, retrieved_chunks, _scan_chunks(retrieved_chunks, cache))
+        for query, retrieved_chunks in zip(queries, retrieved_chunks_list)
+    ]
@@ -1,3 +1,18 @@
-# Placeholder for utility functions
-def placeholder():
-    pass
\ No newline at end of file
+"""Text helpers shared by the retrieval and decision services"""
+import re
+from typing import List
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are",
+    "was", "be", "by", "with", "what", "which", "does", "do", "this", "that",
+    "it", "as", "at", "under", "my", "i", "me", "if", "any", "how", "can",
+})
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric tokens"""
+    return _TOKEN_RE.findall(text.lower())
+
+def query_terms(query: str) -> List[str]:
+    """Tokens of a question without stopwords"""
+    return [t for t in tokenize(query) if t not in STOPWORDS]
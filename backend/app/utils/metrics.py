@@ -0,0 +1,64 @@
+"""
+In-process metrics: counters, gauges and latency windows.
+
+Everything is kept in memory per worker and exposed as a JSON snapshot by the
+/metrics/ endpoint.
+"""
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+import numpy as np
+
+LATENCY_WINDOW = 1024
+
+class Metrics:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._latencies: Dict[str, deque] = {}
+
+    def incr(self, name: str, value: float = 1.0) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Record one latency sample (in seconds) into a sliding window"""
+        with self._lock:
+            if name not in self._latencies:
+                self._latencies[name] = deque(maxlen=self._window)
+            self._latencies[name].append(seconds)
+
+    def percentile(self, name: str, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = list(self._latencies.get(name, ()))
+        if len(samples) < min_samples:
+            return None
+        return float(np.percentile(samples, q))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            latencies = {name: list(samples) for name, samples in self._latencies.items()}
+        summary = {}
+        for name, samples in latencies.items():
+            if not samples:
+                continue
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            summary[name] = {
+                "count": len(samples),
+                "p50_ms": round(float(p50) * 1000, 3),
+                "p95_ms": round(float(p95) * 1000, 3),
+                "p99_ms": round(float(p99) * 1000, 3),
+            }
+        return {"counters": counters, "gauges": gauges, "latency": summary}
+
+# Process-wide registry
+metrics = Metrics()
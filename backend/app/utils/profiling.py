@@ -0,0 +1,286 @@
+"""
+Per-request stage timings, slow-request logging and on-demand profiling.
+
+Every HTTP request gets a stage-timing dict in a context variable; code wraps
+its expensive steps in `with stage("retrieve"):` and the timings follow the
+request into threadpool workers. Requests slower than the threshold are logged
+with their stage breakdown.
+
+An admin can profile a single request by sending `X-Profile: sampling` or
+`X-Profile: deterministic` (or `?profile=...`) together with `X-Admin-Token`.
+Sampling mode records folded stacks ("a;b;c count", as consumed by
+flamegraph.pl and speedscope). Deterministic mode runs cProfile over the
+request's stages and keeps the pstats dump. Only one cProfile profiler can be
+active per process (on 3.12+ it is built on sys.monitoring), so a session owns
+a single profiler and a stage that cannot take it runs unprofiled instead of
+failing. The profile is stored under the ID returned in `X-Profile-Id`, in the
+memory of the worker that served the request. Requests without the flag only
+pay for the timing dict.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+logger = logging.getLogger("app.slow_requests")
+
+PROFILE_MODES = ("sampling", "deterministic")
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+_session: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+# Held while any session's profiler is enabled; cProfile cannot run twice in one process
+_profiler_lock = threading.Lock()
+
+def token_matches(expected: str, given: Optional[str]) -> bool:
+    """Constant-time admin token check; an unset token matches nothing"""
+    return bool(expected) and given is not None and hmac.compare_digest(given.encode(), expected.encode())
+
+@contextmanager
+def stage(name: str):
+    """Time a named stage of the current request (no-op outside a request)"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    session = _session.get()
+    if session is not None:
+        session.enter_thread()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+        if session is not None:
+            session.exit_thread()
+
+def record_stage(name: str, elapsed_ms: float) -> None:
+    """Add an externally measured duration (e.g. queueing delay) to the current request's stages"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed_ms
+
+def _folded_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class ProfileSession:
+    """Profiles the threads that work on one request"""
+
+    def __init__(self, mode: str, interval: float = 0.005):
+        self.mode = mode
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._threads: Dict[int, int] = {}  # thread id -> nesting depth
+        self._profiler = cProfile.Profile() if mode == "deterministic" else None
+        self._profiling_thread: Optional[int] = None
+        self._profiled = False
+        self._stats: Optional[pstats.Stats] = None
+        self.unprofiled_stages = 0
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.mode == "sampling":
+            # The event-loop thread is sampled too; deterministic mode only profiles stages
+            self.enter_thread()
+            self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        if self.mode == "sampling":
+            self.exit_thread()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self._profiled:
+            self._stats = pstats.Stats(self._profiler)
+
+    def _enable_profiler(self, tid: int) -> None:
+        """Run the session's profiler in this thread, unless it or another session's is already running"""
+        if self._profiling_thread is not None or not _profiler_lock.acquire(blocking=False):
+            self.unprofiled_stages += 1
+            return
+        try:
+            self._profiler.enable()
+        except ValueError:
+            # Another profiling tool (a debugger, coverage) owns the profiler slot
+            _profiler_lock.release()
+            self.unprofiled_stages += 1
+            return
+        self._profiling_thread = tid
+        self._profiled = True
+
+    def enter_thread(self) -> None:
+        tid = threading.get_ident()
+        with self._lock:
+            depth = self._threads.get(tid, 0)
+            self._threads[tid] = depth + 1
+            if depth == 0 and self._profiler is not None:
+                self._enable_profiler(tid)
+
+    def exit_thread(self) -> None:
+        tid = threading.get_ident()
+        with self._lock:
+            depth = self._threads.get(tid, 0) - 1
+            if depth > 0:
+                self._threads[tid] = depth
+                return
+            self._threads.pop(tid, None)
+            if self._profiling_thread == tid:
+                self._profiler.disable()
+                self._profiling_thread = None
+                _profiler_lock.release()
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                tids = [tid for tid in self._threads if tid != own]
+            frames = sys._current_frames()
+            for tid in tids:
+                frame = frames.get(tid)
+                if frame is not None:
+                    self.samples[_folded_stack(frame)] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def pstats_dump(self) -> Optional[bytes]:
+        if self._stats is None:
+            return None
+        return marshal.dumps(self._stats.stats)
+
+    def summary(self, limit: int = 40) -> str:
+        if self.mode == "sampling":
+            by_leaf = Counter()
+            for stack, count in self.samples.items():
+                by_leaf[stack.rsplit(";", 1)[-1]] += count
+            total = sum(by_leaf.values()) or 1
+            return "\n".join(f"{count / total:6.1%}  {leaf}" for leaf, count in by_leaf.most_common(limit))
+        if self._stats is None:
+            return ""
+        out = io.StringIO()
+        self._stats.stream = out
+        self._stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+class ProfileStore:
+    """Most recent profiles, bounded"""
+
+    def __init__(self, max_profiles: int = 50):
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def put(self, profile: Dict) -> None:
+        with self._lock:
+            self._profiles[profile["id"]] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [{k: v for k, v in p.items() if k not in ("folded", "pstats", "summary")}
+                    for p in reversed(self._profiles.values())]
+
+profile_store = ProfileStore()
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+class ProfilingMiddleware:
+    """ASGI middleware: stage timings and slow-request log for all requests, profiling on request"""
+
+    def __init__(self, app, admin_token: str = "", slow_request_ms: float = 1000.0,
+                 sample_interval_ms: float = 5.0):
+        self.app = app
+        self.admin_token = admin_token
+        self.slow_request_ms = slow_request_ms
+        self.sample_interval = sample_interval_ms / 1000.0
+
+    def _requested_mode(self, scope) -> Optional[str]:
+        mode = _header(scope, b"x-profile")
+        if mode is None and b"profile=" in scope.get("query_string", b""):
+            mode = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [None])[0]
+        if mode is None:
+            return None
+        if not token_matches(self.admin_token, _header(scope, b"x-admin-token")):
+            return None
+        return mode if mode in PROFILE_MODES else "sampling"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        timings_token = _timings.set(timings)
+        mode = self._requested_mode(scope)
+        session = session_token = profile_id = None
+        if mode is not None:
+            profile_id = uuid.uuid4().hex[:12]
+            session = ProfileSession(mode, self.sample_interval)
+            session_token = _session.set(session)
+            session.start()
+
+        status = {"code": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if profile_id is not None:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            if session is not None:
+                session.stop()
+                _session.reset(session_token)
+                profile_store.put({
+                    "id": profile_id,
+                    "mode": mode,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status["code"],
+                    "worker_pid": os.getpid(),
+                    "created": time.time(),
+                    "duration_ms": round(elapsed_ms, 3),
+                    "stages_ms": {k: round(v, 3) for k, v in timings.items()},
+                    "unprofiled_stages": session.unprofiled_stages,
+                    "folded": session.folded() if mode == "sampling" else None,
+                    "pstats": session.pstats_dump(),
+                    "summary": session.summary(),
+                })
+            _timings.reset(timings_token)
+            if elapsed_ms >= self.slow_request_ms:
+                logger.warning("Slow request %s %s status=%s %.1fms stages=%s", scope["method"], scope["path"],
+                               status["code"], elapsed_ms, {k: round(v, 1) for k, v in timings.items()})
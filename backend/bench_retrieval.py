@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality vs latency benchmark across backends and settings
+
+    python bench_retrieval.py                                  # synthetic policy corpus
+    python bench_retrieval.py --docs policy.pdf --labels qa.jsonl --json results.json
+
+Labels are JSONL: {"question": "...", "relevant_text": ["snippet of the clause"]}
+or {"question": "...", "relevant_ids": ["<chunk_id>"]}.
+"""
+
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+# Add the current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+TOPICS = [
+    ("maternity", "maternity expenses including delivery and pre-natal care", "Are maternity expenses covered?"),
+    ("dental", "dental treatment arising from an accidental injury", "Is dental treatment covered after an accident?"),
+    ("cataract", "cataract surgery up to the limit in the schedule", "What is the limit for cataract surgery?"),
+    ("ambulance", "road ambulance charges for emergency transfer", "Will the policy pay for an ambulance?"),
+    ("organ donor", "medical expenses of an organ donor for harvesting the organ", "Does it cover organ donor expenses?"),
+    ("ayush", "in-patient AYUSH treatment at a registered hospital", "Is ayurvedic hospital treatment covered?"),
+    ("room rent", "room rent capped at one percent of the sum insured per day", "Is there a cap on room rent?"),
+    ("pre-existing", "pre-existing diseases after a waiting period of thirty six months", "When are pre-existing diseases covered?"),
+    ("cosmetic", "cosmetic or plastic surgery unless needed after an accident", "Is cosmetic surgery excluded?"),
+    ("daycare", "day care procedures that need less than twenty four hours of hospitalisation", "Are day care procedures covered?"),
+    ("health check", "a preventive health check-up every two claim-free years", "Do I get a free health check-up?"),
+    ("grace period", "a grace period of thirty days for premium payment", "How long is the premium grace period?"),
+]
+
+FILLER = ("The insurer will settle claims subject to the terms, conditions and exclusions of this policy. "
+          "All amounts are payable in accordance with the schedule and the sum insured. ")
+
+def synthetic_corpus(sections: int = 40, seed: int = 7):
+    """Policy-like chunks with one answering clause per topic, plus near-miss and boilerplate chunks"""
+    rng = random.Random(seed)
+    chunks, metadata, labelled = [], [], []
+    for s in range(sections):
+        for name, clause, _ in TOPICS:
+            if s == 0:
+                text = f"Section {s}.{name}: The policy covers {clause}. " + FILLER
+            else:
+                # Near misses mention the topic without stating the benefit
+                text = f"Section {s}.{name}: Claims for {name} must be notified within {rng.randint(7, 60)} days. " + FILLER * rng.randint(1, 3)
+            metadata.append({"chunk_id": f"synthetic_{len(chunks)}", "file_path": "synthetic", "start_pos": 0})
+            chunks.append(text)
+    for name, clause, question in TOPICS:
+        labelled.append({"question": question, "relevant_text": [clause]})
+    return chunks, metadata, labelled
+
+def load_corpus(doc_paths, labels_path):
+    from app.services.pipeline import chunk_file
+    from app.services.evaluation import load_labelled_set
+
+    chunks, metadata = [], []
+    for path in doc_paths:
+        result = chunk_file(path)
+        if result["error"]:
+            print(f"⚠️ Warning: could not parse {path}: {result['error']}")
+        chunks.extend(result["chunks"])
+        metadata.extend(result["metadata"])
+    return chunks, metadata, load_labelled_set(labels_path)
+
+def main():
+    from app.services.evaluation import run_grid, default_configs, pareto_frontier
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", nargs="*", help="PDF/DOCX files to index")
+    parser.add_argument("--labels", help="JSONL of labelled questions (required with --docs)")
+    parser.add_argument("--k", type=int, nargs="*", default=[1, 3, 5, 10])
+    parser.add_argument("--dims", type=int, nargs="*", default=[256, 512, 1024])
+    parser.add_argument("--dtypes", nargs="*", default=["float32", "float16", "int8"])
+    parser.add_argument("--rerank", type=int, nargs="*", default=[0, 30], help="Re-rank candidate counts (0 = off)")
+    parser.add_argument("--json", help="Write the full results to this file")
+    args = parser.parse_args()
+
+    if args.docs:
+        if not args.labels:
+            parser.error("--labels is required with --docs")
+        chunks, metadata, labelled = load_corpus(args.docs, args.labels)
+    else:
+        chunks, metadata, labelled = synthetic_corpus()
+
+    report = run_grid(chunks, metadata, labelled, default_configs(args.dims, args.dtypes, args.rerank), ks=args.k)
+
+    print("🔎 Retrieval evaluation")
+    print("=" * 100)
+    print(f"{report['chunks']} chunks, {report['questions']} questions "
+          f"({report['unresolved_questions']} with no matching chunk skipped)")
+    print(f"{'config':<30}{'k':>4}{'recall':>9}{'mrr':>8}{'ndcg':>8}{'p50 ms':>9}{'p95 ms':>9}{'index KB':>11}")
+    for row in report["results"]:
+        print(f"{row['config']:<30}{row['k']:>4}{row['recall']:>9.3f}{row['mrr']:>8.3f}{row['ndcg']:>8.3f}"
+              f"{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}{row['memory_bytes'] / 1024:>11.1f}")
+
+    print("\n📈 Pareto frontier per k (nDCG vs p95 latency and index memory)")
+    for row in pareto_frontier(report["results"]):
+        print(f"  {row['config']:<30} k={row['k']:<3} ndcg={row['ndcg']:.3f} p95={row['p95_ms']:.3f} ms "
+              f"index={row['memory_bytes'] / 1024:.1f} KB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -89,5 +89,892 @@ def test_services():
         traceback.print_exc()
         return False
 
+def test_evidence_modes():
+    """Evidence text is trimmed according to the requested mode"""
+    from app.services.output import render_result, make_snippet, QueryResult
+
+    text = "General conditions apply. " * 20 + "Knee surgery is covered after a waiting period. " + "Legal notice. " * 20
+    retrieved = [{"clause_id": "doc_0", "text": text, "similarity_score": 0.5, "source": "doc.pdf"}]
+    decision = {"answer": "Yes", "status": "covered"}
+
+    full = render_result(decision, retrieved, "Is knee surgery covered?", "full")
+    assert full["evidence"][0]["text"] == text
+
+    snippet = render_result(decision, retrieved, "Is knee surgery covered?", "snippet")
+    assert "Knee surgery is covered" in snippet["evidence"][0]["text"]
+    assert len(snippet["evidence"][0]["text"]) < len(text)
+
+    ids_only = render_result(decision, retrieved, "Is knee surgery covered?", "ids_only")
+    assert "text" not in ids_only["evidence"][0]
+    assert ids_only["evidence"][0]["clause_id"] == "doc_0"
+
+    # Loosely typed model output still renders to a valid QueryResult
+    messy = {"answer": "Yes", "confidence": "0.75", "conditions": "Waiting period: 2 years", "token_usage": "12"}
+    rendered = render_result(messy, retrieved, "Is knee surgery covered?", "ids_only")
+    validated = QueryResult(**rendered)
+    assert (rendered["confidence"], rendered["conditions"], rendered["token_usage"]) == (0.75, ["Waiting period: 2 years"], 12)
+    assert (validated.confidence, validated.conditions, validated.token_usage) == (0.75, rendered["conditions"], 12)
+    rendered = render_result({"confidence": None, "conditions": [{"limit": 5}, None]}, retrieved, "q", "ids_only")
+    assert QueryResult(**rendered).confidence == 0.0 and rendered["conditions"] == ['{"limit": 5}']
+
+    assert make_snippet("short text", "anything") == "short text"
+
+def test_rerank():
+    """Re-ranker promotes the candidate with the query phrase and respects its budget"""
+    from app.services.reranker import rerank
+
+    candidates = [
+        {"clause_id": "a", "text": "Legal notices and general definitions.", "similarity_score": 0.9},
+        {"clause_id": "b", "text": "Surgery of the knee may require approval.", "similarity_score": 0.5},
+        {"clause_id": "c", "text": "Knee surgery is covered after 24 months.", "similarity_score": 0.4},
+    ]
+    ranked, info = rerank("Is knee surgery covered?", candidates, k=2)
+    assert info["reranked"]
+    assert ranked[0]["clause_id"] == "c"
+
+    ranked, info = rerank("Is knee surgery covered?", candidates, k=2, budget_ms=0.0)
+    assert not info["reranked"]
+    assert [c["clause_id"] for c in ranked] == ["a", "b"]
+
+    # A NaN first-stage score is treated as zero instead of poisoning every feature column
+    with_nan = [dict(candidates[0], similarity_score=float("nan"))] + candidates[1:]
+    ranked, info = rerank("Is knee surgery covered?", with_nan, k=3)
+    assert info["reranked"] and ranked[0]["clause_id"] == "c" and ranked[-1]["clause_id"] == "a"
+
+    # Proximity and phrase features over several candidates match their definitions
+    from app.services.reranker import _Encoded, _phrase_hits, _proximity
+    docs = [["knee", "x", "x", "surgery"], ["surgery", "knee", "knee", "surgery"], ["knee"], []]
+    encoded = _Encoded(docs, ["knee", "surgery"])
+    assert _proximity(encoded).tolist() == [0.5, 1.0, 1.0, 0.0]
+    assert _phrase_hits(encoded, ["knee", "surgery"]).tolist() == [0.0, 1.0, 0.0, 0.0]
+
+def test_hash_embedder():
+    """Feature-hashing embeddings rank by shared terms and support incremental adds"""
+    import numpy as np
+    from app.services.simple_embedder import SimpleEmbedder
+
+    embedder = SimpleEmbedder(dim=256)
+    embedder.build_index([
+        "Knee surgery is covered after a waiting period.",
+        "Cosmetic procedures are excluded.",
+        "",
+    ])
+    assert embedder.embeddings.shape == (3, 256)
+    assert np.allclose(np.linalg.norm(embedder.embeddings[:2], axis=1), 1.0, atol=1e-5)
+    assert embedder.retrieve("is knee surgery covered", 1)[0]["clause_id"] == "chunk_0"
+
+    before = embedder.embeddings.copy()
+    embedder.add(["Dental treatment is covered."])
+    assert np.array_equal(embedder.embeddings[:3], before)
+    assert embedder.retrieve("dental treatment", 1)[0]["clause_id"] == "chunk_3"
+
+    # A shared hasher that keeps resetting still gives every thread the serial vectors
+    from concurrent.futures import ThreadPoolExecutor
+    from app.services.simple_embedder import FeatureHasher, hash_embed
+    texts = [f"clause {i} covers treatment code t{i} and rider r{i * 7}" for i in range(200)]
+    expected = hash_embed(texts, 64, FeatureHasher())
+    shared = FeatureHasher(max_tokens=50)
+    with ThreadPoolExecutor(8) as pool:
+        starts = list(range(0, 200, 20)) * 4
+        results = list(pool.map(lambda i: hash_embed(texts[i:i + 20], 64, shared), starts))
+    assert all(np.allclose(result, expected[i:i + 20]) for i, result in zip(starts, results))
+
+def test_embedding_cache():
+    """Second build of the same chunks is served entirely from the cache"""
+    import tempfile
+    import numpy as np
+    from app.services.simple_embedder import SimpleEmbedder
+    from app.services.embedding_cache import EmbeddingCache
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        chunks = ["Knee surgery is covered.", "Cosmetic procedures are excluded.", "Knee surgery is covered."]
+        first = SimpleEmbedder(dim=64, cache=EmbeddingCache(cache_dir, "test", 64))
+        first.build_index(chunks)
+        assert first.last_build_stats["cache_hits"] == 0
+        assert first.last_build_stats["embedded"] == 2
+
+        # A fresh cache object reads the files written by the first one
+        second = SimpleEmbedder(dim=64, cache=EmbeddingCache(cache_dir, "test", 64))
+        second.build_index(chunks + ["Dental care is covered."])
+        assert second.last_build_stats["cache_hits"] == 3
+        assert second.last_build_stats["embedded"] == 1
+        assert np.allclose(second.embeddings[:3], first.embeddings)
+
+        # A writer that died after appending vectors but before keys must not shift later rows
+        cache = EmbeddingCache(cache_dir, "test", 64)
+        with open(cache.vectors_path, "ab") as f:
+            f.write(np.ones((2, 64), dtype=np.float32).tobytes())
+        third = SimpleEmbedder(dim=64, cache=cache)
+        third.build_index(["Ambulance charges are covered."])
+        fresh = SimpleEmbedder(dim=64, cache=EmbeddingCache(cache_dir, "test", 64))
+        fresh.build_index(["Ambulance charges are covered.", "Knee surgery is covered."])
+        assert fresh.last_build_stats["cache_hits"] == 2
+        assert np.allclose(fresh.embeddings[0], third.embeddings[0])
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Past max_rows the oldest rows are compacted away and the rest stay correctly keyed
+        cache = EmbeddingCache(cache_dir, "test", 16, max_rows=10)
+        texts = [f"clause {i}" for i in range(25)]
+        embedder = SimpleEmbedder(dim=16, cache=cache)
+        for i in range(0, 25, 3):
+            embedder.add(texts[i:i + 3])
+        assert len(cache) <= 10
+        reader = SimpleEmbedder(dim=16, cache=EmbeddingCache(cache_dir, "test", 16, max_rows=10))
+        reader.build_index(texts[-3:])
+        assert reader.last_build_stats["cache_hits"] == 3
+        assert np.allclose(reader.embeddings, embedder.embeddings[-3:])
+
+def test_resilient_caller():
+    """Retries recover transient errors; repeated failures open the breaker"""
+    import time
+    from app.services.resilience import ResilientCaller, CircuitBreaker, CircuitOpenError
+
+    attempts = []
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 2:
+            raise ConnectionError("transient")
+        return "ok"
+    caller = ResilientCaller("test_flaky", timeout=1.0, max_retries=2, backoff_base=0.001)
+    assert caller.call(flaky) == "ok"
+    assert len(attempts) == 2
+
+    def slow(timeout):
+        time.sleep(0.2)
+        return "late"
+    breaker = CircuitBreaker("test_slow", failure_threshold=1, reset_timeout=60)
+    caller = ResilientCaller("test_slow", timeout=0.05, max_retries=1, backoff_base=0.001, breaker=breaker)
+    try:
+        caller.call(slow)
+        assert False, "expected a timeout"
+    except TimeoutError:
+        pass
+    assert breaker.state == CircuitBreaker.OPEN
+    try:
+        caller.call(slow)
+        assert False, "expected the breaker to short-circuit"
+    except CircuitOpenError:
+        pass
+
+    class HTTPError(Exception):
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def failing(status):
+        calls = []
+        def fn(timeout):
+            calls.append(timeout)
+            raise HTTPError(status)
+        return calls, fn
+
+    # 4xx errors are not retried and do not count against the upstream; 5xx and 429 are retried
+    breaker = CircuitBreaker("test_status", failure_threshold=2, reset_timeout=60)
+    caller = ResilientCaller("test_status", timeout=1.0, max_retries=2, backoff_base=0.001, breaker=breaker)
+    for status, expected_attempts in ((400, 1), (503, 3), (429, 3)):
+        calls, fn = failing(status)
+        try:
+            caller.call(fn)
+            assert False, "expected the error"
+        except HTTPError:
+            pass
+        assert len(calls) == expected_attempts, status
+        # Two failed calls trip a threshold of 2, regardless of the three attempts in each
+        assert breaker.state == (CircuitBreaker.OPEN if status == 429 else CircuitBreaker.CLOSED)
+
+    # The overall deadline caps retries and backoff
+    calls, fn = failing(503)
+    caller = ResilientCaller("test_deadline", timeout=1.0, max_retries=50, backoff_base=0.05, backoff_max=0.05, deadline=0.2)
+    start = time.monotonic()
+    try:
+        caller.call(fn)
+    except HTTPError:
+        pass
+    assert time.monotonic() - start < 0.5 and len(calls) < 50
+
+    # A hedge that never started is cancelled once the attempt ends
+    from app.utils.metrics import metrics
+    for _ in range(20):
+        metrics.observe("test_hedge.latency", 0.01)
+    started = []
+    def stuck(timeout):
+        started.append(timeout)
+        time.sleep(0.2)
+        return "late"
+    caller = ResilientCaller("test_hedge", timeout=0.1, max_retries=0, hedge=True, max_workers=1)
+    try:
+        caller.call(stuck)
+    except TimeoutError:
+        pass
+    time.sleep(0.3)
+    assert len(started) == 1
+
+def test_shared_index():
+    """A second handle attaches to published generations read-only"""
+    import os
+    import tempfile
+    from app.services.simple_embedder import build_index
+    from app.services.shared_index import SharedIndex
+
+    with tempfile.TemporaryDirectory() as root:
+        writer, reader = SharedIndex(root), SharedIndex(root)
+        assert reader.current() is None
+
+        meta = [{"chunk_id": "p.pdf_0", "file_path": "p.pdf", "start_pos": 0},
+                {"chunk_id": "p.pdf_1", "file_path": "p.pdf", "start_pos": 40}]
+        assert writer.publish(build_index(["Knee surgery is covered.", "Dental care is excluded."], meta)) == 1
+        index = reader.current()
+        assert not index.embeddings.flags.writeable
+        assert index.retrieve("dental care", 1)[0]["clause_id"] == "p.pdf_1"
+
+        writer.publish(build_index(["Maternity benefits."]))
+        assert reader.current().generation == 2
+        assert list(reader.current().chunks) == ["Maternity benefits."]
+
+        # A reader that saw CURRENT just before newer publishes deleted that generation re-reads it and attaches
+        from app.services import shared_index
+        for text in ("Dental benefits.", "Vision benefits."):
+            writer.publish(build_index([text]))
+        assert not os.path.exists(os.path.join(root, "gen-2"))
+        read_generation = shared_index._read_generation
+        stale = iter([2])
+        shared_index._read_generation = lambda path: next(stale, None) or read_generation(path)
+        try:
+            late = SharedIndex(root)
+            assert late.current().generation == 4 and list(late.current().chunks) == ["Vision benefits."]
+        finally:
+            shared_index._read_generation = read_generation
+
+def test_streaming_ingest():
+    """Streaming chunker matches adaptive_chunk and the pipeline indexes in batches"""
+    import os
+    import tempfile
+    from docx import Document
+    from app.services.chunker import adaptive_chunk, stream_chunks
+    from app.services.pipeline import ingest_files
+    from app.services.simple_embedder import SimpleEmbedder
+
+    text = "\n\n".join(f"Clause {i}: benefit {i} is covered subject to limits." for i in range(300))
+    chunks, _ = adaptive_chunk([{"text": text, "file_path": "p.pdf"}], max_tokens=64)
+    streamed = list(stream_chunks([{"file_path": "p.pdf", "page": 1, "text": text}], max_tokens=64))
+    assert [c for c, _ in streamed] == chunks
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "policy.docx")
+        doc = Document()
+        for i in range(200):
+            doc.add_paragraph(f"Clause {i}: benefit {i} is covered subject to limits.")
+        doc.save(path)
+
+        index = SimpleEmbedder(dim=64)
+        stats = ingest_files([path, os.path.join(tmp, "missing.pdf")], index, batch_size=2, queue_batches=1)
+        assert stats["chunks"] == len(index.chunks) == len(index.embeddings) > 0
+        assert stats["batches"] >= 1
+        assert stats["errors"][0]["file_path"].endswith("missing.pdf")
+
+def test_parallel_ingest():
+    """Files parse in a process pool; one bad file fails alone, and batch uploads keep same-named files apart"""
+    import os
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    from docx import Document
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.services.pipeline import chunk_file, ingest_files_parallel
+    from app.services.simple_embedder import SimpleEmbedder
+    from app.routers import document
+
+    def policy(path, subject):
+        doc = Document()
+        for i in range(20):
+            doc.add_paragraph(f"Clause {i}: {subject} benefit {i} is covered subject to limits.")
+        doc.save(path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        good, broken = os.path.join(tmp, "good.docx"), os.path.join(tmp, "broken.docx")
+        policy(good, "dental")
+        with open(broken, "wb") as f:
+            f.write(b"not a zip file")
+
+        parsed = chunk_file(good, max_tokens=64)
+        assert parsed["error"] is None and parsed["chunks"] and len(parsed["chunks"]) == len(parsed["metadata"])
+        assert chunk_file(broken)["error"] and chunk_file(broken)["chunks"] == []
+
+        index = SimpleEmbedder(dim=64)
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as pool:
+            stats = ingest_files_parallel([good, broken], index, pool, batch_size=4, max_tokens=64)
+        assert [f["status"] for f in stats["files"]] == ["ok", "failed"]
+        assert stats["chunks"] == len(index.chunks) == stats["files"][0]["indexed_chunks"] > 0
+        assert stats["errors"][0]["file_path"] == broken
+
+        # A dead worker breaks the shared pool: its files fail, and the next upload gets fresh workers
+        from app.services import pipeline
+        dead = pipeline.get_parse_pool(1)
+        try:
+            dead.submit(os._exit, 1).result()
+        except Exception:
+            pass
+        stats = ingest_files_parallel([good], SimpleEmbedder(dim=64), max_tokens=64)
+        assert stats["files"][0]["status"] == "failed" and "worker died" in stats["files"][0]["error"]
+        fresh = pipeline.get_parse_pool(1)
+        try:
+            assert fresh is not dead
+            stats = ingest_files_parallel([good], SimpleEmbedder(dim=64), max_tokens=64)
+            assert stats["files"][0]["status"] == "ok"
+        finally:
+            pipeline.reset_parse_pool(fresh)
+
+        saved = (document.UPLOAD_DIR, document.EMBEDDING_CACHE_DIR, document.DEDUP_ENABLED)
+        document.UPLOAD_DIR, document.EMBEDDING_CACHE_DIR, document.DEDUP_ENABLED = os.path.join(tmp, "uploads"), None, False
+        try:
+            app = FastAPI()
+            app.include_router(document.router)
+            client = TestClient(app)
+            uploads = []
+            for subject in ("maternity", "cataract"):
+                policy(good, subject)
+                with open(good, "rb") as f:
+                    uploads.append(("files", ("policy.docx", f.read())))
+            response = client.post("/upload/batch/", files=uploads + [
+                ("files", ("broken.docx", b"not a zip file")),
+                ("files", ("notes.txt", b"plain text")),
+            ])
+            body = response.json()
+            assert response.status_code == 200 and body["files_processed"] == 2 and body["files_failed"] == 2
+            assert len({f["file_path"] for f in body["files"]}) == 4
+            assert all("indexed_chunks" in f for f in body["files"])
+            texts = " ".join(chunk if isinstance(chunk, str) else chunk["text"] for chunk in document.chunks)
+            assert "maternity" in texts and "cataract" in texts
+        finally:
+            document.UPLOAD_DIR, document.EMBEDDING_CACHE_DIR, document.DEDUP_ENABLED = saved
+
+def test_docx_tables():
+    """Streaming DOCX extraction keeps tables and heading hints in document order"""
+    import os
+    import tempfile
+    from docx import Document
+    from app.services.parser import iter_docx_blocks, extract_text_from_docx
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "schedule.docx")
+        doc = Document()
+        doc.add_heading("Schedule of Benefits", level=1)
+        table = doc.add_table(rows=2, cols=2)
+        table.cell(0, 0).text, table.cell(0, 1).text = "Benefit", "Limit"
+        table.cell(1, 0).text, table.cell(1, 1).text = "Dental", "Rs 10,000"
+        doc.add_paragraph("Limits apply per policy year.")
+        doc.save(path)
+
+        blocks = list(iter_docx_blocks(path))
+        assert [b["type"] for b in blocks] == ["paragraph", "table_row", "table_row", "paragraph"]
+        assert blocks[0]["heading_level"] == 1
+        assert blocks[2]["text"] == "Dental | Rs 10,000"
+        assert "Dental | Rs 10,000" in extract_text_from_docx(path)
+
+        # Heading hints become the section of every chunk beneath them, and chunks never span two sections
+        doc = Document()
+        doc.add_heading("Benefits", level=1)
+        doc.add_paragraph("Maternity expenses are covered.")
+        doc.add_heading("Exclusions", level=1)
+        doc.add_paragraph("Cosmetic surgery is excluded.")
+        sectioned = os.path.join(tmp, "sectioned.docx")
+        doc.save(sectioned)
+        from app.services.parser import iter_pages
+        from app.services.chunker import stream_chunks
+        from app.services.metadata_store import MetadataStore, parse_filters
+        chunks = list(stream_chunks(iter_pages(sectioned)))
+        assert [(meta["section"], text.splitlines()[-1]) for text, meta in chunks] == [
+            ("Benefits", "Maternity expenses are covered."), ("Exclusions", "Cosmetic surgery is excluded.")]
+        store = MetadataStore.from_dicts([meta for _, meta in chunks])
+        assert parse_filters({"section": ["Exclusions"]}).mask(store).tolist() == [False, True]
+        assert [meta["page"] for _, meta in chunks] == [None, None]
+        doc = Document()
+        for i in range(120):
+            doc.add_paragraph(f"Clause {i}.")
+        long_path = os.path.join(tmp, "long.docx")
+        doc.save(long_path)
+        units = list(iter_pages(long_path))
+        assert len(units) == 3 and {unit["page"] for unit in units} == {None}
+
+        # Text boxes nest paragraphs inside a run; their mc:Fallback copy is skipped, and a page break
+        # comes after the text of the paragraph that contains it
+        import zipfile
+        w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+        mc = 'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+        box = '<w:p><w:r><w:t>Boxed note.</w:t></w:r></w:p>'
+        xml = (f'<w:document {w} {mc}><w:body>'
+               '<w:p><w:r><w:t>Before box, </w:t></w:r>'
+               f'<w:r><mc:AlternateContent><mc:Choice><w:txbxContent>{box}</w:txbxContent></mc:Choice>'
+               f'<mc:Fallback><w:txbxContent>{box}</w:txbxContent></mc:Fallback></mc:AlternateContent></w:r>'
+               '<w:r><w:t>after box.</w:t><w:br w:type="page"/><w:t>Same paragraph.</w:t></w:r></w:p>'
+               '<w:p><w:r><w:t>Next page.</w:t></w:r></w:p>'
+               '</w:body></w:document>')
+        boxed = os.path.join(tmp, "boxed.docx")
+        with zipfile.ZipFile(boxed, "w") as archive:
+            archive.writestr("word/document.xml", xml)
+        assert [(b["type"], b["text"]) for b in iter_docx_blocks(boxed)] == [
+            ("paragraph", "Boxed note."),
+            ("paragraph", "Before box, after box.\nSame paragraph."),
+            ("page_break", ""),
+            ("paragraph", "Next page."),
+        ]
+        # DOCX pages come from explicit breaks only; the fixed-size block units are not pages
+        assert [(p["page"], p["text"].split("\n")[-3]) for p in iter_pages(boxed)] == [
+            (1, "Same paragraph."), (2, "Next page.")]
+
+def test_keyword_scanner():
+    """Scanner respects word boundaries and negated phrases, and reports positions"""
+    from app.services.simple_logic import scan, evaluate, evaluate_batch
+
+    assert scan("Specified benefits for the gift shop") == []
+    text = "Cosmetic surgery is not covered. Dental care is covered subject to approval."
+    matches = scan(text)
+    assert [(m["category"], m["term"]) for m in matches] == [
+        ("exclusion", "not covered"), ("coverage", "covered"), ("condition", "subject to")]
+    assert text[matches[0]["start"]:matches[0]["end"]] == "not covered"
+
+    chunk = {"clause_id": "c1", "text": "Cosmetic surgery is not covered."}
+    assert evaluate("cosmetic surgery", [chunk])["status"] == "not_covered"
+    results = evaluate_batch(["cosmetic surgery", "dental"], [[chunk], [chunk, {"clause_id": "c2", "text": text}]])
+    assert [r["status"] for r in results] == ["not_covered", "conditional"]
+    assert results[1]["matches"][0]["clause_id"] == "c1"
+
+def test_near_duplicate_dedup():
+    """Repeated boilerplate collapses into one chunk with back-references"""
+    from app.services.dedup import dedup_chunks
+
+    boilerplate = ("General conditions: the insured must notify the insurer of any claim within thirty days "
+                   "and provide all documents reasonably requested by the insurer for assessment.")
+    chunks = [
+        boilerplate,
+        "Dental treatment is covered up to the annual limit shown in the schedule.",
+        boilerplate.replace("thirty", "30"),
+        boilerplate,
+    ]
+    metadata = [{"chunk_id": f"rider{i}.pdf_0", "file_path": f"rider{i}.pdf"} for i in range(4)]
+    kept, kept_meta, stats = dedup_chunks(chunks, metadata, threshold=0.7)
+
+    assert kept == chunks[:2]
+    assert [d["file_path"] for d in kept_meta[0]["duplicates"]] == ["rider2.pdf", "rider3.pdf"]
+    assert stats["duplicates_removed"] == 2
+    assert stats["shrinkage"] == 0.5
+
+    # Same wording with a different number is a different clause and is kept
+    from app.services.dedup import numeric_values
+    assert numeric_values("Rs 50,000 within thirty-six months") == numeric_values("Rs 50000 within 36 months")
+    variants = [boilerplate, boilerplate.replace("thirty", "sixty"), boilerplate.replace("thirty", "60")]
+    kept, kept_meta, stats = dedup_chunks(variants, metadata[:3], threshold=0.7)
+    assert kept == variants[:2] and [d["file_path"] for d in kept_meta[1]["duplicates"]] == ["rider2.pdf"]
+
+def test_sharded_index():
+    """Scatter-gather over shard processes returns the same top-k as one process"""
+    from app.services.simple_embedder import SimpleEmbedder
+    from app.services.sharded_index import ShardedIndex
+
+    from app.services.metadata_store import Field
+
+    docs = [f"Clause {i}: benefit {i % 7} covers procedure {i % 11} after {i % 5} months." for i in range(50)]
+    meta = [{"file_path": "p.pdf", "chunk_id": f"p.pdf_{i}", "page": i // 10} for i in range(50)]
+    single = SimpleEmbedder(dim=128)
+    single.build_index(docs, meta)
+    sharded = ShardedIndex(num_shards=3, dim=128)
+    try:
+        sharded.build_index(docs[:20], meta[:20])
+        sharded.add(docs[20:], meta[20:])
+        assert sum(sharded.shard_rows) == 50
+        assert max(sharded.shard_rows) - min(sharded.shard_rows) <= 1
+
+        for query in ("benefit 3 procedure 4", "after 2 months"):
+            for filters in (None, Field("page").between(1, 2)):
+                expected = [(r["clause_id"], round(r["similarity_score"], 5)) for r in single.retrieve(query, 5, filters)]
+                actual = [(r["clause_id"], round(r["similarity_score"], 5)) for r in sharded.retrieve(query, 5, filters)]
+                assert actual == expected
+
+        # Concurrent queries pipeline through the shards and each gets its own results
+        from concurrent.futures import ThreadPoolExecutor
+        queries = [f"benefit {i % 7} procedure {i % 11}" for i in range(40)]
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda q: [r["clause_id"] for r in sharded.retrieve(q, 3)], queries))
+        assert results == [[r["clause_id"] for r in single.retrieve(q, 3)] for q in queries]
+
+        # A retired index keeps serving the requests that pinned it, then stops its shards
+        assert sharded.pin()
+        sharded.retire()
+        assert not sharded.pin()
+        assert sharded.retrieve("after 3 months", 1, Field("page") == 4)
+        processes = list(sharded._processes)
+        sharded.unpin()
+        for process in processes:
+            process.join(timeout=5)
+        assert not any(process.is_alive() for process in processes)
+    finally:
+        sharded.close()
+
+def test_admission_control():
+    """Bounded queue sheds with 503, token bucket limits each client with 429"""
+    import asyncio
+    from app.services.admission import AdmissionController, Rejected
+
+    async def scenario():
+        controller = AdmissionController("test_admission", max_concurrency=1, max_queue=1,
+                                         rate_per_client=1.0, burst=2.0)
+        release = asyncio.Event()
+        statuses = []
+
+        async def request(client):
+            try:
+                async with controller.slot(client, deadline=5.0):
+                    await release.wait()
+                statuses.append(200)
+            except Rejected as rejected:
+                statuses.append(rejected.status_code)
+                assert rejected.retry_after >= 1
+
+        tasks = [asyncio.create_task(request(f"client{i}")) for i in range(3)]
+        await asyncio.sleep(0.05)
+        assert controller.in_flight == 1 and controller.waiting == 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert sorted(statuses) == [200, 200, 503]
+
+        statuses.clear()
+        for _ in range(3):
+            await request("greedy")
+        assert statuses == [200, 200, 429]
+
+        # A batch pays one token per question and cannot exceed the burst in one go
+        batch = AdmissionController("test_admission_batch", rate_per_client=1.0, burst=3.0)
+        async with batch.slot("c", deadline=5.0, cost=3):
+            pass
+        for cost in (1, 4):
+            try:
+                async with batch.slot("c", deadline=5.0, cost=cost):
+                    pass
+                raise AssertionError("batch was admitted")
+            except Rejected as rejected:
+                assert rejected.status_code == 429
+
+    asyncio.run(scenario())
+
+    # The rate-limit identity is the peer (or what a trusted proxy forwarded), never a client-chosen header
+    from starlette.requests import Request
+    from app.routers import document
+
+    def client_of(peer, headers):
+        scope = {"type": "http", "client": (peer, 1234),
+                 "headers": [(k.encode(), v.encode()) for k, v in headers.items()]}
+        return document._client_id(Request(scope))
+
+    assert client_of("10.0.0.5", {"x-client-id": "rotated", "x-forwarded-for": "6.6.6.6"}) == "10.0.0.5"
+    document.TRUSTED_PROXIES = {"10.0.0.1"}
+    try:
+        assert client_of("10.0.0.1", {"x-forwarded-for": "6.6.6.6, 203.0.113.7"}) == "203.0.113.7"
+    finally:
+        document.TRUSTED_PROXIES = set()
+
+def test_request_profiling():
+    """Profiles only admin-flagged requests and records stage timings across the threadpool"""
+    import marshal
+    import threading
+    import time
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from starlette.concurrency import run_in_threadpool
+    from app.utils.profiling import ProfilingMiddleware, profile_store, stage
+
+    def work():
+        with stage("retrieve"):
+            time.sleep(0.05)
+        return {"ok": True}
+
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, admin_token="secret", slow_request_ms=10_000, sample_interval_ms=1)
+
+    @app.get("/work")
+    async def endpoint():
+        return await run_in_threadpool(work)
+
+    client = TestClient(app)
+    assert "x-profile-id" not in client.get("/work").headers
+    assert "x-profile-id" not in client.get("/work", headers={"X-Profile": "sampling", "X-Admin-Token": "wrong"}).headers
+
+    response = client.get("/work?profile=sampling", headers={"X-Admin-Token": "secret"})
+    profile = profile_store.get(response.headers["x-profile-id"])
+    assert profile["stages_ms"]["retrieve"] >= 40
+    assert any(line.split(" ")[0].endswith("work") or ";work (" in line for line in profile["folded"].splitlines())
+
+    response = client.get("/work", headers={"X-Profile": "deterministic", "X-Admin-Token": "secret"})
+    profile = profile_store.get(response.headers["x-profile-id"])
+    assert any("time.sleep" in func[2] for func in marshal.loads(profile["pstats"]))
+    assert "time.sleep" in profile["summary"]
+
+    # Only one cProfile may run per process: a concurrent deterministic session skips its stage instead of failing
+    from app.utils.profiling import ProfileSession
+    first, second = ProfileSession("deterministic"), ProfileSession("deterministic")
+    first.enter_thread()
+    worker = threading.Thread(target=lambda: (second.enter_thread(), second.exit_thread()))
+    worker.start()
+    worker.join()
+    first.exit_thread()
+    first.stop()
+    second.stop()
+    assert first.unprofiled_stages == 0 and second.unprofiled_stages == 1 and second.pstats_dump() is None
+
+def test_retrieval_evaluation():
+    """Ranking metrics, grid evaluation across backends and the Pareto frontier"""
+    from app.services.evaluation import recall_at_k, reciprocal_rank, ndcg_at_k, run_grid, pareto_frontier
+
+    assert recall_at_k([3, 1, 2], {1, 9}, 2) == 0.5
+    assert reciprocal_rank([3, 1, 2], {1}, 3) == 0.5
+    assert ndcg_at_k([1, 3], {1}, 2) == 1.0 and 0 < ndcg_at_k([3, 1], {1}, 2) < 1.0
+
+    chunks = ["The policy covers maternity expenses and delivery charges.",
+              "Dental treatment is excluded unless caused by an accident.",
+              "Room rent is capped at one percent of the sum insured."]
+    metadata = [{"chunk_id": f"doc_{i}", "file_path": "doc"} for i in range(len(chunks))]
+    labelled = [{"question": "Are maternity expenses covered?", "relevant_ids": ["doc_0"]},
+                {"question": "Is dental treatment covered?", "relevant_text": ["dental treatment is excluded"]},
+                {"question": "Unanswerable", "relevant_text": ["no such clause"]}]
+    configs = [{"backend": "tfidf"}, {"backend": "hash", "dim": 256, "dtype": "int8"},
+               {"backend": "hash", "dim": 256, "dtype": "float32", "rerank_candidates": 3}]
+    report = run_grid(chunks, metadata, labelled, configs, ks=(1, 3), warmup=0)
+
+    assert report["questions"] == 2 and report["unresolved_questions"] == 1
+    assert len(report["results"]) == 6
+    assert all(row["recall"] == 1.0 for row in report["results"] if row["k"] == 3)
+    assert next(r for r in report["results"] if r.get("dtype") == "int8")["memory_bytes"] < 3 * 256 + 64
+    frontier = pareto_frontier(report["results"])
+    assert frontier and all(row in report["results"] for row in frontier)
+    # Each k has its own frontier; a k=3 row never knocks out a k=1 row
+    assert {row["k"] for row in frontier} == {1, 3}
+    rows = [{"k": 1, "ndcg": 0.5, "p95_ms": 1.0, "memory_bytes": 10}, {"k": 3, "ndcg": 0.9, "p95_ms": 1.0, "memory_bytes": 10}]
+    assert pareto_frontier(rows) == rows
+
+    # Blocked int8 scoring matches scoring the upcast matrix in one go
+    import numpy as np
+    from app.services import evaluation
+    retriever = evaluation.HashRetriever(chunks * 3, metadata * 3, dim=256, dtype="int8")
+    query = retriever.embedder.embed_batch(["maternity expenses"])[0]
+    block_rows, evaluation.INT8_BLOCK_ROWS = evaluation.INT8_BLOCK_ROWS, 2
+    try:
+        blocked = retriever._int8_scores(query)
+    finally:
+        evaluation.INT8_BLOCK_ROWS = block_rows
+    assert np.allclose(blocked, (retriever.matrix.astype(np.float32) @ query) * retriever.scale, atol=1e-6)
+
+def test_query_cache():
+    """Repeated questions reuse the vector and top-k; adding chunks invalidates the results"""
+    from app.services.simple_embedder import SimpleEmbedder
+    from app.services.query_cache import LRUCache, query_vectors
+
+    lru = LRUCache("test_lru", max_size=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    lru.get("a")
+    lru.put("c", 3)
+    assert lru.get("b") is None and lru.get("a") == 1 and len(lru) == 2
+
+    index = SimpleEmbedder(dim=128)
+    index.build_index(["Maternity expenses are covered.", "Dental care is excluded."],
+                      [{"chunk_id": "c0"}, {"chunk_id": "c1"}])
+    first = index.retrieve("Is maternity covered?", top_k=1)
+    first[0]["similarity_score"] = -1.0
+    hits = index.result_cache.hits
+    vector_hits = query_vectors.hits
+    again = index.retrieve("is MATERNITY covered", top_k=1)
+    assert index.result_cache.hits == hits + 1
+    assert again[0]["clause_id"] == "c0" and again[0]["similarity_score"] > 0
+
+    index.add(["Maternity benefits are covered after nine months."], [{"chunk_id": "c2"}])
+    assert len(index.retrieve("Is maternity covered?", top_k=3)) == 3
+    assert index.result_cache.hits == hits + 1 and query_vectors.hits > vector_hits
+
+def test_metadata_filters():
+    """Columnar metadata round-trips to dicts and filters restrict retrieval"""
+    import tempfile
+    from app.services.metadata_store import MetadataStore, Field, parse_filters
+    from app.services.simple_embedder import SimpleEmbedder
+
+    metadata = [
+        {"file_path": "a.pdf", "chunk_id": "a.pdf_0", "start_pos": 0, "page": 1},
+        {"file_path": "a.pdf", "chunk_id": "a.pdf_1", "start_pos": 900, "page": 4, "section": "Exclusions"},
+        {"file_path": "b.docx", "chunk_id": "custom-id", "start_pos": 0, "page": None,
+         "duplicates": [{"chunk_id": "c.pdf_3", "file_path": "c.pdf", "page": 2}]},
+    ]
+    store = MetadataStore.from_dicts(metadata)
+    assert store[0] == metadata[0] and store[1] == metadata[1]
+    assert store[2]["chunk_id"] == "custom-id" and store[2]["duplicates"] == metadata[2]["duplicates"]
+    with tempfile.TemporaryDirectory() as tmp:
+        store.save(tmp)
+        assert list(MetadataStore.load(tmp)) == list(store)
+
+    assert (Field("file_path") == "a.pdf").mask(store).tolist() == [True, True, False]
+    assert ((Field("page") >= 2) | (Field("file_path") == "b.docx")).mask(store).tolist() == [False, True, True]
+    assert (~(Field("section") == "Exclusions")).mask(store).tolist() == [True, False, True]
+    assert parse_filters({"page": {"gte": 1, "lte": 3}}).mask(store).tolist() == [True, False, False]
+    assert parse_filters({"file_path": ["b.docx", "missing.pdf"]}).mask(store).tolist() == [False, False, True]
+    # A deduplicated row also answers for the sources listed in its back-references
+    assert (Field("file_path") == "c.pdf").mask(store).tolist() == [False, False, True]
+    assert parse_filters({"file_path": ["a.pdf", "c.pdf"]}).mask(store).tolist() == [True, True, True]
+    assert (~(Field("file_path") == "c.pdf")).mask(store).tolist() == [True, True, False]
+    # Operands of the wrong type are rejected up front (the router turns ValueError into a 400)
+    for spec in ({"page": "3"}, {"page": ["x"]}, {"page": {"gte": [1]}}, {"page": True}, {"file_path": 3},
+                 {"section": {"in": "Exclusions"}}):
+        try:
+            parse_filters(spec)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{spec} should be rejected")
+
+    index = SimpleEmbedder(dim=128)
+    index.build_index(["Maternity expenses are covered.", "Maternity is excluded in year one.", "Dental care."], metadata)
+    assert [r["clause_id"] for r in index.retrieve("maternity", top_k=3, filters=Field("page") >= 4)] == ["a.pdf_1"]
+    assert index.retrieve("maternity", top_k=3, filters=Field("file_path") == "nowhere.pdf") == []
+    assert [r["clause_id"] for r in index.retrieve("maternity", top_k=3, filters=Field("file_path") == "c.pdf")] \
+        == ["custom-id"]
+    assert len(index.retrieve("maternity", top_k=3)) == 3
+
+def test_local_and_routing_evaluators():
+    """Local classifier decides on-topic evidence; routing escalates only ambiguous questions"""
+    from app.services.evaluators import LocalEvaluator, LLMEvaluator, RoutingEvaluator
+
+    chunks = [
+        {"clause_id": "c1", "similarity_score": 0.6,
+         "text": "Maternity expenses are covered up to Rs 50,000. Dental treatment is excluded."},
+        {"clause_id": "c2", "similarity_score": 0.4,
+         "text": "Cosmetic surgery is not covered. Cataract surgery is covered provided it is done after 2 years."},
+    ]
+    local = LocalEvaluator()
+    assert local.evaluate("Is maternity covered?", chunks)["status"] == "covered"
+    assert local.evaluate("Is dental treatment covered?", chunks)["status"] == "not_covered"
+    assert local.evaluate("Is cataract surgery covered?", chunks)["status"] == "conditional"
+    unclear = local.evaluate("Is skydiving covered?", chunks)
+    assert unclear["status"] == "unclear" and unclear["confidence"] < 0.5
+    # A question with no subject left after dropping generic terms cannot be decided locally
+    assert local.evaluate("Is it covered under the policy?", chunks)["status"] == "unclear"
+    assert '"Cosmetic surgery is not covered."' in local.evaluate("Is cosmetic surgery covered?", chunks)["answer"]
+
+    class StubLLM(LLMEvaluator):
+        def __init__(self, fail=False):
+            super().__init__()
+            self.fail = fail
+            self.calls = 0
+
+        def call(self, query, retrieved_chunks):
+            self.calls += 1
+            if self.fail:
+                raise TimeoutError("upstream timed out")
+            return {"answer": "llm", "conditions": [], "decision_rationale": "llm", "confidence": 0.9, "status": "covered"}
+
+    remote = StubLLM()
+    router = RoutingEvaluator(local, remote, threshold=0.75)
+    assert router.evaluate("Is maternity covered?", chunks)["answer"].startswith("Yes") and remote.calls == 0
+    assert router.evaluate("Is skydiving covered?", chunks)["answer"] == "llm" and remote.calls == 1
+
+    offline = RoutingEvaluator(local, StubLLM(fail=True)).evaluate("Is skydiving covered?", chunks)
+    assert offline["status"] == "unclear" and "LLM escalation failed" in offline["decision_rationale"]
+
+    # Negations outside the fixed "not covered" phrase never vote as coverage
+    for text in ("Maternity expenses will not be covered.", "There is no coverage for maternity."):
+        negated = [{"clause_id": "n1", "similarity_score": 0.6, "text": text}]
+        assert local.evaluate("Is maternity covered?", negated)["status"] == "not_covered"
+    # An unresolved negation leaves no decisive vote, so the router escalates instead of answering locally
+    unresolved = [{"clause_id": "n2", "similarity_score": 0.6, "text": "Maternity is covered without any exception."}]
+    assert local.evaluate("Is maternity covered?", unresolved)["confidence"] < 0.75
+    calls = remote.calls
+    assert router.evaluate("Is maternity covered?", unresolved)["answer"] == "llm" and remote.calls == calls + 1
+
+    from app.services.evaluators import Evaluator
+    try:
+        Evaluator()
+        raise AssertionError("Evaluator is abstract")
+    except TypeError:
+        pass
+
+def test_clause_facts():
+    """Templated questions are answered from facts extracted at ingest; anything ambiguous falls through"""
+    import tempfile
+    from app.services.simple_embedder import SimpleEmbedder
+    from app.services.shared_index import publish, attach
+    from app.services.metadata_store import Field
+
+    texts = [
+        "4.1 Maternity expenses are covered up to Rs 50,000, provided the insured has completed a waiting period of 9 months.",
+        "Cataract surgery is covered up to Rs. 40,000 per eye. Room rent is capped at 1% of the sum insured per day.",
+        "Exclusions: Cosmetic surgery is not covered.",
+        "A waiting period of thirty-six (36) months applies to pre-existing diseases.",
+    ]
+    metadata = [{"file_path": "a.pdf", "chunk_id": f"a.pdf_{i}"} for i in range(3)] + [{"file_path": "b.pdf", "chunk_id": "b.pdf_0"}]
+    index = SimpleEmbedder(dim=64)
+    index.build_index(texts, metadata)
+    facts = index.clause_facts
+
+    decision, supporting = facts.answer("What is the waiting period for maternity?")
+    assert decision["answer"] == "The waiting period for maternity is 9 months." and supporting[0]["row"] == 0
+    assert facts.answer("Is there a limit for cataract surgery?")[0]["conditions"] == ["Limit: Rs. 40,000"]
+    assert facts.answer("Is cosmetic surgery covered?")[0]["status"] == "not_covered"
+    assert facts.answer("Is maternity covered under the policy?")[0]["status"] == "conditional"
+    assert "36 months" in facts.answer("How long is the wait for pre-existing diseases?")[0]["answer"]
+    # A different subject, an unknown one, or a non-templated question needs the full pipeline
+    assert facts.answer("Is surgery covered?") is None
+    assert facts.answer("Is skydiving covered?") is None
+    assert facts.answer("How do I file a claim?") is None
+    # Filters restrict which clauses may answer
+    assert facts.answer("Waiting period for pre-existing diseases?", index.filter_mask(Field("file_path") == "a.pdf")) is None
+
+    # Time qualifiers make an exclusion conditional; a waiting-period sentence states no coverage of its own
+    qualified = SimpleEmbedder(dim=64)
+    qualified.build_index([
+        "Maternity expenses are not covered during the first 9 months.",
+        "The waiting period for pre-existing diseases is 36 months of continuous coverage.",
+    ])
+    decision = qualified.clause_facts.answer("Is maternity covered?")[0]
+    assert decision["status"] == "conditional" and decision["confidence"] < 0.9
+    assert qualified.clause_facts.answer("What is the waiting period for pre-existing diseases?")[0]["answer"] \
+        == "The waiting period for pre-existing diseases is 36 months."
+    assert all(f["type"] == "waiting_period" for f in qualified.clause_facts.facts[1:])
+    decision, evidence = qualified.answer_from_facts("Is maternity covered?")
+
+    # Negations outside the fixed "not covered" phrase, restrictions and contrasting clauses
+    def status(sentence, question):
+        index = SimpleEmbedder(dim=64)
+        index.build_index([sentence])
+        found = index.clause_facts.answer(question)
+        return found[0]["status"] if found else None
+
+    assert status("Maternity expenses will not be covered.", "Is maternity covered?") == "not_covered"
+    assert status("There is no coverage for maternity.", "Is maternity covered?") == "not_covered"
+    assert status("Maternity is covered only for female employees.", "Is maternity covered?") == "conditional"
+    contrast = "Hospitalisation for accidents is covered but dental treatment is excluded."
+    assert status(contrast, "Is hospitalisation for accidents covered?") == "covered"
+    assert status(contrast, "Is dental treatment covered?") == "not_covered"
+    # A negation that governs no cue makes the whole sentence untrustworthy
+    assert status("Dental treatment is covered without any waiting period.", "Is dental treatment covered?") is None
+    assert evidence[0]["text"].startswith("Maternity") and evidence[0]["similarity_score"] == 1.0
+
+    with tempfile.TemporaryDirectory() as root:
+        attached = attach(root, publish(index, root))
+        assert attached.clause_facts.answer("What is the limit on room rent?")[0]["answer"].endswith("1% of the sum insured.")
+
 if __name__ == "__main__":
-    test_services() 
\ No newline at end of file
+    test_services()
+    test_evidence_modes()
+    test_rerank()
+    test_hash_embedder()
+    test_embedding_cache()
+    test_resilient_caller()
+    test_shared_index()
+    test_streaming_ingest()
+    test_parallel_ingest()
+    test_docx_tables()
+    test_keyword_scanner()
+    test_near_duplicate_dedup()
+    test_sharded_index()
+    test_admission_control()
+    test_request_profiling()
+    test_retrieval_evaluation()
+    test_query_cache()
+    test_metadata_filters()
+    test_local_and_routing_evaluators()
+    test_clause_facts()